@@ -0,0 +1,97 @@
+# encoding: utf-8
+"""
+Measure the logging overhead per message.
+
+Each case logs the same per-message events as the consumer, one debug and one
+info record per message, to a file and reports the time spent in the logging
+calls per message:
+
+    disabled-fstring   debug disabled, message built with an f-string
+    disabled-lazy      debug disabled, %-style arguments
+    sync               records formatted and written by the calling thread
+    async              records handed to a QueueListener thread
+    async-rate-limited async with a RateLimitFilter on the logger
+
+usage: python -m benchmarks.logging_overhead [--messages N]
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import logging
+import logging.handlers
+import os
+import queue
+import tempfile
+import time
+
+from rabbit_indexer.utils.log_setup import LOG_FORMAT, AsyncQueueHandler, RateLimitFilter
+
+PATH = '/badc/cmip6/data/CMIP6/CMIP/MOHC/UKESM1-0-LL/historical/r1i1p1f2/Amon/tas/gn/latest/tas.nc'
+
+
+def run(logger: logging.Logger, messages: int, lazy: bool = True) -> float:
+    """
+    :return: nanoseconds per message spent in the logging calls
+    """
+    start = time.perf_counter_ns()
+    for tag in range(messages):
+        if lazy:
+            logger.debug('Acknowledging message: %s', tag)
+            logger.info('Processed %s %s', PATH, 'DEPOSIT')
+        else:
+            logger.debug(f'Acknowledging message: {tag}')
+            logger.info(f'Processed {PATH} DEPOSIT')
+    return (time.perf_counter_ns() - start) / messages
+
+
+def make_logger(name: str, handler: logging.Handler, level: int = logging.INFO) -> logging.Logger:
+    logger = logging.getLogger(f'benchmark.{name}')
+    logger.propagate = False
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    return logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_handler = logging.FileHandler(os.path.join(tmp_dir, 'benchmark.log'))
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        results = {}
+
+        disabled = make_logger('disabled', logging.NullHandler(), level=logging.WARNING)
+        results['disabled-fstring'] = run(disabled, args.messages, lazy=False)
+        results['disabled-lazy'] = run(disabled, args.messages)
+
+        results['sync'] = run(make_logger('sync', file_handler), args.messages)
+
+        limited = make_logger('limited', logging.NullHandler())
+        limited.addFilter(RateLimitFilter(rate=100, burst=100))
+
+        for name, logger in (('async', make_logger('async', logging.NullHandler())), ('async-rate-limited', limited)):
+            records = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(records, file_handler)
+            logger.handlers = [AsyncQueueHandler(records)]
+
+            listener.start()
+            results[name] = run(logger, args.messages)
+
+            # Time to drain the queue is not included in the async results
+            listener.stop()
+
+        file_handler.close()
+
+    for name, elapsed in results.items():
+        print(f'  {name:<24} {elapsed:>8.0f} ns/message')
+
+
+if __name__ == '__main__':
+    main()
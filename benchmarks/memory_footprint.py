@@ -0,0 +1,210 @@
+# encoding: utf-8
+"""
+Measure the memory footprint of PathTools, PathFilter and the consumer.
+
+Memory is measured with tracemalloc, which counts the Python allocations still
+held, and by sampling the resident set size of the process, which includes
+everything else. Three things are measured:
+
+    path_tools   PathTools construction from a synthetic MOLES mapping
+    path_filter  PathFilter with a large rule set
+    replay       Consumer memory while replaying messages for directories
+                 which are not in the mapping, sampled every chunk of messages.
+                 Memory should level off once the bounded caches are full.
+
+usage: python -m benchmarks.memory_footprint [--observations N [N ...]] [--rules N [N ...]] [--messages N]
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import gc
+import json
+import os
+import resource
+import tempfile
+import tracemalloc
+
+from benchmarks.moles_api_stub import MolesAPIStub
+from benchmarks.moles_mapping_memory import synthetic_observations
+from rabbit_indexer.index_updaters.base import UpdateHandler
+from rabbit_indexer.queue_handler import QueueHandler
+from rabbit_indexer.utils import PathFilter, PathTools, YamlConfig
+
+# Typing imports
+from typing import Callable, List, Tuple
+
+
+def rss_bytes() -> int:
+    """
+    :return: Current resident set size of the process. Falls back to the
+        peak where the current size is not available.
+    """
+    try:
+        with open('/proc/self/statm') as reader:
+            return int(reader.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # kB on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def traced(build: Callable[[], object]) -> Tuple[int, int]:
+    """
+    :return: Bytes allocated by build() which are still held afterwards and the change in RSS
+    """
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+
+    result = build()
+    gc.collect()
+
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss_bytes()
+
+    del result
+    return current, rss_after - rss_before
+
+
+def write_mapping_file(directory: str, count: int) -> str:
+    """
+    :return: Path to a mapping file with ``count`` synthetic observations
+    """
+    path = os.path.join(directory, f'mapping-{count}.json')
+    with open(path, 'w') as writer:
+        json.dump(synthetic_observations(count), writer)
+    return path
+
+
+def path_tools_footprint(mapping_file: str, compact: bool) -> Tuple[int, int]:
+    """
+    :return: Bytes held by PathTools once the mapping has loaded and the change in RSS
+    """
+
+    def build():
+        # Only the MOLES mapping is loaded, the spots need the network
+        path_tools = PathTools(mapping_file=mapping_file, compact_mapping=compact, deferred=True)
+        path_tools.moles_mapping
+        return path_tools
+
+    return traced(build)
+
+
+def path_filter_rules(count: int) -> List[str]:
+    return [f'/badc/project{i % 500}/data/instrument{i}/restricted' for i in range(count)]
+
+
+def path_filter_footprint(count: int) -> Tuple[int, int]:
+    """
+    :return: Bytes held by a PathFilter with ``count`` rules and the change in RSS
+    """
+    rules = path_filter_rules(count)
+    return traced(lambda: PathFilter(rules))
+
+
+class ReplayHandler(UpdateHandler):
+    """
+    Looks up the MOLES record for the directory of each message, as the
+    directory handler does
+    """
+
+    mapping_file = None
+
+    def _create_path_tools(self) -> PathTools:
+        api_cache = self.conf.get('moles', 'api_cache', default={})
+        return PathTools(
+            mapping_file=self.mapping_file,
+            deferred=True,
+            api_cache_size=api_cache.get('size', 10000),
+            api_url=self.conf.get('moles', 'api_url'),
+            api_batch=self.conf.get('moles', 'api_batch'),
+        )
+
+    def process_event(self, message):
+        self.pt.get_moles_record_metadata(os.path.dirname(message.filepath))
+
+
+class ReplayQueueHandler(QueueHandler):
+    HANDLER_CLASS = ReplayHandler
+
+
+def replay_footprint(mapping_file: str, messages: int, chunk: int = 1000, api_cache_size: int = 10000) -> List[Tuple[int, int, int]]:
+    """
+    Replay DEPOSIT messages for new directories through the consumer. The
+    MOLES API lookups are answered by a local stub.
+
+    :return: (messages, traced bytes, RSS) sampled after every chunk of messages
+    """
+
+    ReplayHandler.mapping_file = mapping_file
+
+    samples = []
+
+    def ack():
+        pass
+
+    with MolesAPIStub() as stub:
+        conf = YamlConfig()
+        conf.config = {
+            'rabbit_server': {'queues': []},
+            'indexer': {},
+            # Messages are replayed one at a time so there is nothing to wait for
+            'moles': {'api_url': stub.url, 'api_cache': {'size': api_cache_size}, 'api_batch': {'window': 0}},
+        }
+        consumer = ReplayQueueHandler(conf)
+
+        gc.collect()
+        tracemalloc.start()
+
+        for i in range(messages):
+            body = f'2021-02-08 12:00:00:/badc/project{i % 300}/data/new{i}/v1/file.nc:DEPOSIT:10:'.encode()
+            consumer.process_body(body, ack)
+
+            if (i + 1) % chunk == 0:
+                gc.collect()
+                samples.append((i + 1, tracemalloc.get_traced_memory()[0], rss_bytes()))
+
+        tracemalloc.stop()
+        consumer.queue_handler.close()
+
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--observations', nargs='+', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--rules', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--messages', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        print('PathTools construction')
+        print(f'  {"observations":>12} {"mapping":>10} {"traced MB":>10} {"RSS MB":>8}')
+        for count in args.observations:
+            mapping_file = write_mapping_file(tmp_dir, count)
+            for compact in (False, True):
+                current, rss = path_tools_footprint(mapping_file, compact)
+                print(f'  {count:>12} {"compact" if compact else "dict+tree":>10} {current / 2**20:>10.1f} {rss / 2**20:>8.1f}')
+            os.remove(mapping_file)
+
+        print('PathFilter')
+        print(f'  {"rules":>12} {"traced MB":>10} {"RSS MB":>8}')
+        for count in args.rules:
+            current, rss = path_filter_footprint(count)
+            print(f'  {count:>12} {current / 2**20:>10.1f} {rss / 2**20:>8.1f}')
+
+        print('Consumer replay')
+        print(f'  {"messages":>12} {"traced MB":>10} {"RSS MB":>8}')
+        mapping_file = write_mapping_file(tmp_dir, 10000)
+        chunk = max(args.messages // 10, 1)
+        for count, current, rss in replay_footprint(mapping_file, args.messages, chunk=chunk):
+            print(f'  {count:>12} {current / 2**20:>10.1f} {rss / 2**20:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# encoding: utf-8
+"""
+Compare MOLES API lookups for paths which are not in the mapping made with one
+request and connection each, as they used to be, with the MolesAPIBatcher.
+The lookups are made from several threads against a local stub of the API.
+Results are cached in both modes. Each path is asked for ``repeats`` times in
+a row, as the directories of a new dataset are, so the same path is often
+asked for again before the first lookup has finished.
+
+usage: python -m benchmarks.moles_api_lookups [--paths N] [--threads N] [--latency SECONDS] [--repeats N]
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.moles_api_stub import MolesAPIStub
+from rabbit_indexer.utils.moles_api import MolesAPIBatcher
+
+# Typing imports
+from typing import Callable, List
+
+
+def cached(lookup: Callable[[str], object]) -> Callable[[str], object]:
+    cache = {}
+
+    def cached_lookup(path):
+        if path not in cache:
+            cache[path] = lookup(path)
+        return cache[path]
+
+    return cached_lookup
+
+
+def run(lookup: Callable[[str], object], paths: List[str], threads: int) -> float:
+    """
+    :return: Seconds taken to look up all the paths
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lookup, paths))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--paths', type=int, default=2000, help='Number of distinct paths')
+    parser.add_argument('--threads', type=int, default=8, help='Threads making lookups')
+    parser.add_argument('--latency', type=float, default=0.002, help='Seconds taken by the stub to answer')
+    parser.add_argument('--repeats', type=int, default=2, help='Times each path is asked for, as by directories in the same dataset')
+    args = parser.parse_args()
+
+    paths = [f'/badc/project{i % 50}/data/new{i}' for i in range(args.paths) for _ in range(args.repeats)]
+
+    def unbatched(url):
+        def lookup(path):
+            response = requests.get(f'{url}{path}', timeout=10)
+            return response.json() if response else None
+        return lookup
+
+    print(f'{"mode":>10} {"seconds":>8} {"lookups/s":>10} {"requests":>9} {"connections":>12}')
+
+    for mode in ('unbatched', 'batched'):
+        with MolesAPIStub(latency=args.latency) as stub:
+            if mode == 'unbatched':
+                elapsed = run(cached(unbatched(stub.url)), paths, args.threads)
+            else:
+                batcher = MolesAPIBatcher(stub.url, concurrency=args.threads)
+                elapsed = run(cached(batcher.get), paths, args.threads)
+                batcher.close()
+
+            print(f'{mode:>10} {elapsed:>8.2f} {len(paths) / elapsed:>10.0f} {stub.requests:>9} {stub.connections:>12}')
+
+
+if __name__ == '__main__':
+    main()
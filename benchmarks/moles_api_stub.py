@@ -0,0 +1,125 @@
+# encoding: utf-8
+"""
+Local stand-in for the MOLES get_info API, used by the tests and benchmarks.
+
+    with MolesAPIStub(latency=0.002) as stub:
+        path_tools = PathTools(api_url=stub.url, ...)
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Typing imports
+from typing import Optional
+
+PREFIX = '/api/v0/obs/get_info'
+
+
+def stub_record(path: str) -> dict:
+    return {
+        'title': f'Observation for {path}',
+        'url': 'https://catalogue.ceda.ac.uk/uuid/0',
+        'record_type': 'Dataset',
+    }
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Keep the connections open so that connection reuse can be counted
+    protocol_version = 'HTTP/1.1'
+
+    # The headers and body are written separately
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+
+    def do_GET(self):
+        stub = self.server.stub
+
+        with stub.lock:
+            stub.requests += 1
+
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        path = self.path[len(PREFIX):] if self.path.startswith(PREFIX) else None
+        record = stub.lookup(path) if path else None
+
+        if stub.status is not None:
+            self.send_response(stub.status)
+            body = b'{}'
+        elif record is None:
+            self.send_response(404)
+            body = b'{}'
+        else:
+            self.send_response(200)
+            body = json.dumps(record).encode()
+
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MolesAPIStub:
+    """
+    HTTP server answering get_info requests on a free local port.
+    Counts the requests and connections it receives.
+
+    Parameters:
+        records: Records by path. If None, every path has a record.
+        latency: Seconds to wait before answering each request
+        status: If set, every request is answered with this status, e.g. to return errors
+    """
+
+    def __init__(self, records: Optional[dict] = None, latency: float = 0, status: Optional[int] = None):
+        self.records = records
+        self.latency = latency
+        self.status = status
+
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}{PREFIX}'
+
+    def lookup(self, path: str) -> Optional[dict]:
+        if self.records is None:
+            return stub_record(path)
+        return self.records.get(path)
+
+    def start(self) -> 'MolesAPIStub':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='moles-api-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
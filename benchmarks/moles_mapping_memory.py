@@ -0,0 +1,89 @@
+# encoding: utf-8
+"""
+Compare the memory used by the dict + DatasetNode representation of the MOLES
+mapping with the CompactMolesStore.
+
+usage: python -m benchmarks.moles_mapping_memory [--observations N [N ...]]
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import gc
+import json
+import tracemalloc
+import uuid
+
+from directory_tree import DatasetNode
+from rabbit_indexer.utils.moles_store import CompactMolesStore
+
+
+def synthetic_observations(count: int) -> dict:
+    """
+    Generate a mapping which looks like the output of generate_moles_mapping
+
+    :param count: Number of observations
+    :return: dict of path to record metadata
+    """
+    mapping = {}
+    for i in range(count):
+        path = f'/badc/project{i % 300}/data/instrument{i % 17}/dataset{i}/v{i % 3}'
+        mapping[path] = {
+            'title': f'Synthetic observation {i} from instrument {i % 17} for project {i % 300}',
+            'url': f'https://catalogue.ceda.ac.uk/uuid/{uuid.UUID(int=i).hex}',
+            'record_type': 'Dataset',
+        }
+    return mapping
+
+
+def measure(build, *args) -> int:
+    """
+    :return: Bytes allocated by build(*args) which are still held afterwards
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build(*args)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def build_current(document: str):
+    mapping = json.loads(document)
+
+    tree = DatasetNode()
+    for path in mapping:
+        tree.add_child(path)
+
+    return mapping, tree
+
+
+def build_compact(document: str):
+    return CompactMolesStore(json.loads(document))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--observations', nargs='+', type=int, default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f'{"observations":>12} {"dict+tree MB":>14} {"compact MB":>12} {"ratio":>7}')
+    for count in args.observations:
+
+        # Both structures are built from a JSON document, as they would be from
+        # the API, so that neither shares strings with the generator.
+        document = json.dumps(synthetic_observations(count))
+
+        current = measure(build_current, document)
+        compact = measure(build_compact, document)
+
+        print(f'{count:>12} {current / 2**20:>14.1f} {compact / 2**20:>12.1f} {current / compact:>7.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# encoding: utf-8
+"""
+Measure the throughput of decode -> filter -> metadata -> sink without a
+rabbit server or Elasticsearch cluster.
+
+A synthetic archive is created in a temporary directory and DEPOSIT messages
+for every file are passed through the same steps as the consumer, writing to
+a null or JSONL sink. The JSONL output can be bulk loaded later.
+
+usage: python -m benchmarks.pipeline_throughput [--dirs N] [--files N] [--sink null|jsonl] [--output DIR]
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from rabbit_indexer.index_updaters.sinks import JsonlSink, NullSink
+from rabbit_indexer.queue_handler.queue_handler import QueueHandler
+from rabbit_indexer.utils import PathFilter, PathTools
+
+MAPPING_FILE = os.path.join(os.path.dirname(__file__), '..', 'tests', 'moles_mapping_file.json')
+
+
+def make_archive(root: str, dirs: int, files: int):
+    """
+    Create the synthetic archive and return the messages for it
+
+    :return: list of message bodies
+    """
+    messages = []
+    for d in range(dirs):
+        directory = os.path.join(root, 'badc', f'dataset{d % 10}', 'data', f'run{d}')
+        os.makedirs(directory, exist_ok=True)
+
+        for f in range(files):
+            path = os.path.join(directory, f'file{f}.nc')
+            with open(path, 'wb') as writer:
+                writer.write(b'\0' * 128)
+
+            messages.append(json.dumps({
+                'datetime': '2021-02-09 11:17:12',
+                'filepath': path,
+                'action': 'DEPOSIT',
+                'filesize': '128',
+                'message': ''
+            }).encode())
+
+    return messages
+
+
+def run(messages, path_tools, path_filter, sink) -> float:
+    """
+    :return: messages per second
+    """
+    start = time.perf_counter()
+
+    for body in messages:
+        message = QueueHandler.decode_message(body)
+
+        if not path_filter.allow_path(message.filepath):
+            continue
+
+        metadata, _ = path_tools.generate_path_metadata(message.filepath)
+        sink.add(
+            {'update': {'_index': 'ceda-fbi', '_id': PathTools.generate_id(message.filepath)}},
+            {'doc': metadata, 'doc_as_upsert': True}
+        )
+
+    sink.flush()
+
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dirs', type=int, default=100)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--sink', choices=['null', 'jsonl'], default='null')
+    parser.add_argument('--output', help='Directory for the jsonl output. Defaults to a temporary directory')
+    args = parser.parse_args()
+
+    path_tools = PathTools(mapping_file=MAPPING_FILE, deferred=True)
+    path_filter = PathFilter(paths=['/neodc'])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        messages = make_archive(tmpdir, args.dirs, args.files)
+
+        if args.sink == 'jsonl':
+            sink = JsonlSink(args.output or os.path.join(tmpdir, 'output'))
+        else:
+            sink = NullSink()
+
+        rate = run(messages, path_tools, path_filter, sink)
+        sink.close()
+
+    print(f'{len(messages)} messages, {args.sink} sink: {rate:,.0f} messages/s')
+    print(f'sink stats: {sink.stats}')
+
+
+if __name__ == '__main__':
+    main()
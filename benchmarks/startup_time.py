@@ -0,0 +1,92 @@
+# encoding: utf-8
+"""
+Measure the consumer startup cost.
+
+Import time is measured in a fresh interpreter for each of the package
+modules, along with which of the heavy dependencies were imported.
+Time-to-READY is the time from creating PathTools until the MOLES mapping is
+ready to use, for both the eager and deferred initialisation modes.
+
+usage: python -m benchmarks.startup_time [--mapping-file FILE] [--repeat N]
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = [
+    'rabbit_indexer',
+    'rabbit_indexer.utils',
+    'rabbit_indexer.queue_handler',
+    'rabbit_indexer.index_updaters.base',
+]
+
+HEAVY_DEPENDENCIES = ['pika', 'requests', 'dateutil', 'ceda_elasticsearch_tools']
+
+IMPORT_SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def import_time(module: str, repeat: int):
+    """
+    :return: median import time in seconds and the heavy dependencies loaded
+    """
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SCRIPT.format(module=module, heavy=HEAVY_DEPENDENCIES)]
+        )
+        result = json.loads(output)
+        times.append(result['elapsed'])
+        loaded = result['loaded']
+
+    return statistics.median(times), loaded
+
+
+def time_to_ready(deferred: bool, mapping_file: str) -> float:
+    """
+    :return: seconds from creating PathTools until the MOLES mapping can be used
+    """
+    from rabbit_indexer.utils import PathTools
+
+    start = time.perf_counter()
+    path_tools = PathTools(mapping_file=mapping_file, deferred=deferred)
+    if deferred:
+        path_tools.start_loading()
+    path_tools.wait_ready()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mapping-file', help='Load the MOLES mapping from a file instead of the API')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('Import time')
+    for module in MODULES:
+        elapsed, loaded = import_time(module, args.repeat)
+        print(f'  {module:<40} {elapsed * 1000:>8.1f} ms  loaded: {", ".join(loaded) or "-"}')
+
+    print('Time to READY')
+    for deferred in (False, True):
+        elapsed = time_to_ready(deferred, args.mapping_file)
+        print(f'  {"deferred" if deferred else "eager":<40} {elapsed:>8.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,23 +5,198 @@ from datetime import datetime
 import logging
 import time
 import os
-from dateutil.parser import parse
+import threading
+from contextlib import contextmanager
 from abc import ABC, abstractmethod
-from rabbit_indexer.utils import PathTools
+from rabbit_indexer.utils import PathTools, PathFilter
+from rabbit_indexer.utils.log_setup import apply_log_filters
+from .sinks import Sink, get_sink
+from .burst import BurstDetector
+from .rollup import DirectoryRollup
+from .subtree import SubtreeRemover
 
 # Typing imports
-from typing import TYPE_CHECKING
+from typing import Callable, List, Optional, Set, TYPE_CHECKING
 if TYPE_CHECKING:
     from rabbit_indexer.utils.yaml_config import YamlConfig
     from rabbit_indexer.queue_handler.queue_handler import IngestMessage
 
 
+logger = logging.getLogger(__name__)
+
+# Actions which change the metadata for a directory and those below it
+DIRECTORY_ACTIONS = {'MKDIR', 'RMDIR', 'SYMLINK'}
+
+# Bulk item statuses which are worth retrying
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class Delivery:
+    """
+    Tracks the outstanding work for a rabbit message and acknowledges it
+    once all of the work is done.
+
+    Work is registered with :meth:`hold` and completed with :meth:`release`.
+    The message is acknowledged when it has been closed and nothing is held.
+
+    Parameters:
+        ack: Called once all the work is complete
+        nack: Called instead of ack if any of the work failed. If not given,
+            failed messages are acknowledged.
+    """
+
+    def __init__(self, ack: Callable[[], None], nack: Optional[Callable[[], None]] = None):
+        self.ack = ack
+        self.nack = nack
+        self.failed = False
+
+        self._held = 0
+        self._closed = False
+        self._done = False
+        self._lock = threading.Lock()
+
+    def hold(self) -> None:
+        with self._lock:
+            self._held += 1
+
+    def release(self, success: bool = True) -> None:
+        with self._lock:
+            self._held -= 1
+            if not success:
+                self.failed = True
+
+        self._finish()
+
+    def fail(self) -> None:
+        self.failed = True
+
+    def close(self) -> None:
+        """
+        No more work will be registered
+        """
+        with self._lock:
+            self._closed = True
+
+        self._finish()
+
+    def _finish(self) -> None:
+        with self._lock:
+            if self._done or not self._closed or self._held:
+                return
+            self._done = True
+
+        if self.failed and self.nack:
+            self.nack()
+        else:
+            self.ack()
+
+
+class BufferedBulkSink(Sink):
+    """
+    Sends the buffered bulk actions to Elasticsearch.
+
+    Items which fail with a retryable status are retried on their own with
+    exponential backoff, which is also used when the whole request is
+    rejected with a 429. Updates to documents which do not exist, such as
+    rollups for a directory which has since been removed, are dropped.
+
+    Parameters:
+        bulk: Callable which takes the NDJSON bulk body and returns the bulk response dict
+        max_retries: Number of times a failed item is retried
+        backoff: Initial backoff in seconds
+        max_backoff: Maximum backoff in seconds
+        kwargs: Batching options for :class:`Sink`
+    """
+
+    def __init__(
+        self,
+        bulk: Callable[[str], dict],
+        max_retries: int = 5,
+        backoff: float = 1,
+        max_backoff: float = 60,
+        **kwargs
+    ):
+        self.bulk = bulk
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        super().__init__(**kwargs)
+
+    def _sleep(self, attempt: int) -> None:
+        time.sleep(min(self.backoff * 2 ** attempt, self.max_backoff))
+
+    @staticmethod
+    def _document_missing(result: dict) -> bool:
+        """
+        :param result: Bulk response item
+        :return: True if the item is an update to a document which does not exist
+        """
+        error = result.get('update', {}).get('error') or {}
+        return isinstance(error, dict) and error.get('type') == 'document_missing_exception'
+
+    def _send(self, items: List[tuple]) -> None:
+        """
+        Send the items, retrying failures, and release their deliveries
+        """
+
+        attempt = 0
+        while items:
+
+            try:
+                response = self.bulk(''.join(item for item, _ in items))
+            except Exception as e:
+                status = getattr(e, 'status_code', None) or getattr(e, 'status', None)
+                if attempt >= self.max_retries:
+                    logger.error('Bulk request failed after %s retries', attempt, exc_info=e)
+                    self._release(items, success=False)
+                    return
+
+                logger.warning('Bulk request failed with status %s, retrying', status)
+                self.stats['retries'] += len(items)
+                self._sleep(attempt)
+                attempt += 1
+                continue
+
+            retry = []
+            for item, result in zip(items, response.get('items', [])):
+                status = list(result.values())[0].get('status', 200)
+
+                if status < 300:
+                    self._release([item])
+
+                elif self._document_missing(result):
+                    logger.debug('Dropped update to a missing document: %s', item[0].strip())
+                    self._release([item])
+
+                elif status in RETRY_STATUSES and attempt < self.max_retries:
+                    retry.append(item)
+
+                else:
+                    logger.error('Bulk action failed: %s %s', item[0].strip(), result)
+                    self._release([item], success=False)
+
+            # Release anything without a result in the response
+            self._release(items[len(response.get('items', [])):])
+
+            items = retry
+            if items:
+                self.stats['retries'] += len(items)
+                self._sleep(attempt)
+                attempt += 1
+
+
 class UpdateHandler(ABC):
     """
     Abstract Base class for file/directory based rabbitMQ messages which are used to update
     the CEDA files indices.
+
+    Class Variables:
+        NACK_FAILED: Reject messages which fail rather than acknowledging them
     """
 
+    NACK_FAILED = False
+
     def __init__(self, conf: 'YamlConfig', **kwargs) -> None:
         """
 
@@ -29,6 +204,13 @@ class UpdateHandler(ABC):
         """
         self.conf = conf
         self.pt = None
+        self.path_filter = None
+        self.sink = None
+        self.burst = None
+        self.rollups = None
+        self.subtree = None
+        self._es_client = None
+        self._local = threading.local()
         self._setup_logging()
         self.logger.info('Initialising rabbitmq consumer')
         self.setup_extra(**kwargs)
@@ -44,23 +226,485 @@ class UpdateHandler(ABC):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
 
-    def setup_extra(self, refresh_interval: int = 30, **kwargs):
+        apply_log_filters(self.conf)
+
+    def setup_extra(
+        self,
+        refresh_interval: int = 30,
+        path_tools: Optional[PathTools] = None,
+        rollup: bool = True,
+        **kwargs
+    ):
         """
         Setup extra properties for the handler
+
+        :param refresh_interval: Default minutes between refreshes of the mappings
+        :param path_tools: PathTools shared with other handlers. Created if not given.
+        :param rollup: Keep the directory rollups if ``indexer.rollup`` is set
         """
 
         # Initialise update counter
-        self.logger.info('Initialising update counter with refresh_interval: {}'.format(refresh_interval))
+        refresh_interval = self.conf.get('indexer', 'refresh_interval', default=refresh_interval)
+        self.logger.info('Initialising update counter with refresh_interval: %s', refresh_interval)
         self.update_time = datetime.now()
         self.refresh_interval = refresh_interval * 60 # convert to seconds
 
         # Initialise Path Tools
-        moles_obs_map_url = self.conf.get("moles", "moles_obs_map_url")
+        if path_tools is None:
+            path_tools = self._create_path_tools()
 
-        self.logger.info('Downloading MOLES mapping')
-        path_tools = PathTools(moles_mapping_url=moles_obs_map_url)
         self.pt = path_tools
 
+        # Initialise the path filter
+        self.path_filter = self._create_path_filter(self.conf)
+
+        self.setup_sink()
+        self.setup_burst()
+        self.setup_subtree_removal()
+
+        if rollup:
+            self.setup_rollup()
+
+    def _create_path_tools(self) -> PathTools:
+        """
+        Create PathTools from the ``moles``, ``spots`` and ``indexer`` sections.
+        If ``indexer.sidecar`` is set, lookups are made by the node sidecar.
+        """
+
+        deferred = self.conf.get("indexer", "deferred_init", default=False)
+        sidecar = self.conf.get("indexer", "sidecar", default={})
+
+        if sidecar.get("socket"):
+            self.logger.info('Using the mapping sidecar at %s', sidecar["socket"])
+            return PathTools.from_config(
+                self.conf,
+                sidecar=sidecar["socket"],
+                sidecar_cache_size=sidecar.get("cache_size", 10000),
+                sidecar_cache_ttl=sidecar.get("cache_ttl", 60)
+            )
+
+        if not deferred:
+            self.logger.info('Downloading MOLES mapping')
+
+        path_tools = PathTools.from_config(self.conf)
+
+        if deferred:
+            self.logger.info('Loading mappings in the background')
+            path_tools.start_loading()
+
+        return path_tools
+
+    def _create_path_filter(self, conf: 'YamlConfig') -> PathFilter:
+        """
+        Create the path filter from ``indexer.path_filter``, or use the node
+        sidecar if ``indexer.sidecar.path_filter`` is set
+        """
+
+        if self.pt.sidecar is not None and conf.get('indexer', 'sidecar', default={}).get('path_filter'):
+            from rabbit_indexer.utils.sidecar import SidecarPathFilter
+            return SidecarPathFilter(self.pt.sidecar)
+
+        return PathFilter(**conf.get('indexer', 'path_filter', default={}))
+
+    def setup_sink(self) -> None:
+        """
+        Create the output sink described by ``indexer.sink`` or ``elasticsearch.bulk``
+        """
+
+        self.sink = get_sink(self.conf)
+
+    def setup_burst(self) -> None:
+        """
+        Create the burst detector if ``indexer.burst`` is set
+        """
+
+        options = self.conf.get('indexer', 'burst')
+        if not options:
+            return
+
+        self.burst = BurstDetector(self._reconcile, **options)
+
+    def setup_subtree_removal(self) -> None:
+        """
+        Remove whole directory trees with a delete by prefix if
+        ``indexer.subtree_removal`` is set
+        """
+
+        options = dict(self.conf.get('indexer', 'subtree_removal', default={}))
+        if not options:
+            return
+
+        self.subtree_indices = options.pop('indices', [])
+        self.subtree = SubtreeRemover(self.delete_tree, **options)
+
+    def setup_rollup(self, sink: Optional[Sink] = None) -> None:
+        """
+        Create the directory rollups if ``indexer.rollup`` is set
+
+        :param sink: Sink for the rollup updates. Defaults to the handler sink.
+        """
+
+        options = self.conf.get('indexer', 'rollup')
+        if not options:
+            return
+
+        sink = sink or self.sink
+        if sink is None:
+            self.logger.warning('indexer.rollup needs an output sink, the directory rollups are disabled')
+            return
+
+        if not options.get('checkpoint_file'):
+            self.logger.warning('indexer.rollup needs a checkpoint_file, the directory rollups are disabled')
+            return
+
+        self.rollups = DirectoryRollup(sink, **options)
+
+    @property
+    def current_delivery(self) -> Optional[Delivery]:
+        """
+        The delivery for the message being processed in this thread
+        """
+        return getattr(self._local, 'delivery', None)
+
+    @contextmanager
+    def delivery(self, ack: Callable[[], None], nack: Optional[Callable[[], None]] = None):
+        """
+        Context for processing a message. Actions added to the sink with
+        :meth:`index` while in the context hold the message until they are
+        written. The message is acknowledged when the context exits and all
+        of its actions have been written.
+
+        :param ack: Called to acknowledge the message
+        :param nack: Called instead of ack if processing failed
+        """
+
+        delivery = Delivery(ack, nack)
+        self._local.delivery = delivery
+
+        try:
+            yield delivery
+        except Exception:
+            delivery.fail()
+            raise
+        finally:
+            self._local.delivery = None
+            delivery.close()
+
+    def index(self, action: dict, source: Optional[dict] = None) -> None:
+        """
+        Add an action to the sink, holding the current message until it is written
+
+        :param action: Bulk action line
+        :param source: Optional source line
+        """
+        self.sink.add(action, source, delivery=self.current_delivery)
+
+    def absorb(self, message: 'IngestMessage') -> bool:
+        """
+        Pass a deposit to the burst detector. If its directory is receiving a
+        burst of deposits, the message is held until the directory is reconciled
+        and should not be processed.
+
+        :param message: The parsed rabbitMQ message
+        :return: True if the message has been absorbed
+        """
+
+        if self.burst is None or self.current_delivery is None:
+            return False
+
+        if message.action != 'DEPOSIT' or os.path.basename(message.filepath) == '00README':
+            return False
+
+        return self.burst.absorb(message.filepath, self.current_delivery)
+
+    def remove_subtree(self, message: 'IngestMessage') -> bool:
+        """
+        Handle a REMOVE or RMDIR with a delete by prefix if it removes a
+        directory tree, or if the tree it is in has already been removed
+
+        :param message: The parsed rabbitMQ message
+        :return: True if the message needs no further processing
+        """
+
+        if self.subtree is None:
+            return False
+
+        return self.subtree.handle(message)
+
+    def delete_tree(self, prefix: str) -> None:
+        """
+        Delete a directory and everything below it from each of the
+        ``indexer.subtree_removal.indices``. Buffered output is written
+        first so it cannot recreate documents after the delete.
+
+        :param prefix: Directory path
+        """
+
+        self.flush()
+
+        for index in self.subtree_indices:
+            self._delete_by_prefix(index['index'], index.get('field', 'path'), prefix)
+
+        if self.pt is not None:
+            self.pt.invalidate_directory_metadata(prefix)
+
+    def _delete_by_prefix(self, index: str, field: str, prefix: str) -> None:
+        """
+        :param index: Index name
+        :param field: Keyword field holding the path
+        :param prefix: Directory path
+        """
+
+        if self._es_client is None:
+            from ceda_elasticsearch_tools.elasticsearch import CEDAElasticsearchClient
+
+            api_key = self.conf.get('elasticsearch', 'es_api_key')
+            self._es_client = CEDAElasticsearchClient(headers={'x-api-key': api_key})
+
+        query = {
+            'query': {
+                'bool': {
+                    'should': [
+                        {'term': {field: prefix}},
+                        {'prefix': {field: f'{prefix}/'}},
+                    ],
+                    'minimum_should_match': 1
+                }
+            }
+        }
+
+        result = self._es_client.delete_by_query(index=index, body=query, conflicts='proceed')
+        self.logger.info('Deleted %s documents below %s from %s', result.get('deleted'), prefix, index)
+
+    def flush(self) -> None:
+        """
+        Write any buffered output
+        """
+        if self.sink is not None:
+            self.sink.flush()
+
+    def default_prefetch(self) -> int:
+        """
+        Prefetch for the queues which do not set one. Messages written through
+        a sink are only acknowledged once their batch has been written, so a
+        batch can only fill if that many messages are unacknowledged at once.
+        Absorbed deposits are held until the rescan, so a burst can only be seen
+        if ``threshold`` of them can be delivered.
+
+        :return: Number of unacknowledged messages
+        """
+
+        prefetch = 1
+
+        if self.sink is not None:
+            prefetch = max(prefetch, self.sink.max_actions)
+
+        if self.rollups is not None:
+            prefetch = max(prefetch, self.rollups.max_pending)
+
+        if self.burst is not None:
+            prefetch = max(prefetch, self.burst.threshold)
+
+        return prefetch
+
+    def rollup(self, message: 'IngestMessage') -> None:
+        """
+        Add a DEPOSIT or REMOVE to the directory rollups, holding the current
+        message until the change has been checkpointed
+
+        :param message: The parsed rabbitMQ message
+        """
+
+        if self.rollups is not None:
+            self.rollups.apply(message, self.current_delivery)
+
+    def prefetch(self, messages: List['IngestMessage']) -> None:
+        """
+        Start fingerprinting the deposited files in a batch of messages so they
+        are hashed in parallel while the messages are processed. With a sidecar,
+        the MOLES records for their directories are fetched in one request.
+
+        :param messages: The parsed rabbitMQ messages
+        """
+
+        if self.pt is None:
+            return
+
+        if self.pt.sidecar is not None:
+            self.pt.prefetch_moles_records(list({
+                message.filepath if message.action in DIRECTORY_ACTIONS else os.path.dirname(message.filepath)
+                for message in messages
+            }))
+
+        if self.pt.fingerprinter is None:
+            return
+
+        self.pt.prefetch_fingerprints([
+            message.filepath for message in messages
+            if message.action == 'DEPOSIT'
+            and (self.path_filter is None or self.path_filter.allow_path(message.filepath))
+        ])
+
+    def _reconcile(self, directory: str, deliveries: List[Delivery], names: Set[str]) -> None:
+        """
+        Rescan a directory after a burst and release the absorbed deliveries
+        once everything indexed by :meth:`reconcile_directory` has been written.
+        Only the absorbed files are reconciled. The rest of the directory was
+        indexed from its own events. Absorbed files which have gone again
+        are left to their REMOVE events.
+
+        :param directory: Directory to rescan
+        :param deliveries: The absorbed deliveries
+        :param names: Names of the absorbed files
+        """
+
+        def release(success):
+            for delivery in deliveries:
+                delivery.release(success)
+
+        batch = Delivery(lambda: release(True), lambda: release(False))
+        self._local.delivery = batch
+
+        try:
+            with os.scandir(directory) as it:
+                entries = [entry for entry in it if entry.name in names and entry.is_file(follow_symlinks=False)]
+
+            if self.pt is not None:
+                self.pt.prefetch_fingerprints([entry.path for entry in entries])
+
+            self.reconcile_directory(directory, entries)
+
+        except FileNotFoundError:
+            self.logger.info('%s removed before it was reconciled', directory)
+
+        except Exception:
+            self.logger.exception('Failed to reconcile %s', directory)
+            batch.fail()
+
+        finally:
+            self._local.delivery = None
+            batch.close()
+
+    def reconcile_directory(self, directory: str, entries: List[os.DirEntry]) -> None:
+        """
+        Bring the index up to date with the files absorbed during a burst.
+        Actions added with :meth:`index` are written in bulk and hold the absorbed
+        messages until they are written.
+
+        The default creates a DEPOSIT message for each file and passes it to
+        :meth:`process_event`, which should write through :meth:`index`.
+        Handlers can override this to build the actions straight from the
+        entries, which carry the stat from the scan.
+
+        :param directory: The rescanned directory
+        :param entries: The absorbed files which are still in the directory
+        """
+
+        from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        for entry in entries:
+            if self.path_filter is not None and not self.path_filter.allow_path(entry.path):
+                continue
+
+            message = IngestMessage(timestamp, entry.path, 'DEPOSIT', str(entry.stat().st_size), '')
+            self.process_event(message)
+
+    def close(self) -> None:
+        """
+        Reconcile any absorbed events and flush any buffered output
+        """
+        if self.burst is not None:
+            self.burst.close()
+
+        if self.rollups is not None:
+            self.rollups.close()
+
+        if self.sink is not None:
+            self.sink.close()
+
+        if self.pt is not None and self.pt.fingerprinter is not None:
+            self.pt.fingerprinter.close()
+
+        if self.pt is not None:
+            self.pt.api_batcher.close()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the handler to be ready to process messages
+
+        :param timeout: Maximum time to wait in seconds
+        :return: True if the handler is ready
+        """
+
+        if self.pt is None:
+            return True
+
+        return self.pt.wait_ready(timeout)
+
+    def invalidate_caches(self, message: 'IngestMessage') -> None:
+        """
+        Invalidate the cached directory metadata affected by a message.
+        Called before the message is processed.
+
+        :param message: The parsed rabbitMQ message
+        """
+
+        if self.pt is None:
+            return
+
+        if message.action in DIRECTORY_ACTIONS:
+            self.pt.invalidate_directory_metadata(message.filepath)
+
+        elif os.path.basename(message.filepath) == '00README':
+            self.pt.invalidate_directory_metadata(os.path.dirname(message.filepath))
+
+    def reload_config(self, conf: 'YamlConfig') -> None:
+        """
+        Apply a new configuration. Only the parts which have changed are rebuilt,
+        the loaded mappings are kept.
+
+        :param conf: The newly read configuration
+        """
+
+        old_conf = self.conf
+
+        def changed(*keys, default=None):
+            return old_conf.get(*keys, default=default) != conf.get(*keys, default=default)
+
+        # Build everything before swapping so that a bad config leaves the handler unchanged
+        updates = {}
+
+        if changed('logging', 'log_level'):
+            log_level_str = conf.get('logging', 'log_level', default='info')
+            updates['log_level'] = getattr(logging, log_level_str.upper())
+
+        if changed('indexer', 'path_filter'):
+            updates['path_filter'] = self._create_path_filter(conf)
+
+        if changed('indexer', 'refresh_interval'):
+            updates['refresh_interval'] = conf.get('indexer', 'refresh_interval', default=30) * 60
+
+        for section in ('rabbit_server', 'moles', 'spots'):
+            if changed(section):
+                self.logger.warning('Changes to the %s section require a restart', section)
+
+        if 'log_level' in updates:
+            self.logger.setLevel(updates['log_level'])
+
+        if changed('logging'):
+            apply_log_filters(conf)
+
+        if 'path_filter' in updates:
+            self.path_filter = updates['path_filter']
+
+        if 'refresh_interval' in updates:
+            self.refresh_interval = updates['refresh_interval']
+
+        self.conf = conf
+        self.logger.info('Reloaded configuration. Updated: %s', ', '.join(updates) or 'nothing')
+
     def _update_mappings(self):
         """
         Need to make sure that the code is using the most up to date mapping, either in
@@ -90,6 +734,8 @@ class UpdateHandler(ABC):
         :param message: A rabbit_indexer.queue_handler.IngestMessage
         """
 
+        from dateutil.parser import parse
+
         timestamp = parse(message.datetime)
 
         t_delta = datetime.now() - timestamp
@@ -0,0 +1,172 @@
+# encoding: utf-8
+"""
+Detects bursts of deposits into a single directory so that they can be
+handled with one rescan of the directory instead of one update per event.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# Typing imports
+from typing import Callable, List, Set, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.index_updaters.base import Delivery
+
+logger = logging.getLogger(__name__)
+
+
+class _Burst:
+
+    __slots__ = ('deliveries', 'names', 'started', 'last')
+
+    def __init__(self, now: float):
+        self.deliveries = []
+        self.names = set()
+        self.started = now
+        self.last = now
+
+
+class BurstDetector:
+    """
+    Counts the events for each directory in a sliding window. Once a directory
+    has ``threshold`` events within ``window`` seconds, further events for it are
+    absorbed: their deliveries are held and the directory is reconciled once,
+    when it has been quiet for ``settle`` seconds or ``max_delay`` seconds after
+    the first absorbed event. The names of the absorbed files and the held
+    deliveries are passed to the reconcile callback, which releases the
+    deliveries when the reconciled state has been written.
+
+    Parameters:
+        reconcile: Called with the directory, the absorbed deliveries and the names of the absorbed files
+        threshold: Number of events within the window which starts a burst
+        window: Length of the sliding window in seconds
+        settle: Seconds without events after which a burst is reconciled
+        max_delay: Maximum seconds an absorbed event waits to be reconciled
+    """
+
+    def __init__(
+        self,
+        reconcile: Callable[[str, List['Delivery'], Set[str]], None],
+        threshold: int = 1000,
+        window: float = 60,
+        settle: float = 5,
+        max_delay: float = 60
+    ):
+        if threshold < 1:
+            raise ValueError(f'Burst threshold must be at least 1. You have provided {threshold}')
+
+        self.reconcile = reconcile
+        self.threshold = threshold
+        self.window = window
+        self.settle = settle
+        self.max_delay = max_delay
+
+        self.stats = {'bursts': 0, 'absorbed': 0, 'reconciled': 0}
+
+        self._events = {}
+        self._bursts = {}
+        self._lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._run_timer, name='burst-timer', daemon=True)
+        self._timer.start()
+
+    def absorb(self, path: str, delivery: 'Delivery') -> bool:
+        """
+        Count an event for the parent directory of a file and absorb it if the
+        directory is in a burst
+
+        :param path: File path of the event
+        :param delivery: Delivery for the event. Held if the event is absorbed.
+        :return: True if the event has been absorbed and should not be processed
+        """
+
+        directory, name = os.path.split(path)
+        now = time.monotonic()
+
+        with self._lock:
+            burst = self._bursts.get(directory)
+
+            if burst is None:
+                events = self._events.get(directory)
+                if events is None:
+                    events = self._events[directory] = deque(maxlen=self.threshold)
+                events.append(now)
+
+                if len(events) < self.threshold or now - events[0] > self.window:
+                    return False
+
+                logger.info('Burst of events in %s, absorbing events until it settles', directory)
+                del self._events[directory]
+                burst = self._bursts[directory] = _Burst(now)
+                self.stats['bursts'] += 1
+
+            delivery.hold()
+            burst.deliveries.append(delivery)
+            burst.names.add(name)
+            burst.last = now
+            self.stats['absorbed'] += 1
+
+        return True
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Reconcile the bursts which are due
+
+        :param force: Reconcile all the bursts
+        """
+
+        now = time.monotonic()
+        due = []
+
+        with self._lock:
+            for directory, burst in list(self._bursts.items()):
+                settled = now - burst.last >= self.settle
+
+                if force or settled:
+                    del self._bursts[directory]
+
+                elif now - burst.started >= self.max_delay:
+                    # Still busy, keep absorbing into a new batch
+                    self._bursts[directory] = _Burst(now)
+
+                else:
+                    continue
+
+                if burst.deliveries:
+                    due.append((directory, burst.deliveries, burst.names))
+
+            # Forget directories which have not had an event within the window
+            for directory, events in list(self._events.items()):
+                if now - events[-1] > self.window:
+                    del self._events[directory]
+
+        for directory, deliveries, names in due:
+            logger.info('Reconciling %s after absorbing %s events', directory, len(deliveries))
+            self.stats['reconciled'] += 1
+            try:
+                self.reconcile(directory, deliveries, names)
+            except Exception:
+                logger.exception('Failed to reconcile %s', directory)
+                for delivery in deliveries:
+                    delivery.release(False)
+
+    def close(self) -> None:
+        """
+        Stop the timer and reconcile all the outstanding bursts
+        """
+        self._stop.set()
+        self._timer.join()
+        self.flush(force=True)
+
+    def _run_timer(self) -> None:
+        while not self._stop.wait(min(self.settle, 1)):
+            self.flush()
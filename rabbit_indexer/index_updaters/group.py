@@ -0,0 +1,149 @@
+# encoding: utf-8
+"""
+Runs several handlers on one decoded stream of messages.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import time
+from .base import Delivery, UpdateHandler
+
+# Typing imports
+from typing import List, Optional, Type, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.utils.yaml_config import YamlConfig
+    from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+
+class HandlerGroup(UpdateHandler):
+    """
+    Passes each message to a list of handlers which share one PathTools, so the
+    mappings are only held once. The path metadata and stat results are shared
+    between the handlers for each message using :meth:`PathTools.message_scope`.
+
+    Each handler gets its own delivery for the message. A handler which raises is
+    retried on its own, with exponential backoff, without running the others again.
+    The message is acknowledged once every handler has succeeded and its output
+    has been written, otherwise it is rejected.
+
+    Handlers which override ``setup_extra`` must pass the keyword arguments on to
+    ``UpdateHandler.setup_extra`` to use the shared PathTools.
+
+    Parameters:
+        conf: YamlConfig
+        handler_classes: The UpdateHandler classes to run
+        retries: Number of times a failed handler is retried for a message
+        backoff: Initial backoff in seconds
+    """
+
+    NACK_FAILED = True
+
+    def __init__(
+        self,
+        conf: 'YamlConfig',
+        handler_classes: List[Type[UpdateHandler]],
+        retries: int = 2,
+        backoff: float = 1,
+        **kwargs
+    ):
+        self.handler_classes = handler_classes
+        self.handlers = []
+        self.retries = retries
+        self.backoff = backoff
+
+        super().__init__(conf, **kwargs)
+
+    def setup_extra(self, **kwargs):
+        super().setup_extra(rollup=False, **kwargs)
+
+        for handler_class in self.handler_classes:
+            self.logger.info('Initialising handler %s', handler_class.__name__)
+            handler = handler_class(conf=self.conf, path_tools=self.pt, rollup=False)
+
+            # Bursts are detected once for the group
+            if handler.burst is not None:
+                handler.burst.close()
+                handler.burst = None
+
+            # Trees are removed once for the group
+            handler.subtree = None
+
+            self.handlers.append(handler)
+
+        # Directory rollups are kept once for the group and written with the first handler output
+        sinks = [handler.sink for handler in self.handlers if handler.sink is not None]
+        if sinks:
+            self.setup_rollup(sinks[0])
+
+    def setup_sink(self) -> None:
+        # The group does not write anything itself
+        self.sink = None
+
+    def process_event(self, message: 'IngestMessage') -> None:
+        """
+        Pass the message to every handler
+
+        :param message: The parsed rabbitMQ message
+        """
+
+        parent = self.current_delivery
+
+        with self.pt.message_scope():
+            for handler in self.handlers:
+                self._process(handler, message, parent)
+
+    def _process(self, handler: UpdateHandler, message: 'IngestMessage', parent: Optional[Delivery]) -> None:
+        """
+        Run one handler with retries. The handler holds the parent delivery
+        until it has finished and its output has been written.
+        """
+
+        if parent is not None:
+            parent.hold()
+            delivery = Delivery(lambda: parent.release(True), lambda: parent.release(False))
+        else:
+            delivery = Delivery(lambda: None)
+
+        handler._local.delivery = delivery
+        name = type(handler).__name__
+
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    handler.process_event(message)
+                    break
+
+                except Exception:
+                    if attempt >= self.retries:
+                        self.logger.exception('%s failed to process %s', name, message.filepath)
+                        delivery.fail()
+                        break
+
+                    self.logger.warning('%s failed to process %s, retrying', name, message.filepath, exc_info=True)
+                    time.sleep(self.backoff * 2 ** attempt)
+
+        finally:
+            handler._local.delivery = None
+            delivery.close()
+
+    def reload_config(self, conf: 'YamlConfig') -> None:
+        super().reload_config(conf)
+
+        for handler in self.handlers:
+            handler.reload_config(conf)
+
+    def flush(self) -> None:
+        for handler in self.handlers:
+            handler.flush()
+
+    def default_prefetch(self) -> int:
+        return max([super().default_prefetch()] + [handler.default_prefetch() for handler in self.handlers])
+
+    def close(self) -> None:
+        super().close()
+
+        for handler in self.handlers:
+            handler.close()
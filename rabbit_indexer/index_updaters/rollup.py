@@ -0,0 +1,353 @@
+# encoding: utf-8
+"""
+Incremental directory size and file count rollups.
+
+Every DEPOSIT and REMOVE carries the size of the file, so the totals for the
+directories above it can be kept up to date without aggregation queries or
+tree walks. The changes are accumulated in a tree keyed by path component and
+flushed in periodic batches as scripted updates to the directories index.
+
+The batches are checkpointed before the messages behind them are acknowledged,
+so no change is lost over a restart. Each update carries a sequence number for
+the consumer which sent it and is a no-op if the directory document has
+already seen it, so resending a batch after a restart does not count it twice.
+The sequence number and the consumer name are kept in the checkpoint, so a
+restarted consumer carries on from where it stopped rather than having its
+updates dropped until the sequence catches up.
+
+The updates never create a directory document. Changes to a directory which
+has been removed, or has not been indexed yet, are dropped by the sink.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+# Typing imports
+from typing import Dict, Iterator, Optional, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.index_updaters.base import Delivery
+    from rabbit_indexer.index_updaters.sinks import Sink
+    from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_SCRIPT = (
+    "if (ctx._source.rollup_seq == null) { ctx._source.rollup_seq = [:]; } "
+    "if (ctx._source.rollup_seq.containsKey(params.instance) "
+    "&& ctx._source.rollup_seq[params.instance] >= params.seq) { ctx.op = 'noop'; } "
+    "else { "
+    "ctx._source.total_size = (ctx._source.total_size ?: 0) + params.size; "
+    "ctx._source.file_count = (ctx._source.file_count ?: 0) + params.count; "
+    "ctx._source.rollup_seq[params.instance] = params.seq; }"
+)
+
+
+class _Node:
+
+    __slots__ = ('children', 'size', 'count')
+
+    def __init__(self):
+        self.children = {}
+        self.size = 0
+        self.count = 0
+
+
+class _DeltaTree:
+    """
+    Size and count changes for each directory, stored as a tree of path
+    components so that the shared prefixes are only held once.
+
+    The root is not a directory in the index. The changes climb as far as the
+    top level directories of the archive, such as ``/badc``.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+
+    def __bool__(self) -> bool:
+        return bool(self.root.children)
+
+    def add(self, directory: str, size: int, count: int, ancestors: bool = True) -> None:
+        """
+        Add a change to a directory and, if ``ancestors``, every directory above it
+        """
+
+        node = self.root
+
+        for component in directory.strip('/').split('/'):
+            if not component:
+                continue
+            node = node.children.setdefault(component, _Node())
+            if ancestors:
+                node.size += size
+                node.count += count
+
+        if not ancestors and node is not self.root:
+            node.size += size
+            node.count += count
+
+    def items(self) -> Iterator[Tuple[str, int, int]]:
+        """
+        :return: (directory, size, count) for the directories with a change
+        """
+        stack = [('/' + component, child) for component, child in self.root.children.items()]
+        while stack:
+            path, node = stack.pop()
+            if node.size or node.count:
+                yield path, node.size, node.count
+
+            for component, child in node.children.items():
+                stack.append((os.path.join(path, component), child))
+
+
+class DirectoryRollup:
+    """
+    Keeps the ``total_size`` and ``file_count`` of the directories in the
+    index up to date from the DEPOSIT and REMOVE events.
+
+    The deliveries are held until the change has been checkpointed. A
+    directory only has one update in flight at a time, changes to it which
+    arrive while it is being sent are kept for the next flush.
+
+    Parameters:
+        sink: Sink for the update actions
+        index: Directories index
+        checkpoint_file: JSON file to keep the sequence number and the unsent changes in
+            between restarts. Each consumer needs its own file.
+        instance: Name of this consumer in the sequence numbers. Defaults to the name
+            kept in the checkpoint, or the hostname and a random suffix for a new checkpoint.
+        interval: Seconds between flushes
+        max_pending: Number of held deliveries which triggers a flush
+    """
+
+    def __init__(
+        self,
+        sink: 'Sink',
+        checkpoint_file: str,
+        index: str = 'ceda-dirs',
+        instance: Optional[str] = None,
+        interval: float = 5,
+        max_pending: int = 500
+    ):
+        self.sink = sink
+        self.index = index
+        self.checkpoint_file = checkpoint_file
+        self.instance = instance
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self.stats = {'events': 0, 'flushes': 0, 'updates': 0, 'failures': 0}
+
+        self._pending = _DeltaTree()
+        self._deliveries = []
+        self._seq = 0
+
+        # directory: [seq, size, count] checkpointed but not yet confirmed
+        self._outstanding = {}
+        self._in_flight = set()
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self._load_checkpoint()
+
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._run_timer, name='rollup-timer', daemon=True)
+        self._timer.start()
+
+    def apply(self, message: 'IngestMessage', delivery: Optional['Delivery'] = None) -> bool:
+        """
+        Add the change from a DEPOSIT or REMOVE to the directories above the file
+
+        :param message: The parsed rabbitMQ message
+        :param delivery: Delivery to hold until the change has been checkpointed
+        :return: True if the message changed the totals
+        """
+
+        if message.action == 'DEPOSIT':
+            count = 1
+        elif message.action == 'REMOVE':
+            count = -1
+        else:
+            return False
+
+        try:
+            size = int(message.filesize or 0) * count
+        except ValueError:
+            size = 0
+
+        if delivery:
+            delivery.hold()
+
+        with self._lock:
+            self._pending.add(os.path.dirname(message.filepath), size, count)
+            self.stats['events'] += 1
+            if delivery:
+                self._deliveries.append(delivery)
+            full = len(self._deliveries) >= self.max_pending
+
+        if full:
+            self.flush()
+
+        return True
+
+    def flush(self) -> None:
+        """
+        Checkpoint the pending changes, release their deliveries and send
+        the changes which are not already in flight
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                deliveries = self._deliveries
+                self._pending = _DeltaTree()
+                self._deliveries = []
+
+                # Directories with an unconfirmed update keep their changes for later
+                seq = self._seq + 1
+                for directory, size, count in pending.items():
+                    if directory in self._outstanding:
+                        self._pending.add(directory, size, count, ancestors=False)
+                    else:
+                        self._outstanding[directory] = [seq, size, count]
+
+                idle = not self._outstanding and not self._pending
+                if not idle:
+                    self._seq = seq
+                    checkpoint = self._checkpoint()
+                    to_send = {
+                        directory: tuple(update) for directory, update in self._outstanding.items()
+                        if directory not in self._in_flight
+                    }
+                    self._in_flight.update(to_send)
+
+            if idle:
+                self._release(deliveries)
+                return
+
+            try:
+                self._save_checkpoint(checkpoint)
+            except OSError:
+                logger.exception('Unable to write the rollup checkpoint %s', self.checkpoint_file)
+                # The deliveries are held until a later checkpoint succeeds
+                with self._lock:
+                    self._in_flight.difference_update(to_send)
+                    self._deliveries.extend(deliveries)
+                return
+
+            self._release(deliveries)
+            self.stats['flushes'] += 1
+
+            for directory, update in to_send.items():
+                self._send(directory, *update)
+
+    def totals(self) -> Dict[str, Tuple[int, int]]:
+        """
+        :return: directory to (size, count) for the changes which have not been confirmed
+        """
+        with self._lock:
+            totals = {directory: (size, count) for directory, (_, size, count) in self._outstanding.items()}
+            for directory, size, count in self._pending.items():
+                old_size, old_count = totals.get(directory, (0, 0))
+                totals[directory] = (old_size + size, old_count + count)
+        return totals
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    def _send(self, directory: str, seq: int, size: int, count: int) -> None:
+        from rabbit_indexer.index_updaters.base import Delivery
+        from rabbit_indexer.utils.path_tools import PathTools
+
+        action = {'update': {'_index': self.index, '_id': PathTools.generate_id(directory)}}
+        source = {
+            'script': {
+                'source': ROLLUP_SCRIPT,
+                'lang': 'painless',
+                'params': {'instance': self.instance, 'seq': seq, 'size': size, 'count': count},
+            },
+        }
+
+        delivery = Delivery(
+            lambda: self._confirmed(directory, seq, True),
+            lambda: self._confirmed(directory, seq, False)
+        )
+        self.sink.add(action, source, delivery=delivery)
+        delivery.close()
+
+    def _confirmed(self, directory: str, seq: int, success: bool) -> None:
+        with self._lock:
+            self._in_flight.discard(directory)
+
+            if success:
+                self.stats['updates'] += 1
+                if self._outstanding.get(directory, [None])[0] == seq:
+                    del self._outstanding[directory]
+            else:
+                # Resent with the same sequence number on the next flush
+                self.stats['failures'] += 1
+
+    def _release(self, deliveries: list, success: bool = True) -> None:
+        for delivery in deliveries:
+            delivery.release(success)
+
+    def _checkpoint(self) -> dict:
+        return {
+            'instance': self.instance,
+            'seq': self._seq,
+            'outstanding': self._outstanding.copy(),
+            'pending': [list(item) for item in self._pending.items()],
+        }
+
+    def _save_checkpoint(self, checkpoint: dict) -> None:
+        tmp_file = f'{self.checkpoint_file}.tmp'
+        with open(tmp_file, 'w') as writer:
+            json.dump(checkpoint, writer)
+            writer.flush()
+            os.fsync(writer.fileno())
+
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def _load_checkpoint(self) -> None:
+        if not os.path.exists(self.checkpoint_file):
+            if self.instance is None:
+                # Unique to this checkpoint, so consumers on the same host do not share sequence numbers
+                self.instance = f'{socket.gethostname()}-{uuid.uuid4().hex[:8]}'
+            return
+
+        with open(self.checkpoint_file) as reader:
+            checkpoint = json.load(reader)
+
+        if self.instance is None:
+            self.instance = checkpoint['instance']
+
+        elif checkpoint['instance'] != self.instance:
+            logger.warning(
+                'Rollup checkpoint %s was written by %s, not %s',
+                self.checkpoint_file, checkpoint['instance'], self.instance
+            )
+
+        self._seq = checkpoint.get('seq', 0)
+        self._outstanding = checkpoint.get('outstanding', {})
+        for directory, size, count in checkpoint.get('pending', []):
+            self._pending.add(directory, size, count, ancestors=False)
+
+        logger.info('Loaded %s unsent directory rollups', len(self._outstanding))
+
+    def _run_timer(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush the directory rollups')
@@ -0,0 +1,309 @@
+# encoding: utf-8
+"""
+Output sinks for the handlers.
+
+All sinks take Elasticsearch bulk actions so that a handler does not need to
+know where its output is going. The sink is chosen by the ``indexer.sink``
+section of the config:
+
+- ``elasticsearch``: :class:`rabbit_indexer.index_updaters.base.BufferedBulkSink`
+- ``jsonl``: :class:`JsonlSink`, rotating, compressed files of bulk actions which
+  can be bulk loaded later
+- ``null``: :class:`NullSink`, only counts the actions
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+# Typing imports
+from typing import List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.index_updaters.base import Delivery
+    from rabbit_indexer.utils.yaml_config import YamlConfig
+
+logger = logging.getLogger(__name__)
+
+
+class Sink(ABC):
+    """
+    Buffers bulk actions and writes them in batches.
+
+    A batch is written when it reaches ``max_actions`` or ``max_bytes``, or when the
+    oldest action has waited ``max_age`` seconds. The deliveries behind the actions
+    are released once the batch has been written.
+
+    Parameters:
+        max_actions: Number of actions in a batch
+        max_bytes: Size of a batch in bytes
+        max_age: Maximum time in seconds an action waits before being written
+    """
+
+    def __init__(self, max_actions: int = 500, max_bytes: int = 5 * 2**20, max_age: float = 5):
+        self.max_actions = max_actions
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.stats = {'flushes': 0, 'actions': 0, 'retries': 0, 'failures': 0}
+
+        self._buffer = []
+        self._bytes = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._run_timer, name=f'{type(self).__name__}-timer', daemon=True)
+        self._timer.start()
+
+    @staticmethod
+    def serialise(action: dict, source: Optional[dict] = None) -> str:
+        """
+        :return: The NDJSON lines for the action
+        """
+        item = json.dumps(action) + '\n'
+        if source is not None:
+            item += json.dumps(source) + '\n'
+        return item
+
+    def add(self, action: dict, source: Optional[dict] = None, delivery: Optional['Delivery'] = None) -> None:
+        """
+        Add an action to the buffer
+
+        :param action: Bulk action line e.g. ``{'update': {'_index': 'ceda-dirs', '_id': '...'}}``
+        :param source: Optional source line e.g. ``{'doc': {...}, 'doc_as_upsert': True}``
+        :param delivery: Delivery to hold until the action has been written
+        """
+
+        item = self.serialise(action, source)
+
+        if delivery:
+            delivery.hold()
+
+        with self._lock:
+            self._buffer.append((item, delivery))
+            self._bytes += len(item)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+            full = len(self._buffer) >= self.max_actions or self._bytes >= self.max_bytes
+
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write everything in the buffer
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                items = self._buffer
+                self._buffer = []
+                self._bytes = 0
+                self._oldest = None
+
+            if items:
+                self.stats['flushes'] += 1
+                self._send(items)
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    @abstractmethod
+    def _send(self, items: List[tuple]) -> None:
+        """
+        Write a batch and release the deliveries
+
+        :param items: list of (NDJSON string, delivery) tuples
+        """
+        pass
+
+    def _run_timer(self) -> None:
+        while not self._stop.wait(min(self.max_age, 1)):
+            oldest = self._oldest
+            if oldest is not None and time.monotonic() - oldest >= self.max_age:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Failed to flush %s', type(self).__name__)
+
+    def _release(self, items: List[tuple], success: bool = True) -> None:
+        for _, delivery in items:
+            if success:
+                self.stats['actions'] += 1
+            else:
+                self.stats['failures'] += 1
+
+            if delivery:
+                delivery.release(success)
+
+
+class NullSink(Sink):
+    """
+    Counts the actions and discards them. Used to measure the throughput
+    of the rest of the pipeline.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stats['bytes'] = 0
+
+    def add(self, action: dict, source: Optional[dict] = None, delivery: Optional['Delivery'] = None) -> None:
+        item = self.serialise(action, source)
+
+        with self._lock:
+            self.stats['actions'] += 1
+            self.stats['bytes'] += len(item)
+
+    def _send(self, items: List[tuple]) -> None:
+        self._release(items)
+
+
+class JsonlSink(Sink):
+    """
+    Writes the actions to gzip compressed files in the Elasticsearch bulk
+    format, so they can be loaded later with the bulk API. A new file is
+    started once the current file reaches ``max_file_actions`` or
+    ``max_file_bytes`` of uncompressed output.
+
+    Parameters:
+        directory: Directory to write the files to
+        prefix: File name prefix
+        compress: Compress the files with gzip
+        max_file_actions: Number of actions in a file
+        max_file_bytes: Uncompressed size of a file in bytes
+        fsync: Sync the file to disk before releasing the deliveries
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str = 'bulk',
+        compress: bool = True,
+        max_file_actions: int = 1000000,
+        max_file_bytes: int = 2**30,
+        fsync: bool = True,
+        **kwargs
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.compress = compress
+        self.max_file_actions = max_file_actions
+        self.max_file_bytes = max_file_bytes
+        self.fsync = fsync
+        self.files = []
+
+        self._raw = None
+        self._writer = None
+        self._file_actions = 0
+        self._file_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        super().__init__(**kwargs)
+
+    def _open(self) -> None:
+        timestamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+        suffix = '.jsonl.gz' if self.compress else '.jsonl'
+        filename = os.path.join(self.directory, f'{self.prefix}-{timestamp}-{len(self.files):05d}{suffix}')
+
+        self._raw = open(filename, 'wb')
+        if self.compress:
+            self._writer = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        else:
+            self._writer = self._raw
+
+        self._file_actions = 0
+        self._file_bytes = 0
+        self.files.append(filename)
+        logger.info('Writing bulk actions to %s', filename)
+
+    def _rotate(self) -> None:
+        if self._writer is None:
+            return
+
+        if self._writer is not self._raw:
+            self._writer.close()
+        self._raw.close()
+
+        self._writer = None
+        self._raw = None
+
+    def _send(self, items: List[tuple]) -> None:
+
+        for item, _ in items:
+            if self._writer is None:
+                self._open()
+
+            data = item.encode()
+            self._writer.write(data)
+            self._file_actions += 1
+            self._file_bytes += len(data)
+
+            if self._file_actions >= self.max_file_actions or self._file_bytes >= self.max_file_bytes:
+                self._rotate()
+
+        if self._writer is not None:
+            self._writer.flush()
+            self._raw.flush()
+            if self.fsync:
+                os.fsync(self._raw.fileno())
+
+        self._release(items)
+
+    def close(self) -> None:
+        super().close()
+        with self._flush_lock:
+            self._rotate()
+
+
+SINKS = {
+    'null': NullSink,
+    'jsonl': JsonlSink,
+}
+
+
+def get_sink(conf: 'YamlConfig') -> Optional[Sink]:
+    """
+    Create the sink described by ``indexer.sink``. For compatibility, the
+    Elasticsearch sink is also created if only ``elasticsearch.bulk`` is set.
+
+    :param conf: YamlConfig
+    :return: Sink or None if no sink is configured
+    """
+
+    options = dict(conf.get('indexer', 'sink', default={}))
+    sink_type = options.pop('type', None)
+
+    if sink_type is None:
+        bulk_options = conf.get('elasticsearch', 'bulk')
+        if not bulk_options:
+            return None
+        sink_type = 'elasticsearch'
+        options = dict(bulk_options)
+
+    if sink_type == 'elasticsearch':
+        from ceda_elasticsearch_tools.elasticsearch import CEDAElasticsearchClient
+        from rabbit_indexer.index_updaters.base import BufferedBulkSink
+
+        api_key = conf.get('elasticsearch', 'es_api_key')
+        client = CEDAElasticsearchClient(headers={'x-api-key': api_key})
+
+        return BufferedBulkSink(bulk=lambda body: client.bulk(body=body), **options)
+
+    if sink_type not in SINKS:
+        raise ValueError(f'Sink type must be one of {["elasticsearch", *SINKS]}. You have provided {sink_type}')
+
+    return SINKS[sink_type](**options)
@@ -0,0 +1,185 @@
+# encoding: utf-8
+"""
+Removes whole directory trees from the indices with one delete by prefix
+instead of one delete for each REMOVE and RMDIR event.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Typing imports
+from typing import Callable, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+logger = logging.getLogger(__name__)
+
+
+class SubtreeRemover:
+    """
+    Turns the removal of a directory tree into a single delete by prefix.
+
+    The tree is removed when an RMDIR arrives, or when ``threshold`` REMOVE
+    events arrive within ``window`` seconds for a directory which no longer
+    exists. The prefix is the highest ancestor which no longer exists, so the
+    RMDIR events for the parent directories which follow are covered too. The
+    REMOVE and RMDIR events under a removed prefix which arrive in the next
+    ``ttl`` seconds are subsumed and need no processing, unless the prefix
+    has been created again.
+
+    Prefixes with fewer than ``min_depth`` components are never removed, so a
+    storage outage which makes the whole archive look missing does not empty
+    the indices.
+
+    Parameters:
+        delete_prefix: Called with the directory to remove everything below
+        threshold: Number of REMOVE events within the window which removes the directory
+        window: Length of the sliding window in seconds
+        min_depth: Minimum number of path components in a removed prefix
+        ttl: Seconds for which events under a removed prefix are subsumed
+        max_prefixes: Maximum number of removed prefixes remembered
+    """
+
+    def __init__(
+        self,
+        delete_prefix: Callable[[str], None],
+        threshold: int = 100,
+        window: float = 60,
+        min_depth: int = 3,
+        ttl: float = 600,
+        max_prefixes: int = 1000
+    ):
+        self.delete_prefix = delete_prefix
+        self.threshold = threshold
+        self.window = window
+        self.min_depth = min_depth
+        self.ttl = ttl
+        self.max_prefixes = max_prefixes
+
+        self.stats = {'removed': 0, 'subsumed': 0}
+
+        self._removes = {}
+        self._removed = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def depth(path: str) -> int:
+        return len([part for part in path.split('/') if part])
+
+    def covers(self, path: str) -> Optional[str]:
+        """
+        :param path: File or directory path
+        :return: The removed prefix which covers the path, if any
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            # Forget the prefixes which have expired
+            while self._removed:
+                prefix, removed = next(iter(self._removed.items()))
+                if now - removed < self.ttl:
+                    break
+                del self._removed[prefix]
+
+            while path not in ('', '/'):
+                if path in self._removed:
+                    break
+                path = os.path.dirname(path)
+            else:
+                return None
+
+        # The prefix has been created again and its new contents need their own events
+        if os.path.exists(path):
+            with self._lock:
+                self._removed.pop(path, None)
+            return None
+
+        return path
+
+    def _count_remove(self, directory: str) -> bool:
+        """
+        :return: True if the directory has reached the threshold of REMOVE events
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            events = self._removes.get(directory)
+            if events is None:
+                events = self._removes[directory] = deque(maxlen=self.threshold)
+
+            events.append(now)
+
+            # Drop directories which have gone quiet so the counters do not grow without limit
+            if len(self._removes) > self.max_prefixes:
+                for name in [name for name, times in self._removes.items() if now - times[-1] > self.window]:
+                    del self._removes[name]
+
+            return len(events) >= self.threshold and now - events[0] <= self.window
+
+    def _highest_missing(self, directory: str) -> str:
+        parent = os.path.dirname(directory)
+        while self.depth(parent) >= self.min_depth and not os.path.exists(parent):
+            directory = parent
+            parent = os.path.dirname(directory)
+        return directory
+
+    def handle(self, message: 'IngestMessage') -> bool:
+        """
+        :param message: The parsed rabbitMQ message
+        :return: True if the message has been handled by a delete by prefix
+            and needs no further processing
+        """
+
+        if message.action not in ('REMOVE', 'RMDIR'):
+            return False
+
+        path = message.filepath.rstrip('/')
+
+        if self.covers(path):
+            self.stats['subsumed'] += 1
+            return True
+
+        if message.action == 'RMDIR':
+            directory = path
+        else:
+            directory = os.path.dirname(path)
+            if not self._count_remove(directory):
+                return False
+
+        # The directory has been recreated since the event
+        if os.path.exists(directory):
+            return False
+
+        prefix = self._highest_missing(directory)
+        if self.depth(prefix) < self.min_depth:
+            return False
+
+        # Registered first so that events arriving during the delete are subsumed
+        with self._lock:
+            self._removed[prefix] = time.monotonic()
+            self._removed.move_to_end(prefix)
+            while len(self._removed) > self.max_prefixes:
+                self._removed.popitem(last=False)
+            self._removes.pop(directory, None)
+
+        logger.info('Removing the tree below %s', prefix)
+
+        try:
+            self.delete_prefix(prefix)
+        except Exception:
+            with self._lock:
+                self._removed.pop(prefix, None)
+            raise
+
+        self.stats['removed'] += 1
+        return True
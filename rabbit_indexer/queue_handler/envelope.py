@@ -0,0 +1,152 @@
+# encoding: utf-8
+"""
+Envelopes carry many deposit events in a single rabbit message.
+
+An envelope is either a JSON array of records or newline delimited records,
+optionally gzip compressed. Each record can be in either of the single message
+formats, a JSON object or the colon separated text format. Envelopes are
+expanded by :meth:`rabbit_indexer.queue_handler.QueueHandler.decode_messages`.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import gzip
+import json
+import logging
+import time
+
+# Typing imports
+from typing import Iterable, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pika.channel import Channel
+    from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def encode_envelope(messages: Iterable['IngestMessage'], compress: bool = True) -> bytes:
+    """
+    Encode messages as newline delimited JSON records
+
+    :param messages: IngestMessages
+    :param compress: gzip the envelope
+    :return: message body
+    """
+    body = ''.join(json.dumps(message._asdict()) + '\n' for message in messages).encode('utf-8')
+
+    if compress:
+        body = gzip.compress(body)
+
+    return body
+
+
+class EnvelopePublisher:
+    """
+    Batches messages into envelopes and publishes them.
+
+    An envelope is published when it has ``max_records`` records or ``max_bytes``
+    of uncompressed records, or when a message is added more than ``max_age``
+    seconds after the first message in the envelope. Pika channels are not thread
+    safe, so there is no timer; call :meth:`flush` periodically and :meth:`close`
+    when done.
+
+    Parameters:
+        channel: pika channel to publish with
+        exchange: Exchange to publish to
+        routing_key: Routing key for the envelopes
+        max_records: Number of records in an envelope
+        max_bytes: Uncompressed size of an envelope in bytes
+        max_age: Maximum time in seconds a record waits to be published
+        compress: gzip the envelopes
+    """
+
+    def __init__(
+        self,
+        channel: 'Channel',
+        exchange: str,
+        routing_key: str = '',
+        max_records: int = 500,
+        max_bytes: int = 2**20,
+        max_age: float = 1,
+        compress: bool = True
+    ):
+        self.channel = channel
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+
+        self.stats = {'envelopes': 0, 'records': 0}
+
+        self._records = []
+        self._bytes = 0
+        self._oldest = None
+
+    def publish(self, message: 'IngestMessage') -> None:
+        """
+        Add a message to the current envelope
+
+        :param message: IngestMessage
+        """
+
+        record = json.dumps(message._asdict()) + '\n'
+
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+        self._records.append(record)
+        self._bytes += len(record)
+
+        if (
+            len(self._records) >= self.max_records
+            or self._bytes >= self.max_bytes
+            or time.monotonic() - self._oldest >= self.max_age
+        ):
+            self.flush()
+
+    def flush(self) -> Optional[int]:
+        """
+        Publish the current envelope
+
+        :return: Number of records published
+        """
+
+        if not self._records:
+            return None
+
+        import pika
+
+        body = ''.join(self._records).encode('utf-8')
+        properties = pika.BasicProperties(content_type='application/x-ndjson', delivery_mode=2)
+
+        if self.compress:
+            body = gzip.compress(body)
+            properties.content_encoding = 'gzip'
+
+        self.channel.basic_publish(
+            exchange=self.exchange,
+            routing_key=self.routing_key,
+            body=body,
+            properties=properties
+        )
+
+        count = len(self._records)
+        self.stats['envelopes'] += 1
+        self.stats['records'] += count
+
+        self._records = []
+        self._bytes = 0
+        self._oldest = None
+
+        logger.debug('Published envelope with %s records', count)
+        return count
+
+    def close(self) -> None:
+        self.flush()
@@ -0,0 +1,165 @@
+# encoding: utf-8
+"""
+Record of messages which have already been applied so that redeliveries
+after a reconnect can be acknowledged without processing them again.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from rabbit_indexer.utils import PathTools
+
+# Typing imports
+from typing import List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyCache:
+    """
+    Bounded set of applied message keys. The oldest keys are dropped once
+    the size limit is reached.
+
+    If a path is given, keys are appended to the file as they are added and
+    reloaded on start so that the record survives a restart. The file is
+    rewritten once it grows to twice the size limit.
+
+    Parameters:
+        size: Maximum number of keys to remember
+        path: Optional file to persist the keys to
+    """
+
+    def __init__(self, size: int = 100000, path: Optional[str] = None):
+        self.size = size
+        self.path = path
+        self.skipped = 0
+
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._writer = None
+        self._lines = 0
+
+        if self.path:
+            self._load()
+
+    @staticmethod
+    def key(message: 'IngestMessage') -> str:
+        """
+        Generate the key for a message
+
+        :param message: The parsed rabbitMQ message
+        :return: key string
+        """
+        return f'{PathTools.generate_id(message.filepath)}:{message.action}:{message.datetime}'
+
+    @classmethod
+    def envelope_key(cls, messages: List['IngestMessage']) -> str:
+        """
+        Generate the key for an envelope of messages. Envelopes are applied as
+        a whole so the key covers all of the records.
+
+        :param messages: The records in the envelope
+        :return: key string
+        """
+        digest = hashlib.sha1()
+        for message in messages:
+            digest.update(cls.key(message).encode())
+            digest.update(b'\n')
+
+        return f'envelope:{digest.hexdigest()}'
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str) -> None:
+        """
+        Record a key as applied
+
+        :param key: Key from :meth:`key`
+        """
+        with self._lock:
+            if key in self._keys:
+                return
+
+            self._add(key)
+
+            if self._writer:
+                self._writer.write(f'{key}\n')
+                self._writer.flush()
+                self._lines += 1
+
+                if self._lines > self.size * 2:
+                    self._compact()
+
+    def seen(self, key: str) -> bool:
+        """
+        Check if a key has already been applied and count it as skipped if so
+
+        :param key: Key from :meth:`key`
+        :return: True if the key has been applied
+        """
+        with self._lock:
+            if key in self._keys:
+                self.skipped += 1
+                return True
+
+        return False
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+
+    def _add(self, key: str) -> None:
+        self._keys[key] = None
+        if len(self._keys) > self.size:
+            self._keys.popitem(last=False)
+
+    def _load(self) -> None:
+        """
+        Load the keys from the persistence file and open it for appending
+        """
+
+        if os.path.exists(self.path):
+            with open(self.path) as reader:
+                for line in reader:
+                    line = line.strip()
+                    if line:
+                        self._add(line)
+
+            logger.info('Loaded %s applied message keys from %s', len(self._keys), self.path)
+
+        self._compact()
+
+    def _compact(self) -> None:
+        """
+        Rewrite the persistence file with only the keys currently held
+        """
+
+        if self._writer:
+            self._writer.close()
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as writer:
+            for key in self._keys:
+                writer.write(f'{key}\n')
+
+        os.replace(tmp_path, self.path)
+
+        self._writer = open(self.path, 'a')
+        self._lines = len(self._keys)
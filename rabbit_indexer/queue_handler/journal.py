@@ -0,0 +1,379 @@
+# encoding: utf-8
+"""
+Local write-ahead journal for the consumer.
+
+Messages are appended to a segmented log on local disk and acknowledged to the
+broker as soon as they have been synced, so the number of messages being
+processed is not limited by the prefetch and a crash does not cause every
+unacknowledged message to be redelivered. The consumer then processes the
+records from the journal and commits their offsets as they complete. On
+startup, the records after the last committed offset are replayed.
+
+Record format, after a header of the record length and its crc32::
+
+    <length: uint32><crc32: uint32><payload>
+
+Segments are named after the offset of their first record and are deleted once
+all of their records have been committed.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+# Typing imports
+from typing import Callable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>II')
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def read_segment(path: str) -> Tuple[List[bytes], int]:
+    """
+    Read the records in a segment. Reading stops at the first incomplete or
+    corrupt record, which is what a crash part way through a write leaves.
+
+    :param path: Segment file
+    :return: The records and the length of the valid part of the file
+    """
+
+    records = []
+    valid = 0
+
+    with open(path, 'rb') as reader:
+        data = reader.read()
+
+    while valid + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, valid)
+        start = valid + HEADER.size
+        payload = data[start:start + length]
+
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+
+        records.append(payload)
+        valid = start + length
+
+    return records, valid
+
+
+class Journal:
+    """
+    Segmented append-only log with batched fsync.
+
+    :meth:`append` writes a record and returns straight away. A sync thread
+    fsyncs the records written since the last sync together, then calls
+    their ``on_sync`` callbacks and makes them available from
+    :meth:`records`. Completed records are passed to :meth:`complete` and
+    the highest offset below which every record is complete is checkpointed.
+
+    Appends never block, as they are made from the connection thread. Once
+    ``max_backlog`` records are not complete the journal is :attr:`paused`
+    and the caller should stop taking new records. ``on_resume`` is called
+    when enough records have completed.
+
+    Parameters:
+        directory: Directory for the segments and checkpoint
+        segment_size: Size in bytes at which a new segment is started
+        sync_interval: Maximum seconds a record waits to be synced
+        checkpoint_interval: Seconds between checkpoints of the committed offset
+        max_backlog: Number of records which are not complete at which the journal is paused
+        resume_backlog: Number of records which are not complete at which the journal
+            resumes. Defaults to half of ``max_backlog``.
+        on_resume: Called from the thread which completed the record when the journal resumes
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = 64 * 2**20,
+        sync_interval: float = 0.05,
+        checkpoint_interval: float = 1,
+        max_backlog: int = 100000,
+        resume_backlog: Optional[int] = None,
+        on_resume: Optional[Callable[[], None]] = None
+    ):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.max_backlog = max_backlog
+        self.resume_backlog = max_backlog // 2 if resume_backlog is None else resume_backlog
+        self.on_resume = on_resume
+
+        self.stats = {'appended': 0, 'syncs': 0, 'replayed': 0, 'completed': 0}
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Offset of the first record of each segment
+        self._segments = []
+        self._file = None
+        self._next = 0
+        self._committed = 0
+        self._checkpointed = 0
+        self._completed = set()
+        self._unsynced = []
+
+        self._ready = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._closed = False
+        self._paused = False
+
+        self._recover()
+
+        self._sync_thread = threading.Thread(target=self._run_sync, name='journal-sync', daemon=True)
+        self._sync_thread.start()
+
+    @property
+    def committed(self) -> int:
+        """
+        Offset of the first record which is not complete
+        """
+        return self._committed
+
+    @property
+    def paused(self) -> bool:
+        """
+        True from when the backlog reaches ``max_backlog`` until it falls to ``resume_backlog``
+        """
+        return self._paused
+
+    def _segment_path(self, offset: int) -> str:
+        return os.path.join(self.directory, f'{offset:020d}{SEGMENT_SUFFIX}')
+
+    def _recover(self) -> None:
+        """
+        Read the checkpoint, truncate a partly written record at the end of the
+        last segment and queue the records after the checkpoint to be replayed
+        """
+
+        checkpoint_path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as reader:
+                self._committed = json.load(reader)['committed']
+        self._checkpointed = self._committed
+
+        self._segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+        self._next = self._committed
+        for start in self._segments:
+            path = self._segment_path(start)
+            records, valid = read_segment(path)
+
+            if valid < os.path.getsize(path):
+                logger.warning('Truncating %s bytes of partly written records from %s', os.path.getsize(path) - valid, path)
+                with open(path, 'r+b') as writer:
+                    writer.truncate(valid)
+
+            for offset, payload in enumerate(records, start):
+                if offset >= self._committed:
+                    self._ready.put((offset, payload))
+                    self.stats['replayed'] += 1
+
+            self._next = max(self._next, start + len(records))
+
+        if self.stats['replayed']:
+            logger.info('Replaying %s journal records from offset %s', self.stats['replayed'], self._committed)
+
+        self._paused = self._next - self._committed >= self.max_backlog
+
+        if self._segments and self._segments[-1] < self._next:
+            self._file = open(self._segment_path(self._segments[-1]), 'ab')
+        else:
+            self._open_segment()
+
+    def _open_segment(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+        if not self._segments or self._segments[-1] != self._next:
+            self._segments.append(self._next)
+        self._file = open(self._segment_path(self._next), 'ab')
+
+    def append(self, payload: bytes, on_sync: Optional[Callable[[], None]] = None) -> int:
+        """
+        Write a record. It is not passed on until it has been synced.
+
+        :param payload: Record
+        :param on_sync: Called from the sync thread once the record is on disk
+        :return: Offset of the record
+        """
+
+        with self._cond:
+            if self._closed:
+                raise ValueError('Journal is closed')
+
+            if self._file.tell() >= self.segment_size:
+                self._open_segment()
+
+            offset = self._next
+            self._file.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._next += 1
+            self._unsynced.append((offset, payload, on_sync))
+            self.stats['appended'] += 1
+
+            if not self._paused and self._next - self._committed >= self.max_backlog:
+                logger.warning('Journal backlog has reached %s records, pausing', self.max_backlog)
+                self._paused = True
+
+            self._cond.notify_all()
+
+        return offset
+
+    def complete(self, offset: int) -> None:
+        """
+        Mark a record as processed. Records can complete in any order.
+
+        :param offset: Offset of the record
+        """
+
+        with self._cond:
+            if offset < self._committed:
+                return
+
+            self._completed.add(offset)
+            while self._committed in self._completed:
+                self._completed.remove(self._committed)
+                self._committed += 1
+
+            self.stats['completed'] += 1
+
+            resume = self._paused and self._next - self._committed <= self.resume_backlog
+            if resume:
+                self._paused = False
+
+        if resume:
+            logger.info('Journal backlog is down to %s records, resuming', self.resume_backlog)
+            if self.on_resume is not None:
+                self.on_resume()
+
+    def records(self) -> Iterator[Tuple[int, bytes]]:
+        """
+        Replayed and newly synced records in offset order. Ends when the
+        journal is closed, leaving the records which have not been read to be
+        replayed on the next start.
+
+        :return: (offset, payload)
+        """
+
+        while True:
+            item = self._ready.get()
+            if item is None or self._closed:
+                return
+            yield item
+
+    def sync(self) -> None:
+        """
+        Sync the records written so far and pass them on
+        """
+
+        with self._cond:
+            batch = self._unsynced
+            self._unsynced = []
+            self._file.flush()
+
+            # A duplicate descriptor stays valid if the segment is rolled while syncing
+            fd = os.dup(self._file.fileno())
+
+        try:
+            if batch:
+                os.fsync(fd)
+                self.stats['syncs'] += 1
+        finally:
+            os.close(fd)
+
+        for offset, payload, on_sync in batch:
+            self._ready.put((offset, payload))
+            if on_sync is not None:
+                on_sync()
+
+    def checkpoint(self) -> None:
+        """
+        Write the committed offset and delete the segments which have been committed
+        """
+
+        with self._cond:
+            committed = self._committed
+            if committed == self._checkpointed:
+                return
+
+            # Every segment but the current one ends where the next starts
+            removable = [
+                start for start, end in zip(self._segments, self._segments[1:])
+                if end <= committed
+            ]
+
+        checkpoint_path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_file = f'{checkpoint_path}.tmp'
+        with open(tmp_file, 'w') as writer:
+            json.dump({'committed': committed}, writer)
+            writer.flush()
+            os.fsync(writer.fileno())
+        os.replace(tmp_file, checkpoint_path)
+
+        with self._cond:
+            self._checkpointed = committed
+            for start in removable:
+                self._segments.remove(start)
+
+        for start in removable:
+            os.remove(self._segment_path(start))
+
+    def _run_sync(self) -> None:
+        # Records appended while a sync is running are synced together by the next one
+        last_checkpoint = time.monotonic()
+
+        while True:
+            with self._cond:
+                if not self._unsynced and not self._closed:
+                    self._cond.wait(self.sync_interval)
+                closed = self._closed
+
+            try:
+                self.sync()
+
+                if closed or time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    self.checkpoint()
+                    last_checkpoint = time.monotonic()
+            except Exception:
+                logger.exception('Failed to sync the journal')
+
+            if closed:
+                return
+
+    def close(self) -> None:
+        """
+        Sync any remaining records and stop passing records on. Records which
+        have not completed are replayed on the next start.
+        """
+
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        self._sync_thread.join()
+        self._ready.put(None)
+
+        with self._cond:
+            self._file.close()
@@ -0,0 +1,330 @@
+# encoding: utf-8
+"""
+Monitor for the queue backlog and the deposit lag.
+
+Periodically reads the message and consumer counts for the consumed queues
+with passive declares, estimates how long the backlog will take to drain from
+the recent rate of processed messages and recommends the number of consumers needed to drain it
+within ``target_drain_time``. The recommendation is logged, can be written to a
+Prometheus textfile and can be passed to a hook, so that it can be used to
+autoscale the consumers.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pydoc import locate
+
+# Typing imports
+from typing import Callable, List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pika.connection import Connection
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'rabbit_indexer'
+
+
+class BacklogMonitor:
+    """
+    Samples the queue backlog and recommends a number of consumers.
+
+    Processed messages are counted by the consumer with :meth:`record_ack`.
+    Messages are tracked from when they are taken from the queue until they
+    have been processed with :meth:`hold`, :meth:`record_deposit` and
+    :meth:`release`, so that the deposit lag is the age of the oldest deposit
+    still waiting. The queues are read on a separate connection in the
+    monitor thread.
+
+    Parameters:
+        connect: Callable which returns a new pika connection
+        queues: Names of the queues to monitor
+        interval: Seconds between samples
+        window: Number of samples used to calculate the rates
+        target_drain_time: Time in seconds the backlog should be drained in
+        min_workers: Minimum recommended consumers
+        max_workers: Maximum recommended consumers
+        metrics_file: Optional Prometheus textfile to write the metrics to
+        hook: Optional callable, or dotted path to one, called with the stats after each sample
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], 'Connection'],
+        queues: List[str],
+        interval: float = 30,
+        window: int = 10,
+        target_drain_time: float = 300,
+        min_workers: int = 1,
+        max_workers: int = 16,
+        metrics_file: Optional[str] = None,
+        hook=None
+    ):
+        self.connect = connect
+        self.queues = queues
+        self.interval = interval
+        self.target_drain_time = target_drain_time
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.metrics_file = metrics_file
+
+        if isinstance(hook, str):
+            hook_path = hook
+            hook = locate(hook_path)
+            if not callable(hook):
+                raise ValueError(f'Monitor hook {hook_path} is not a callable')
+        self.hook = hook
+
+        self.stats = {}
+
+        self._acks = 0
+        self._held = {}
+        self._keys = itertools.count()
+        self._last_deposit = None
+        self._samples = deque(maxlen=max(window, 2))
+        self._lock = threading.Lock()
+        self._connection = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record_ack(self) -> None:
+        """
+        Count a processed message. Called from the consumer threads.
+        """
+        with self._lock:
+            self._acks += 1
+
+    def hold(self) -> int:
+        """
+        Start tracking a message taken from the queue
+
+        :return: Key to pass to :meth:`record_deposit` and :meth:`release`
+        """
+        key = next(self._keys)
+        with self._lock:
+            self._held[key] = None
+        return key
+
+    def record_deposit(self, key: int, deposit_time: str) -> None:
+        """
+        Record the deposit time of a held message. The time is parsed when
+        the monitor samples.
+
+        :param key: From :meth:`hold`
+        :param deposit_time: ``IngestMessage.datetime``
+        """
+        with self._lock:
+            if key in self._held:
+                self._held[key] = deposit_time
+
+    def release(self, key: int) -> None:
+        """
+        Stop tracking a message once it has been processed
+
+        :param key: From :meth:`hold`
+        """
+        with self._lock:
+            deposit_time = self._held.pop(key, None)
+            if deposit_time is not None:
+                self._last_deposit = deposit_time
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='backlog-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._close()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.publish(self.sample())
+            except Exception:
+                logger.warning('Failed to sample the queue backlog', exc_info=True)
+                self._close()
+
+    def _close(self) -> None:
+        if self._connection is not None and self._connection.is_open:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+        self._connection = None
+
+    def _queue_counts(self) -> dict:
+        """
+        :return: {queue: (message_count, consumer_count)}
+        """
+
+        if self._connection is None or not self._connection.is_open:
+            self._connection = self.connect()
+
+        channel = self._connection.channel()
+        counts = {}
+        try:
+            for queue in self.queues:
+                result = channel.queue_declare(queue=queue, passive=True)
+                counts[queue] = (result.method.message_count, result.method.consumer_count)
+        finally:
+            channel.close()
+
+        return counts
+
+    def _deposit_lag(self) -> Optional[float]:
+        """
+        The queues are consumed in order, so the oldest deposit still waiting
+        is the oldest one held by the consumer. If none are held, the next
+        message in the queue was deposited no earlier than the last one
+        processed.
+
+        :return: Seconds since the oldest deposit still waiting
+        """
+        with self._lock:
+            deposits = [deposit for deposit in self._held.values() if deposit is not None]
+            if not deposits and self._last_deposit is not None:
+                deposits = [self._last_deposit]
+
+        if not deposits:
+            return None
+
+        from dateutil.parser import parse
+
+        oldest = None
+        for deposit in deposits:
+            try:
+                deposit_time = parse(deposit)
+            except (ValueError, OverflowError):
+                continue
+            if oldest is None or deposit_time < oldest:
+                oldest = deposit_time
+
+        if oldest is None:
+            return None
+
+        return max((datetime.now() - oldest).total_seconds(), 0)
+
+    def sample(self) -> dict:
+        """
+        Read the queues and calculate the rates and the recommendation
+
+        :return: stats dict
+        """
+
+        counts = self._queue_counts()
+        now = time.monotonic()
+
+        with self._lock:
+            acks = self._acks
+
+        backlog = sum(messages for messages, _ in counts.values())
+        consumers = max((consumers for _, consumers in counts.values()), default=0)
+
+        self._samples.append((now, acks, backlog))
+        first_time, first_acks, first_backlog = self._samples[0]
+        elapsed = now - first_time
+
+        ack_rate = (acks - first_acks) / elapsed if elapsed else 0.0
+
+        # The ack rate is for this consumer. The queue is drained by all of its consumers.
+        drain_rate = ack_rate * max(consumers, 1)
+        inflow_rate = max((backlog - first_backlog) / elapsed + drain_rate, 0) if elapsed else 0.0
+
+        drain_time = backlog / drain_rate if drain_rate else (0.0 if not backlog else math.inf)
+
+        self.stats = {
+            'queues': {queue: messages for queue, (messages, _) in counts.items()},
+            'backlog': backlog,
+            'consumers': consumers,
+            'ack_rate': ack_rate,
+            'inflow_rate': inflow_rate,
+            'drain_time': drain_time,
+            'deposit_lag': self._deposit_lag() if backlog else 0.0,
+            'recommended_workers': self.recommend(backlog, consumers, ack_rate, inflow_rate),
+        }
+        return self.stats
+
+    def recommend(self, backlog: int, consumers: int, ack_rate: float, inflow_rate: float) -> int:
+        """
+        The number of consumers needed to keep up with the inflow and drain
+        the backlog within ``target_drain_time``
+
+        :param backlog: Messages waiting in the queues
+        :param consumers: Current number of consumers
+        :param ack_rate: Messages per second acknowledged by this consumer
+        :param inflow_rate: Messages per second arriving in the queues
+        :return: Recommended number of consumers
+        """
+
+        if ack_rate > 0:
+            required_rate = inflow_rate + backlog / self.target_drain_time
+            workers = math.ceil(required_rate / ack_rate)
+
+        elif backlog:
+            # No throughput measured yet
+            workers = consumers
+
+        else:
+            workers = self.min_workers
+
+        return min(max(workers, self.min_workers), self.max_workers)
+
+    def publish(self, stats: dict) -> None:
+        """
+        Log the stats, write the metrics file and call the hook
+        """
+
+        deposit_lag = stats['deposit_lag']
+        logger.info(
+            'Backlog: %s messages, %s consumers, %.1f acks/s, drain time %.0fs, deposit lag %ss, recommended workers: %s',
+            stats['backlog'], stats['consumers'], stats['ack_rate'], stats['drain_time'],
+            'unknown' if deposit_lag is None else f'{deposit_lag:.0f}', stats['recommended_workers']
+        )
+
+        if self.metrics_file:
+            self.write_metrics(stats)
+
+        if self.hook is not None:
+            try:
+                self.hook(stats)
+            except Exception:
+                logger.exception('Monitor hook failed')
+
+    def write_metrics(self, stats: dict) -> None:
+        """
+        Write the stats in the Prometheus text format. The file is replaced
+        atomically so that a scrape never sees a partial file.
+        """
+
+        lines = [
+            f'# TYPE {METRIC_PREFIX}_queue_messages gauge',
+            *(
+                f'{METRIC_PREFIX}_queue_messages{{queue="{queue}"}} {messages}'
+                for queue, messages in stats['queues'].items()
+            ),
+        ]
+
+        for name in ('consumers', 'ack_rate', 'inflow_rate', 'drain_time', 'deposit_lag', 'recommended_workers'):
+            value = stats[name]
+            if value is None:
+                continue
+            value = '+Inf' if value == math.inf else value
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} gauge')
+            lines.append(f'{METRIC_PREFIX}_{name} {value}')
+
+        tmp_file = f'{self.metrics_file}.tmp'
+        with open(tmp_file, 'w') as writer:
+            writer.write('\n'.join(lines) + '\n')
+        os.replace(tmp_file, self.metrics_file)
@@ -0,0 +1,153 @@
+# encoding: utf-8
+"""
+Priority ordering of the pending tasks for a queue by the message action.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+
+# Typing imports
+from typing import Callable, Dict, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+# Directory events and readme updates change the archive browser straight away
+DEFAULT_WEIGHTS = {
+    'MKDIR': 10,
+    'RMDIR': 10,
+    'SYMLINK': 10,
+    'README': 10,
+}
+
+
+def action_class(message: Optional['IngestMessage']) -> Optional[str]:
+    """
+    The class used to look up the weight of a message. This is the action,
+    except for deposits of 00README files which are ``README``.
+
+    :param message: IngestMessage or None
+    :return: action class
+    """
+    if message is None:
+        return None
+
+    if os.path.basename(message.filepath) == '00README':
+        return 'README'
+
+    return message.action
+
+
+class ActionPriorityQueue:
+    """
+    Pending tasks ordered by the weight of their message action.
+
+    A task is keyed by ``arrival - weight * aging``, so a task with a higher weight
+    runs first but every task gains the equivalent of one unit of weight for every
+    ``aging`` seconds it waits. A deposit can therefore wait at most
+    ``(max weight - deposit weight) * aging`` seconds behind directory events.
+
+    Tasks for the same path run in the order they were submitted and never at
+    the same time. A task only becomes ready once the tasks before it for its
+    path have finished.
+
+    The queue is not thread safe. It is used within the lock of
+    :class:`rabbit_indexer.queue_handler.scheduler.WeightedFairScheduler`.
+
+    Parameters:
+        weights: Mapping of action class to weight. Unknown actions have ``default_weight``
+        default_weight: Weight for actions not in weights
+        aging: Seconds a task waits to gain one unit of weight
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, default_weight: float = 1, aging: float = 10):
+        self.weights = DEFAULT_WEIGHTS if weights is None else weights
+        self.default_weight = default_weight
+        self.aging = aging
+
+        self._ready = []
+        self._waiting = {}
+        self._running = {}
+        self._active = set()
+        self._count = 0
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __bool__(self) -> bool:
+        """
+        True if a task is ready to run
+        """
+        return bool(self._ready)
+
+    def weight(self, message: Optional['IngestMessage']) -> float:
+        return self.weights.get(action_class(message), self.default_weight)
+
+    def append(self, task: Callable[[], None], message: Optional['IngestMessage'] = None) -> None:
+        """
+        Add a task
+
+        :param task: Callable to run
+        :param message: The message the task processes. Used for the weight and path.
+        """
+
+        key = time.monotonic() - self.weight(message) * self.aging
+        path = message.filepath if message is not None else None
+        entry = (key, next(self._seq), task, path)
+
+        self._count += 1
+
+        if path is not None:
+            # Only one task for a path is ready or running at a time
+            if path in self._active:
+                self._waiting.setdefault(path, deque()).append(entry)
+                return
+            self._active.add(path)
+
+        heapq.heappush(self._ready, entry)
+
+    def popleft(self) -> Callable[[], None]:
+        """
+        Remove the next task. :meth:`done` must be called once it has run.
+        """
+
+        _, _, task, path = heapq.heappop(self._ready)
+        self._count -= 1
+        self._running[id(task)] = path
+        return task
+
+    def done(self, task: Callable[[], None]) -> None:
+        """
+        Mark a task as finished, making the next task for its path ready
+        """
+
+        path = self._running.pop(id(task), None)
+        if path is None:
+            return
+
+        waiting = self._waiting.get(path)
+        if not waiting:
+            self._active.discard(path)
+            return
+
+        heapq.heappush(self._ready, waiting.popleft())
+        if not waiting:
+            del self._waiting[path]
+
+    def clear(self) -> None:
+        """
+        Drop the pending tasks. Running tasks are still tracked until they are done.
+        """
+
+        self._ready = []
+        self._waiting = {}
+        self._active = set(path for path in self._running.values() if path is not None)
+        self._count = 0
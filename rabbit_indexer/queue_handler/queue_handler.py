@@ -8,20 +8,31 @@ __copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
 __license__ = 'BSD - see LICENSE file in top-level package directory'
 __contact__ = 'richard.d.smith@stfc.ac.uk'
 
-import pika
 from rabbit_indexer.utils import YamlConfig
 import logging
 import functools
 from collections import namedtuple
 import json
+import gzip
+import signal
+import threading
+from rabbit_indexer.utils.config_watcher import ConfigWatcher
+from .scheduler import WeightedFairScheduler
+from .idempotency import IdempotencyCache
+from .sharding import ShardingConfig
+from .monitor import BacklogMonitor
+from .journal import Journal
+from .envelope import GZIP_MAGIC
 
 # Typing imports
-from pika.channel import Channel
-from pika.connection import Connection
-from pika.frame import Method
-from pika.frame import Header
+from typing import Callable, List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pika.channel import Channel
+    from pika.connection import Connection
+    from pika.frame import Method
+    from pika.frame import Header
 
-logger = logging.getLogger()
+logger = logging.getLogger(__name__)
 
 elastic_logger = logging.getLogger('elasticsearch')
 elastic_logger.setLevel(logging.WARNING)
@@ -60,7 +71,7 @@ class QueueHandler:
             filesize = split_line[5]
             message = ":".join(split_line[6:])
 
-        :param body: Message body, either a json string or text
+        :param body: Message body or a single record from an envelope, either a json string or text
         :return: IngestMessage
             {
                 'datetime': ':'.join(split_line[:3]),
@@ -73,7 +84,8 @@ class QueueHandler:
         """
 
         # Decode the byte string to utf-8
-        body = body.decode('utf-8')
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
 
         try:
             msg = json.loads(body)
@@ -93,6 +105,39 @@ class QueueHandler:
 
         return IngestMessage(**msg)
 
+    @staticmethod
+    def decode_messages(body: bytes) -> List[IngestMessage]:
+        """
+        Decode a message which may be an envelope of many records. Envelopes
+        are a JSON array of records or newline delimited records, optionally
+        gzip compressed. Records can be in either of the formats accepted by
+        :meth:`decode_message`.
+
+        :param body: Message body
+        :return: list of IngestMessages
+        """
+
+        if body[:2] == GZIP_MAGIC:
+            body = gzip.decompress(body)
+
+        text = body.decode('utf-8').strip()
+
+        try:
+            doc = json.loads(text)
+        except json.JSONDecodeError:
+            doc = None
+
+        if isinstance(doc, dict):
+            return [IngestMessage(**doc)]
+
+        if isinstance(doc, list):
+            return [
+                IngestMessage(**record) if isinstance(record, dict) else QueueHandler.decode_message(record)
+                for record in doc
+            ]
+
+        return [QueueHandler.decode_message(line) for line in text.splitlines() if line.strip()]
+
     def __init__(self, conf: YamlConfig):
         """
 
@@ -101,20 +146,81 @@ class QueueHandler:
 
         self.conf = conf
         self.queue_handler = None
+        self.sharding = ShardingConfig.from_conf(conf)
+        self.channels = []
+        self.connection = None
+        self.scheduler = None
+        self.idempotency = None
+        self.config_watcher = None
+        self.monitor = None
+        self.journal = None
+        self._journal_thread = None
+        self._pending_keys = {}
+        self._generation = 0
+        self._channel_queues = []
+        self._consumer_tags = {}
+        self._topology_declared = False
 
         # Init event handlers
         self.get_handlers()
+        self._setup_scheduler()
+        self._setup_idempotency()
+        self._setup_reload()
+        self._setup_monitor()
+        self._setup_journal()
 
     def get_handlers(self):
-        logger.info('Initialising handler')
-        self.queue_handler = self.HANDLER_CLASS(conf=self.conf)
+        """
+        Create the handler. If ``indexer.handlers`` is set, the listed handlers
+        are run together by a :class:`HandlerGroup`.
+        """
+
+        handlers = self.conf.get('indexer', 'handlers')
+
+        if not handlers:
+            logger.info('Initialising handler')
+            self.queue_handler = self.HANDLER_CLASS(conf=self.conf)
+            return
+
+        from pydoc import locate
+        from rabbit_indexer.index_updaters.group import HandlerGroup
+
+        handler_classes = []
+        for handler in handlers:
+            handler_class = locate(handler)
+            if handler_class is None:
+                raise ValueError(f'Unable to import handler {handler}')
+            handler_classes.append(handler_class)
+
+        logger.info('Initialising handlers: %s', ', '.join(handlers))
+        self.queue_handler = HandlerGroup(
+            conf=self.conf,
+            handler_classes=handler_classes,
+            retries=self.conf.get('indexer', 'handler_retries', default=2),
+            backoff=self.conf.get('indexer', 'handler_backoff', default=1)
+        )
 
     def _connect(self):
         """
-        Start Pika connection to server. This is run in each thread.
+        Start Pika connection to server and check the exchanges and queues.
+        This is run in each thread.
+
+        :return: pika connection
+        """
+
+        connection = self._open_connection()
+
+        self._declare_topology(connection)
+
+        return connection
 
-        :return: pika channel
+    def _open_connection(self):
         """
+        Open a connection to the rabbit server
+
+        :return: pika connection
+        """
+        import pika
 
         # Get the username and password for rabbit
         rabbit_user = self.conf.get('rabbit_server', 'user')
@@ -137,39 +243,461 @@ class QueueHandler:
             )
         )
 
+        return connection
+
+    def _start_consuming(self, connection: 'Connection'):
+        """
+        Start consuming from the configured queues. Each queue is consumed on
+        its own channel so that the prefetch for one queue does not hold back
+        deliveries from the others.
+
+        :param connection: pika connection
+        """
+
+        self.connection = connection
+        self.channels = []
+        self._channel_queues = []
+        self._consumer_tags = {}
+
+        # Messages in flight on the old connection will be redelivered. Delivery
+        # tags start again on each connection so the keys are kept per generation.
+        self._generation += 1
+        self._pending_keys = {}
+
+        # Handlers which hold deliveries until their output is written need a larger prefetch
+        default_prefetch = self.queue_handler.default_prefetch() if self.queue_handler is not None else 1
+
+        for queue in self._queue_configs():
+
+            # Each queue gets its own channel and prefetch
+            queue_channel = connection.channel()
+            queue_channel.basic_qos(prefetch_count=queue.get('prefetch', default_prefetch))
+
+            self.channels.append(queue_channel)
+            self._channel_queues.append((queue_channel, queue))
+
+        # A full journal left from the last run is worked through first
+        if self.journal is not None and self.journal.paused:
+            logger.warning('Journal backlog is full, waiting for it to drain before consuming')
+            return
+
+        self._consume(connection)
+
+    def _consume(self, connection: 'Connection'):
+        """
+        Register the consumers on the queue channels
+
+        :param connection: pika connection
+        """
+
+        for queue_channel, queue in self._channel_queues:
+
+            # Set callback
+            callback = functools.partial(self._on_message, queue=queue['name'], connection=connection)
+            self._consumer_tags[queue_channel] = queue_channel.basic_consume(
+                queue=queue['name'],
+                on_message_callback=callback,
+                auto_ack=False,
+                exclusive=queue.get('exclusive', False)
+            )
+
+    def _pause_consuming(self):
+        """
+        Cancel the consumers while the journal backlog is full. Deliveries which
+        have not reached the callback are returned to the queue by pika.
+        The connection keeps running so heartbeats are still answered.
+        """
+
+        for queue_channel, consumer_tag in self._consumer_tags.items():
+            if queue_channel.is_open:
+                queue_channel.basic_cancel(consumer_tag)
+
+        self._consumer_tags = {}
+
+    def _resume_consuming(self):
+        """
+        Register the consumers again once the journal has drained. Run in the
+        connection thread.
+        """
+
+        if self._consumer_tags or self.journal.paused:
+            return
+
+        if self.connection is None or not self.connection.is_open:
+            return
+
+        self._consume(self.connection)
+
+    def _journal_resumed(self):
+        """
+        Called by the journal from a worker thread when the backlog has drained
+        """
+
+        connection = self.connection
+        if connection is not None and connection.is_open:
+            connection.add_callback_threadsafe(self._resume_consuming)
+
+    def _wait_until_ready(self, connection: 'Connection'):
+        """
+        Wait for the handler to finish loading the data it needs, keeping
+        the connection alive while waiting.
+
+        :param connection: pika connection
+        """
+
+        while not self.queue_handler.wait_until_ready(timeout=1):
+            connection.process_data_events(time_limit=0)
+
+    def _declare_topology(self, connection: 'Connection'):
+        """
+        Declare the exchanges and queues. Once the topology has been declared,
+        reconnects only check that it still exists using passive declares.
+        If ``rabbit_server.passive_declare`` is set, the topology is never
+        created by the consumer.
+
+        :param connection: pika connection
+        """
+        import pika
+
+        passive_only = self.conf.get('rabbit_server', 'passive_declare', default=False)
+
+        if self._topology_declared or passive_only:
+            try:
+                self._declare(connection, passive=True)
+                return
+            except pika.exceptions.ChannelClosedByBroker as e:
+                if passive_only:
+                    raise
+                logger.warning('Topology missing on the server, redeclaring', exc_info=e)
+
+        self._declare(connection)
+        self._topology_declared = True
+
+    def _declare(self, connection: 'Connection', passive: bool = False):
+        """
+        Declare the exchanges and queues and bind them together.
+        Bindings are only created when not passive.
+
+        :param connection: pika connection
+        :param passive: Only check that the exchanges and queues exist
+        """
+
         # Get the exchanges to bind
         src_exchange = self.conf.get('rabbit_server', 'source_exchange')
         dest_exchange = self.conf.get('rabbit_server', 'dest_exchange')
 
-        # Create a new channel
         channel = connection.channel()
-        channel.basic_qos(prefetch_count=1)
 
         # Declare relevant exchanges
-        channel.exchange_declare(exchange=src_exchange['name'], exchange_type=src_exchange['type'])
-        channel.exchange_declare(exchange=dest_exchange['name'], exchange_type=dest_exchange['type'])
+        channel.exchange_declare(exchange=src_exchange['name'], exchange_type=src_exchange['type'], passive=passive)
+        channel.exchange_declare(exchange=dest_exchange['name'], exchange_type=dest_exchange['type'], passive=passive)
 
         # Bind source exchange to dest exchange
-        channel.exchange_bind(destination=dest_exchange['name'], source=src_exchange['name'])
+        if not passive:
+            channel.exchange_bind(destination=dest_exchange['name'], source=src_exchange['name'])
+
+        # Declare the exchange the sharded queues are bound to
+        if self.sharding:
+            channel.exchange_declare(
+                exchange=self.sharding.exchange,
+                exchange_type=self.sharding.exchange_type,
+                durable=True,
+                passive=passive
+            )
 
         # Declare queue and bind queue to the dest exchange
-        queues = self.conf.get('rabbit_server', 'queues')
-        for queue in queues:
+        for queue in self._queue_configs(declare=True):
 
             declare_kwargs = queue.get('kwargs',{})
             bind_kwargs = queue.get('bind_kwargs',{})
+            exchange = queue.get('exchange', dest_exchange['name'])
 
-            channel.queue_declare(queue=queue['name'], **declare_kwargs)
-            channel.queue_bind(exchange=dest_exchange['name'], queue=queue['name'], **bind_kwargs)
+            if passive:
+                channel.queue_declare(queue=queue['name'], passive=True)
+            else:
+                channel.queue_declare(queue=queue['name'], **declare_kwargs)
+                channel.queue_bind(exchange=exchange, queue=queue['name'], **bind_kwargs)
 
-            # Set callback
-            callback = functools.partial(self.callback, connection=connection)
-            channel.basic_consume(queue=queue['name'], on_message_callback=callback, auto_ack=False)
+        channel.close()
+
+    def _queue_configs(self, declare: bool = False) -> List[dict]:
+        """
+        The queues to consume from. These are the configured queues unless
+        sharding is configured, in which case they are the shard queues claimed
+        by this instance.
+
+        :param declare: Return the queues to declare rather than consume
+        :return: list of queue config dicts
+        """
+
+        if self.sharding:
+            return self.sharding.claimed_queues()
+
+        return self.conf.get('rabbit_server', 'queues')
+
+    def _setup_idempotency(self):
+        """
+        Create the cache of applied messages used to skip redeliveries.
+        Configured by ``indexer.idempotency``.
+        """
+
+        options = self.conf.get('indexer', 'idempotency')
+        if not options:
+            return
+
+        self.idempotency = IdempotencyCache(
+            size=options.get('size', 100000),
+            path=options.get('path')
+        )
+
+    def _setup_reload(self):
+        """
+        Reload the configuration on SIGHUP and, if ``indexer.reload_interval`` is
+        set, when the config files change. The reload is applied in the connection
+        thread between messages.
+        """
+
+        self._reload_requested = threading.Event()
+
+        if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda signum, frame: self._reload_requested.set())
+
+        interval = self.conf.get('indexer', 'reload_interval')
+        if interval and self.conf.files:
+            self.config_watcher = ConfigWatcher(self.conf.files, self._reload_requested.set, interval)
+            self.config_watcher.start()
+
+    def _check_reload(self):
+        """
+        Apply a requested config reload. Failures are logged and the current
+        config is kept.
+        """
+
+        if not self._reload_requested.is_set():
+            return
+
+        self._reload_requested.clear()
+
+        try:
+            conf = self.conf.reload()
+            if self.queue_handler is not None:
+                self.queue_handler.reload_config(conf)
+        except Exception:
+            logger.exception('Failed to reload config, keeping the current config')
+            return
+
+        self.conf = conf
+
+    def _setup_monitor(self):
+        """
+        Start the backlog monitor if ``rabbit_server.monitor`` is set. The monitor
+        uses its own connection as pika connections are not thread safe.
+        """
+
+        options = self.conf.get('rabbit_server', 'monitor')
+        if not options:
+            return
+
+        self.monitor = BacklogMonitor(
+            connect=self._open_connection,
+            queues=[queue['name'] for queue in self._queue_configs()],
+            **options
+        )
+        self.monitor.start()
+
+    def _setup_scheduler(self):
+        """
+        Create the scheduler used to share the worker threads between the queues.
+        If ``rabbit_server.workers`` is not set, messages are handled in the
+        connection thread as they arrive, unless ``rabbit_server.priority`` is
+        set which needs a worker to reorder the messages.
+        """
+
+        priority = self.conf.get('rabbit_server', 'priority')
+        workers = self.conf.get('rabbit_server', 'workers', default=1 if priority else None)
+        if not workers:
+            return
+
+        queues = {
+            queue['name']: {
+                'weight': queue.get('weight', 1),
+                'concurrency': queue.get('concurrency', 1)
+            }
+            for queue in self._queue_configs()
+        }
+
+        if priority is True:
+            priority = {}
 
-        return channel
+        self.scheduler = WeightedFairScheduler(workers, queues, priority=priority or None)
+        self.scheduler.start()
+
+    def _setup_journal(self):
+        """
+        Create the write-ahead journal if ``indexer.journal`` is set and start
+        the thread which processes the records from it. Records left over from
+        the last run are replayed first.
+        """
+
+        options = self.conf.get('indexer', 'journal')
+        if not options:
+            return
+
+        self.journal = Journal(on_resume=self._journal_resumed, **options)
+
+        self._journal_thread = threading.Thread(target=self._run_journal, name='journal-reader', daemon=True)
+        self._journal_thread.start()
+
+    def _run_journal(self):
+        """
+        Pass the records from the journal to the handler. A record is
+        committed once it has been processed and its output written.
+        """
+
+        for offset, record in self.journal.records():
+            queue, body = record.split(b'\n', 1)
+
+            done = functools.partial(self._journal_done, offset, body)
+            nack = None
+            if self.queue_handler.NACK_FAILED:
+                nack = functools.partial(self._journal_failed, offset)
+
+            task = functools.partial(self.process_body, body, done, nack)
+            self._submit(queue.decode(), body, task)
+
+    def _journal_done(self, offset: int, body: bytes):
+        """
+        Record the message as applied and commit it. This is only done once
+        it has been processed, so a record replayed after a crash is not skipped.
+        """
+        if self.idempotency is not None:
+            key = self._idempotency_key(body)
+            if key:
+                self.idempotency.add(key)
+
+        # Messages are acknowledged when they are synced, so the processed records are counted here
+        if self.monitor is not None:
+            self.monitor.record_ack()
+
+        self.journal.complete(offset)
+
+    def _journal_failed(self, offset: int):
+        """
+        Failed records cannot be dead lettered once they have been acknowledged,
+        so they are logged and committed
+        """
+        logger.error('Failed to process journal record %s', offset)
+
+        if self.monitor is not None:
+            self.monitor.record_ack()
+
+        self.journal.complete(offset)
+
+    def _on_message(self, ch: 'Channel', method: 'Method', properties: 'Header', body: bytes, queue: str, connection: 'Connection'):
+        """
+        Message callback registered with pika. Passes the message on to
+        :meth:`callback`, through the scheduler if one is configured.
+        If the journal is configured, the message is appended to it instead
+        and acknowledged once it has been synced.
+
+        :param queue: The name of the queue the message came from
+        """
+
+        self._check_reload()
+
+        if self.idempotency is not None and self._skip_applied(ch, method, body):
+            return
+
+        if self.journal is not None:
+            ack = functools.partial(self.acknowledge_message, ch, method.delivery_tag, connection)
+            self.journal.append(queue.encode() + b'\n' + body, on_sync=ack)
+
+            # Blocking here would stop the heartbeats, so the consumers are cancelled instead
+            if self.journal.paused and self._consumer_tags:
+                self._pause_consuming()
+            return
+
+        task = functools.partial(self.callback, ch, method, properties, body, connection=connection)
+        self._submit(queue, body, task)
+
+    def _submit(self, queue: str, body: bytes, task: Callable[[], None]):
+        """
+        Run a task for a message, through the scheduler if one is configured
+
+        :param queue: The name of the queue the message came from
+        :param body: Message body, used to prioritise the task
+        :param task: Callable which processes the message
+        """
+
+        if self.scheduler is None:
+            task()
+            return
+
+        message = None
+        if self.scheduler.prioritised:
+            try:
+                messages = self.decode_messages(body)
+            except Exception:
+                # Left for the callback to report
+                messages = []
+
+            # Envelopes are not prioritised
+            if len(messages) == 1:
+                message = messages[0]
+
+        self.scheduler.submit(queue, task, message=message)
+
+    def _skip_applied(self, ch: 'Channel', method: 'Method', body: bytes) -> bool:
+        """
+        Acknowledge redelivered messages which have already been applied.
+        Otherwise remember the key for the delivery so it can be recorded
+        as applied when the message is acknowledged.
+
+        :return: True if the message has been acknowledged and should be skipped
+        """
+
+        key = self._idempotency_key(body)
+        if key is None:
+            return False
+
+        if method.redelivered and self.idempotency.seen(key):
+            logger.debug('Skipping already applied message: %s', key)
+            ch.basic_ack(method.delivery_tag)
+            return True
+
+        # Journal records are recorded as applied when they complete
+        if self.journal is None:
+            self._pending_keys[(self._generation, ch.channel_number, method.delivery_tag)] = key
+
+        return False
+
+    def _idempotency_key(self, body: bytes) -> Optional[str]:
+        """
+        :param body: Message body
+        :return: Key for the message or envelope. None if it cannot be decoded
+        """
+
+        try:
+            messages = self.decode_messages(body)
+            if len(messages) == 1:
+                return self.idempotency.key(messages[0])
+            return self.idempotency.envelope_key(messages)
+        except Exception:
+            # Let the handler deal with messages which cannot be decoded
+            return None
+
+    def _current_generation(self, connection: 'Connection') -> Optional[int]:
+        """
+        :param connection: Connection the message was delivered on
+        :return: The generation of the connection, or None if it has been replaced
+        """
+        generation = self._generation
+        if self.connection is not None and connection is not self.connection:
+            return None
+        return generation
 
     @staticmethod
-    def _acknowledge_message(channel: Channel, delivery_tag: str):
+    def _acknowledge_message(channel: 'Channel', delivery_tag: str):
         """
         Acknowledge message
 
@@ -177,11 +705,11 @@ class QueueHandler:
         :param delivery_tag: Message id
         """
 
-        logger.debug(f'Acknowledging message: {delivery_tag}')
+        logger.debug('Acknowledging message: %s', delivery_tag)
         if channel.is_open:
             channel.basic_ack(delivery_tag)
 
-    def acknowledge_message(self, channel: Channel, delivery_tag: str, connection: Connection):
+    def acknowledge_message(self, channel: 'Channel', delivery_tag: str, connection: 'Connection'):
         """
         Acknowledge message and move onto the next. All of the required
         params come from the message callback params.
@@ -190,12 +718,64 @@ class QueueHandler:
         :param delivery_tag: from the callback method param. eg. method.delivery_tag
         :param connection: connection object from the callback param
         """
+        generation = self._current_generation(connection)
+        if generation is None:
+            # Redelivered on the new connection, where the same tag can belong to another message
+            logger.debug('Dropping acknowledgement from a previous connection: %s', delivery_tag)
+            return
+
+        if self.idempotency is not None:
+            key = self._pending_keys.pop((generation, channel.channel_number, delivery_tag), None)
+            if key:
+                self.idempotency.add(key)
+
+        if self.monitor is not None and self.journal is None:
+            self.monitor.record_ack()
+
+        if not connection.is_open:
+            return
+
         cb = functools.partial(self._acknowledge_message, channel, delivery_tag)
         connection.add_callback_threadsafe(cb)
 
-    def callback(self, ch: Channel, method: Method, properties: Header, body: bytes, connection: Connection):
+    @staticmethod
+    def _reject_message(channel: 'Channel', delivery_tag: str):
+        """
+        Reject message without requeueing it. It is dead lettered if the
+        queue has a dead letter exchange.
+
+        :param channel: Channel which message came from
+        :param delivery_tag: Message id
+        """
+
+        logger.debug('Rejecting message: %s', delivery_tag)
+        if channel.is_open:
+            channel.basic_nack(delivery_tag, requeue=False)
+
+    def reject_message(self, channel: 'Channel', delivery_tag: str, connection: 'Connection'):
+        """
+        Reject a message which failed. The parameters are the same as :meth:`acknowledge_message`.
+        """
+        generation = self._current_generation(connection)
+        if generation is None:
+            logger.debug('Dropping rejection from a previous connection: %s', delivery_tag)
+            return
+
+        if self.idempotency is not None:
+            self._pending_keys.pop((generation, channel.channel_number, delivery_tag), None)
+
+        if not connection.is_open:
+            return
+
+        cb = functools.partial(self._reject_message, channel, delivery_tag)
+        connection.add_callback_threadsafe(cb)
+
+    def callback(self, ch: 'Channel', method: 'Method', properties: 'Header', body: bytes, connection: 'Connection'):
         """
-        Abstract method to define the callback to run during basic consume routine.
+        Callback to run during basic consume routine. Decodes the message, which
+        may be an envelope of many records, and passes each record to
+        :meth:`process_message`. Can be overridden by consumers which need to do
+        something different.
         Arguments provided by pika standard message callback method
 
         :param ch: Channel
@@ -205,7 +785,91 @@ class QueueHandler:
         :param connection: Pika connection
         """
 
-        raise NotImplementedError
+        ack = functools.partial(self.acknowledge_message, ch, method.delivery_tag, connection)
+
+        nack = None
+        if self.queue_handler.NACK_FAILED:
+            nack = functools.partial(self.reject_message, ch, method.delivery_tag, connection)
+
+        self.process_body(body, ack, nack)
+
+    def process_body(self, body: bytes, ack: Callable[[], None], nack: Optional[Callable[[], None]] = None):
+        """
+        Decode a message body and process each of its records
+
+        :param body: Message body
+        :param ack: Called once all of the records have been processed and their output written
+        :param nack: Called instead of ack if a record failed
+        """
+
+        monitor_key = None
+        if self.monitor is not None:
+            # Tracked until processed so the monitor can see the oldest deposit still waiting
+            monitor_key = self.monitor.hold()
+            ack = self._monitor_release(monitor_key, ack)
+            nack = nack and self._monitor_release(monitor_key, nack)
+
+        try:
+            # The message is acknowledged once all of its records have been processed
+            # and anything the handler has added to its sink has been written
+            with self.queue_handler.delivery(ack, nack) as delivery:
+                messages = self.decode_messages(body)
+
+                if monitor_key is not None and messages:
+                    self.monitor.record_deposit(monitor_key, messages[0].datetime)
+
+                if len(messages) == 1:
+                    self.process_message(messages[0])
+                    return
+
+                self.queue_handler.prefetch(messages)
+
+                # A failed record should not stop the rest of the envelope
+                for message in messages:
+                    try:
+                        self.process_message(message)
+                    except Exception:
+                        logger.exception('Failed to process record: %s', message)
+                        delivery.fail()
+
+        except Exception:
+            logger.exception('Failed to process message: %s', body)
+
+    def _monitor_release(self, key: int, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        :param key: Key from :meth:`BacklogMonitor.hold`
+        :param callback: ack or nack for the message
+        :return: callback which also releases the message from the monitor
+        """
+
+        def release():
+            self.monitor.release(key)
+            callback()
+
+        return release
+
+    def process_message(self, message: IngestMessage):
+        """
+        Check a decoded record against the handler path filter and pass it to the handler
+
+        :param message: IngestMessage
+        """
+
+        self.queue_handler.invalidate_caches(message)
+
+        path_filter = self.queue_handler.path_filter
+        if path_filter is not None and not path_filter.allow_path(message.filepath):
+            return
+
+        self.queue_handler.rollup(message)
+
+        # Removals of whole trees are handled by one delete by prefix
+        if self.queue_handler.remove_subtree(message):
+            return
+
+        # Deposits into a busy directory are handled by one rescan
+        if not self.queue_handler.absorb(message):
+            self.queue_handler.process_event(message)
 
     def run(self):
         """
@@ -217,27 +881,69 @@ class QueueHandler:
 
         :return:
         """
+        import pika
 
         while True:
-            channel = self._connect()
+            connection = self._connect()
 
             try:
+                self._wait_until_ready(connection)
+                self._start_consuming(connection)
+
                 logger.info('READY')
-                channel.start_consuming()
+                while connection.is_open:
+                    connection.process_data_events(time_limit=1)
+                    self._check_reload()
 
             except KeyboardInterrupt:
-                channel.stop_consuming()
+                self._stop_consuming(connection)
                 break
 
             except pika.exceptions.StreamLostError as e:
                 # Log problem
                 logger.error('Connection lost, reconnecting', exc_info=e)
+
+                # Unacked messages will be redelivered on the new connection.
+                # Journal records have already been acknowledged and are kept.
+                if self.scheduler is not None and self.journal is None:
+                    self.scheduler.clear()
                 continue
 
             except Exception as e:
                 logger.critical(e)
 
-                channel.stop_consuming()
+                self._stop_consuming(connection)
                 break
 
+        # Records which are not complete are replayed on the next start
+        if self.journal is not None:
+            self.journal.close()
+            self._journal_thread.join()
+
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+        if self.queue_handler is not None:
+            self.queue_handler.close()
+
+        if self.idempotency is not None:
+            self.idempotency.close()
+
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+
+        if self.monitor is not None:
+            self.monitor.stop()
+
+    def _stop_consuming(self, connection: 'Connection'):
+        """
+        Cancel the consumers on all the queue channels and close the connection
+
+        :param connection: pika connection
+        """
+        for channel in self.channels:
+            if channel.is_open:
+                channel.stop_consuming()
 
+        if connection.is_open:
+            connection.close()
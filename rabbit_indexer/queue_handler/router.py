@@ -0,0 +1,124 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import logging
+
+from .queue_handler import QueueHandler
+from .envelope import GZIP_MAGIC, encode_envelope
+
+# Typing imports
+from typing import List, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pika.channel import Channel
+    from pika.connection import Connection
+    from pika.frame import Method
+    from pika.frame import Header
+
+logger = logging.getLogger(__name__)
+
+
+class ShardRouter(QueueHandler):
+    """
+    Consumes the configured queues and republishes each message to the shard
+    exchange, routed by the parent directory of the path. The sharded consumers
+    then each consume the shard queues they have claimed.
+
+    Run with ``indexer.queue_consumer_class`` set to
+    ``rabbit_indexer.queue_handler.router.ShardRouter`` and the same
+    ``rabbit_server.sharding`` section as the consumers.
+    """
+
+    def __init__(self, conf):
+        super().__init__(conf)
+
+        if not self.sharding:
+            raise ValueError('ShardRouter requires the rabbit_server.sharding section')
+
+        self.publish_channel = None
+
+    def get_handlers(self):
+        self.queue_handler = None
+
+    def _setup_scheduler(self):
+        # Messages are published from the connection thread
+        return
+
+    def _setup_idempotency(self):
+        # Messages are only applied by the consumers
+        if self.conf.get('indexer', 'idempotency'):
+            logger.warning('indexer.idempotency is not used by the ShardRouter')
+
+    def _setup_journal(self):
+        # There is no handler to process the records, messages are acknowledged once published
+        if self.conf.get('indexer', 'journal'):
+            logger.warning('indexer.journal is not used by the ShardRouter')
+
+    def _wait_until_ready(self, connection: 'Connection'):
+        return
+
+    def _queue_configs(self, declare: bool = False) -> List[dict]:
+        """
+        The router consumes the configured queues and declares all the shard
+        queues so that messages are held until the partitions are claimed.
+        """
+
+        queues = self.conf.get('rabbit_server', 'queues')
+
+        if declare:
+            return queues + self.sharding.all_queues()
+
+        return queues
+
+    def _start_consuming(self, connection: 'Connection'):
+        self.publish_channel = connection.channel()
+        self.publish_channel.confirm_delivery()
+
+        super()._start_consuming(connection)
+
+    def callback(self, ch: 'Channel', method: 'Method', properties: 'Header', body: bytes, connection: 'Connection'):
+        """
+        Republish the message to the shard exchange and acknowledge it once
+        the broker has confirmed the publish.
+        """
+
+        for routing_key, shard_body in self.route(body):
+            self.publish_channel.basic_publish(
+                exchange=self.sharding.exchange,
+                routing_key=routing_key,
+                body=shard_body,
+                properties=properties
+            )
+
+        self.acknowledge_message(ch, method.delivery_tag, connection)
+
+    def route(self, body: bytes) -> List[Tuple[str, bytes]]:
+        """
+        Work out where to publish a message. Envelopes are split so that each
+        record is sent to the shard for its directory.
+
+        :param body: Message body
+        :return: List of (routing key, body) tuples. Empty if the message cannot be decoded
+        """
+
+        try:
+            messages = self.decode_messages(body)
+        except Exception:
+            logger.exception('Unable to route message: %s', body)
+            return []
+
+        if len(messages) == 1:
+            return [(self.sharding.routing_key(messages[0].filepath), body)]
+
+        shards = {}
+        for message in messages:
+            shards.setdefault(self.sharding.routing_key(message.filepath), []).append(message)
+
+        compress = body[:2] == GZIP_MAGIC
+        return [(routing_key, encode_envelope(records, compress)) for routing_key, records in shards.items()]
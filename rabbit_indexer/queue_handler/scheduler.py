@@ -0,0 +1,229 @@
+# encoding: utf-8
+"""
+Schedulers to share handler capacity between the consumed queues.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import logging
+import threading
+from collections import deque
+from .priority import ActionPriorityQueue
+
+# Typing imports
+from typing import Callable, Dict, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+logger = logging.getLogger(__name__)
+
+
+class _QueueState:
+    """
+    Bookkeeping for a single queue within the scheduler
+    """
+
+    __slots__ = ('name', 'weight', 'concurrency', 'pending', 'in_flight', 'vtime', 'dispatched')
+
+    def __init__(self, name: str, weight: float = 1, concurrency: int = 1, priority: Optional[dict] = None):
+        if weight <= 0:
+            raise ValueError(f'Queue weight must be greater than 0. {name} has weight {weight}')
+
+        if concurrency < 1:
+            raise ValueError(f'Queue concurrency must be at least 1. {name} has concurrency {concurrency}')
+
+        self.name = name
+        self.weight = weight
+        self.concurrency = concurrency
+        self.pending = ActionPriorityQueue(**priority) if priority is not None else deque()
+        self.in_flight = 0
+        self.vtime = 0.0
+        self.dispatched = 0
+
+    @property
+    def eligible(self) -> bool:
+        return bool(self.pending) and self.in_flight < self.concurrency
+
+    def add(self, task: Callable[[], None], message: Optional['IngestMessage'] = None) -> None:
+        if isinstance(self.pending, ActionPriorityQueue):
+            self.pending.append(task, message)
+        else:
+            self.pending.append(task)
+
+    def done(self, task: Callable[[], None]) -> None:
+        self.in_flight -= 1
+        if isinstance(self.pending, ActionPriorityQueue):
+            self.pending.done(task)
+
+
+class WeightedFairScheduler:
+    """
+    Shares a fixed pool of worker threads between a number of queues.
+
+    Each queue has a weight and a concurrency limit. Tasks are picked using
+    start-time fair queuing; every dispatch advances the virtual time of the
+    queue by ``1/weight`` and the eligible queue with the lowest virtual time
+    runs next. A queue which has been idle is brought forward to the current
+    virtual time when it becomes busy again so that it cannot bank credit and
+    then starve the others.
+
+    If ``priority`` is given, the tasks within each queue are ordered by the
+    action of their message using :class:`ActionPriorityQueue`, otherwise they
+    run in the order they were submitted.
+
+    Parameters:
+        workers: Number of worker threads
+        queues: Mapping of queue name to a dict with optional ``weight`` and ``concurrency`` keys
+        priority: Optional kwargs for :class:`ActionPriorityQueue`
+    """
+
+    def __init__(self, workers: int, queues: Optional[Dict[str, dict]] = None, priority: Optional[dict] = None):
+
+        if workers < 1:
+            raise ValueError(f'workers must be at least 1. You have provided {workers}')
+
+        self.workers = workers
+        self.priority = priority
+        self._queues = {}
+        self._vtime = 0.0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+
+        for name, options in (queues or {}).items():
+            self.add_queue(name, **options)
+
+    def add_queue(self, name: str, weight: float = 1, concurrency: int = 1) -> None:
+        """
+        Register a queue with the scheduler
+
+        :param name: Queue name
+        :param weight: Relative share of the worker pool
+        :param concurrency: Maximum number of tasks from this queue which can run at once
+        """
+        with self._cond:
+            self._queues[name] = _QueueState(name, weight, concurrency, self.priority)
+
+    def start(self) -> None:
+        """
+        Start the worker threads
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'scheduler-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, wait: bool = True) -> None:
+        """
+        Stop the worker threads. Tasks which are still pending are dropped,
+        their messages will be redelivered by the broker.
+
+        :param wait: Wait for the running tasks to complete
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        self.clear()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+        self._threads = []
+
+    def clear(self) -> None:
+        """
+        Drop all pending tasks. Used when the connection the tasks were
+        received on has been lost and the messages will be redelivered.
+        """
+        with self._cond:
+            for state in self._queues.values():
+                state.pending.clear()
+
+    @property
+    def prioritised(self) -> bool:
+        return self.priority is not None
+
+    def submit(self, queue: str, task: Callable[[], None], message: Optional['IngestMessage'] = None) -> None:
+        """
+        Add a task to the named queue
+
+        :param queue: Queue name. Unknown queues are registered with default options.
+        :param task: Callable to run in a worker thread
+        :param message: The message the task processes, used to prioritise it
+        """
+        with self._cond:
+            state = self._queues.get(queue)
+            if state is None:
+                state = _QueueState(queue, priority=self.priority)
+                self._queues[queue] = state
+
+            if not state.pending and not state.in_flight:
+                state.vtime = max(state.vtime, self._vtime)
+
+            state.add(task, message)
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        :return: Snapshot of the pending, in flight and dispatched counts for each queue
+        """
+        with self._cond:
+            return {
+                name: {
+                    'pending': len(state.pending),
+                    'in_flight': state.in_flight,
+                    'dispatched': state.dispatched
+                }
+                for name, state in self._queues.items()
+            }
+
+    def _next(self) -> Optional[_QueueState]:
+        """
+        Select the eligible queue with the lowest virtual time.
+        Must be called with the condition held.
+        """
+        selected = None
+        for state in self._queues.values():
+            if state.eligible and (selected is None or state.vtime < selected.vtime):
+                selected = state
+
+        return selected
+
+    def _worker(self) -> None:
+
+        while True:
+            with self._cond:
+                state = self._next()
+                while state is None:
+                    if not self._running:
+                        return
+                    self._cond.wait()
+                    state = self._next()
+
+                if not self._running:
+                    return
+
+                task = state.pending.popleft()
+                state.in_flight += 1
+                state.dispatched += 1
+                self._vtime = state.vtime
+                state.vtime += 1 / state.weight
+
+            try:
+                task()
+            except Exception:
+                logger.exception('Unhandled exception processing task from queue %s', state.name)
+            finally:
+                with self._cond:
+                    state.done(task)
+                    self._cond.notify_all()
@@ -0,0 +1,155 @@
+# encoding: utf-8
+"""
+Helpers to shard the deposit stream between consumer instances.
+
+Messages are routed by a hash of the parent directory of the path so that
+all the events for a directory are handled, in order, by the same instance.
+The sharding is configured by the ``rabbit_server.sharding`` section.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import hashlib
+import os
+
+# Typing imports
+from typing import List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.utils.yaml_config import YamlConfig
+
+PARTITIONS = 'partitions'
+CONSISTENT_HASH = 'consistent_hash'
+SHARDING_MODES = [PARTITIONS, CONSISTENT_HASH]
+
+DEFAULT_EXCHANGE = 'rabbit_indexer.shards'
+DEFAULT_QUEUE_PREFIX = 'rabbit_indexer.shard'
+
+
+def shard_key(path: str) -> str:
+    """
+    The key used to shard a path, its parent directory
+
+    :param path: File or directory path
+    :return: Parent directory
+    """
+    return os.path.dirname(path.rstrip('/')) or '/'
+
+
+def partition_for(path: str, partitions: int) -> int:
+    """
+    Stable partition number for a path. Uses sha1 rather than ``hash``,
+    which is randomised for each process.
+
+    :param path: File or directory path
+    :param partitions: Number of partitions
+    :return: Partition number
+    """
+    digest = hashlib.sha1(shard_key(path).encode(errors='ignore')).digest()
+    return int.from_bytes(digest[:8], 'big') % partitions
+
+
+def claimed_partitions(shard_id: int, shards: int, partitions: int) -> List[int]:
+    """
+    The partitions consumed by an instance. Partitions are dealt out to the
+    instances in turn.
+
+    :param shard_id: Id of this instance, in the range [0, shards)
+    :param shards: Number of instances
+    :param partitions: Number of partitions
+    :return: List of partition numbers
+    """
+    if not 0 <= shard_id < shards:
+        raise ValueError(f'shard_id must be in the range [0, {shards}). You have provided {shard_id}')
+
+    return [partition for partition in range(partitions) if partition % shards == shard_id]
+
+
+class ShardingConfig:
+    """
+    Sharding settings read from ``rabbit_server.sharding``
+
+    Parameters:
+        options: The ``rabbit_server.sharding`` section
+    """
+
+    def __init__(self, options: dict):
+        self.mode = options.get('mode', PARTITIONS)
+
+        if self.mode not in SHARDING_MODES:
+            raise ValueError(f'Sharding mode must be one of {SHARDING_MODES}. You have provided {self.mode}')
+
+        self.exchange = options.get('exchange', DEFAULT_EXCHANGE)
+        self.queue_prefix = options.get('queue_prefix', DEFAULT_QUEUE_PREFIX)
+        self.partitions = options.get('partitions', 1)
+        self.shards = options.get('shards', 1)
+        self.shard_id = options.get('shard_id', 0)
+        self.hash_weight = options.get('hash_weight', 1)
+        self.queue_options = {
+            key: options[key] for key in ('prefetch', 'weight', 'concurrency', 'kwargs') if key in options
+        }
+
+    @classmethod
+    def from_conf(cls, conf: 'YamlConfig') -> Optional['ShardingConfig']:
+        """
+        :return: ShardingConfig or None if sharding is not configured
+        """
+        options = conf.get('rabbit_server', 'sharding')
+        if not options:
+            return None
+        return cls(options)
+
+    @property
+    def exchange_type(self) -> str:
+        return 'x-consistent-hash' if self.mode == CONSISTENT_HASH else 'direct'
+
+    def routing_key(self, path: str) -> str:
+        """
+        Routing key to publish a message for the path to the shard exchange
+
+        :param path: File or directory path
+        :return: routing key
+        """
+        if self.mode == CONSISTENT_HASH:
+            return shard_key(path)
+        return str(partition_for(path, self.partitions))
+
+    def _queue(self, suffix, routing_key: str) -> dict:
+        """
+        Queue config for a shard queue. The queues are durable so that messages
+        are kept while the instance which claims them is restarted.
+        """
+        return {
+            **self.queue_options,
+            'name': f'{self.queue_prefix}.{suffix}',
+            'kwargs': {'durable': True, **self.queue_options.get('kwargs', {})},
+            'exchange': self.exchange,
+            'bind_kwargs': {'routing_key': routing_key},
+            'exclusive': True,
+        }
+
+    def partition_queue(self, partition: int) -> dict:
+        return self._queue(partition, str(partition))
+
+    def all_queues(self) -> List[dict]:
+        """
+        Every queue in the sharded topology. Declared by the router so that
+        messages are held until a consumer claims the partition.
+        """
+        if self.mode == CONSISTENT_HASH:
+            return []
+        return [self.partition_queue(partition) for partition in range(self.partitions)]
+
+    def claimed_queues(self) -> List[dict]:
+        """
+        The queues consumed by this instance
+        """
+        if self.mode == CONSISTENT_HASH:
+            return [self._queue(self.shard_id, str(self.hash_weight))]
+
+        return [
+            self.partition_queue(partition)
+            for partition in claimed_partitions(self.shard_id, self.shards, self.partitions)
+        ]
@@ -8,6 +8,28 @@ __copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
 __license__ = 'BSD - see LICENSE file in top-level package directory'
 __contact__ = 'richard.d.smith@stfc.ac.uk'
 
+import importlib
 
-from .path_tools import PathTools, PathFilter
-from .yaml_config import YamlConfig
\ No newline at end of file
+# The submodules are imported on first access so that importing the package
+# does not pull in the network libraries before they are needed.
+_LAZY_ATTRIBUTES = {
+    'PathTools': '.path_tools',
+    'PathFilter': '.path_tools',
+    'YamlConfig': '.yaml_config',
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,108 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import threading
+import time
+from collections import OrderedDict
+
+# Typing imports
+from typing import Any, Hashable
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded least recently used cache where entries also expire after a
+    time to live. Keys are paths so that a directory and everything
+    below it can be invalidated together.
+
+    Parameters:
+        maxsize: Maximum number of entries
+        ttl: Time to live for an entry in seconds
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        :return: The cached value or default if missing or expired
+        """
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_tree(self, path: str) -> None:
+        """
+        Remove the entry for the path and for everything below it
+
+        :param path: Directory path
+        """
+        path = path.rstrip('/')
+        prefix = f'{path}/'
+
+        with self._lock:
+            keys = [key for key in self._data if key == path or key.startswith(prefix)]
+            for key in keys:
+                del self._data[key]
+            self.invalidations += len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def info(self) -> dict:
+        """
+        :return: Hit and miss counts, hit rate and size
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
@@ -0,0 +1,77 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import logging
+import os
+import threading
+
+# Typing imports
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher:
+    """
+    Polls the modification times of the config files and calls
+    the callback when any of them change.
+
+    Parameters:
+        files: Config files to watch
+        callback: Called with no arguments when a change is seen
+        interval: Polling interval in seconds
+    """
+
+    def __init__(self, files: List[str], callback: Callable[[], None], interval: float = 30):
+        self.files = files
+        self.callback = callback
+        self.interval = interval
+
+        self._mtimes = self._stat()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stat(self) -> Dict[str, Optional[float]]:
+        mtimes = {}
+        for filename in self.files:
+            try:
+                mtimes[filename] = os.stat(filename).st_mtime
+            except OSError:
+                mtimes[filename] = None
+        return mtimes
+
+    def check(self) -> bool:
+        """
+        Check the files for changes and call the callback if there are any
+
+        :return: True if a change was seen
+        """
+        mtimes = self._stat()
+        if mtimes == self._mtimes:
+            return False
+
+        self._mtimes = mtimes
+        logger.info('Config files changed')
+        self.callback()
+        return True
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Failed to check config files for changes')
@@ -11,6 +11,7 @@ __contact__ = 'richard.d.smith@stfc.ac.uk'
 import argparse
 import logging
 from .yaml_config import YamlConfig
+from .log_setup import setup_logging
 from pydoc import locate
 
 logger = logging.getLogger(__name__)
@@ -35,17 +36,14 @@ def consumer_setup(consumer=None, description='Begin the rabbit based deposit in
     conf.read(CONFIG_FILE)
 
     # Setup logging
-    log_level_str = conf.get('logging', 'log_level', default='info')
-    log_level = getattr(logging, log_level_str.upper())
-
-    logging.basicConfig(format='%(asctime)s @%(name)s [%(levelname)s]:    %(message)s', level=log_level)
+    setup_logging(conf)
 
     # Load the consumer
     if not consumer:
         consumer = conf.get('indexer', 'queue_consumer_class')
         consumer = locate(consumer)
 
-    logger.info(f'Loaded {consumer}')
+    logger.info('Loaded %s', consumer)
 
     consumer = consumer(conf)
     consumer.run()
@@ -0,0 +1,191 @@
+# encoding: utf-8
+"""
+Content fingerprints for deposited files.
+
+Files are hashed in a thread pool. hashlib releases the GIL while it hashes
+large buffers, so several files are hashed in parallel. The files are read
+with mmap, or large buffered reads where mmap is not available, so the data is
+not copied into Python objects. The number of files read at once is limited so
+that fingerprinting does not swamp the storage.
+
+:meth:`Fingerprinter.fingerprint` can be called from the connection thread, so
+files are only hashed up to a size cap and a file which takes too long is
+left without a checksum rather than stopping the heartbeats.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import hashlib
+import logging
+import mmap
+import os
+import stat
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# Typing imports
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path: str, algorithm: str = 'sha256', block_size: int = 2**20, use_mmap: bool = True) -> str:
+    """
+    :param path: File to hash
+    :param algorithm: hashlib algorithm name
+    :param block_size: Bytes passed to the hash at a time
+    :param use_mmap: Map the file rather than reading it
+    :return: hex digest
+    """
+
+    digest = hashlib.new(algorithm)
+
+    with open(path, 'rb') as reader:
+        size = os.fstat(reader.fileno()).st_size
+
+        # Empty files cannot be mapped
+        if use_mmap and size:
+            with mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+                with memoryview(mapped) as view:
+                    for start in range(0, len(view), block_size):
+                        digest.update(view[start:start + block_size])
+        else:
+            buffer = bytearray(block_size)
+            with memoryview(buffer) as view:
+                while True:
+                    read = reader.readinto(buffer)
+                    if not read:
+                        break
+                    digest.update(view[:read])
+
+    return digest.hexdigest()
+
+
+class Fingerprinter:
+    """
+    Hashes files in a thread pool. Files can be submitted ahead of time with
+    :meth:`prefetch` so they are hashed while earlier messages are processed.
+
+    Parameters:
+        algorithm: hashlib algorithm name
+        max_size: Files larger than this, in bytes, are not hashed. No limit if None.
+        io_concurrency: Number of files read at once
+        block_size: Bytes passed to the hash at a time
+        use_mmap: Map the files rather than reading them
+        max_prefetch: Number of prefetched results kept for :meth:`fingerprint`
+        timeout: Seconds :meth:`fingerprint` waits for a file to be hashed. No limit if None.
+    """
+
+    def __init__(
+        self,
+        algorithm: str = 'sha256',
+        max_size: Optional[int] = 2**30,
+        io_concurrency: int = 4,
+        block_size: int = 2**20,
+        use_mmap: bool = True,
+        max_prefetch: int = 1024,
+        timeout: Optional[float] = 10
+    ):
+        # Fail on an unknown algorithm now rather than for every file
+        hashlib.new(algorithm)
+
+        self.algorithm = algorithm
+        self.max_size = max_size
+        self.block_size = block_size
+        self.use_mmap = use_mmap
+        self.max_prefetch = max_prefetch
+        self.timeout = timeout
+
+        self.stats = {'hashed': 0, 'bytes': 0, 'skipped': 0, 'timeouts': 0}
+
+        self._pool = ThreadPoolExecutor(max_workers=io_concurrency, thread_name_prefix='fingerprint')
+        self._prefetched = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, path: str) -> Optional[dict]:
+        try:
+            file_stat = os.stat(path)
+        except (FileNotFoundError, PermissionError):
+            return None
+
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+
+        if self.max_size is not None and file_stat.st_size > self.max_size:
+            with self._lock:
+                self.stats['skipped'] += 1
+            return None
+
+        try:
+            digest = hash_file(path, self.algorithm, self.block_size, self.use_mmap)
+        except OSError as e:
+            logger.warning('Unable to fingerprint %s: %s', path, e)
+            return None
+
+        with self._lock:
+            self.stats['hashed'] += 1
+            self.stats['bytes'] += file_stat.st_size
+
+        return {
+            'algorithm': self.algorithm,
+            'digest': digest,
+            'size': file_stat.st_size,
+            'mtime': file_stat.st_mtime,
+        }
+
+    def prefetch(self, paths: Iterable[str]) -> None:
+        """
+        Start hashing files which will be asked for with :meth:`fingerprint`
+
+        :param paths: File paths
+        """
+
+        with self._lock:
+            for path in paths:
+                if path in self._prefetched:
+                    continue
+
+                self._prefetched[path] = self._pool.submit(self._fingerprint, path)
+
+                # Results which were never asked for
+                while len(self._prefetched) > self.max_prefetch:
+                    _, future = self._prefetched.popitem(last=False)
+                    future.cancel()
+
+    def fingerprint(self, path: str) -> Optional[dict]:
+        """
+        :param path: File path
+        :return: dict with the ``algorithm``, ``digest`` and the ``size`` and
+            ``mtime`` of the file which was hashed. None if the path is not a
+            regular file, is larger than ``max_size`` or was not hashed within
+            ``timeout`` seconds.
+        """
+
+        with self._lock:
+            future = self._prefetched.pop(path, None)
+
+        if future is None or future.cancelled():
+            future = self._pool.submit(self._fingerprint, path)
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            logger.warning('Timed out fingerprinting %s, leaving it without a checksum', path)
+            with self._lock:
+                self.stats['timeouts'] += 1
+            return None
+
+    def close(self) -> None:
+        with self._lock:
+            for future in self._prefetched.values():
+                future.cancel()
+            self._prefetched.clear()
+
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,209 @@
+# encoding: utf-8
+"""
+Logging setup for the consumers.
+
+Records are put on an in-process queue by the thread which logs them and are
+formatted and written by a :class:`logging.handlers.QueueListener` thread, so
+slow log handlers do not hold up message processing. Per-message events can be
+rate limited or sampled per logger with :class:`RateLimitFilter` and
+:class:`SampleFilter`. These are applied by a :class:`LoggerFilters` on the
+root handlers, as the filters of a logger are not applied to the records its
+child loggers propagate to it.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+
+# Typing imports
+from typing import Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from rabbit_indexer.utils.yaml_config import YamlConfig
+
+LOG_FORMAT = '%(asctime)s @%(name)s [%(levelname)s]:    %(message)s'
+
+_listener = None
+_lock = threading.Lock()
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue without formatting them. The queue is only used
+    within the process so the record does not need to be made picklable, and
+    the message is formatted in the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket rate limit for each message template of a logger. Records
+    over the limit are dropped and counted in ``dropped``. Warnings and
+    above are never dropped.
+
+    Parameters:
+        rate: Records per second allowed for each template
+        burst: Records allowed in a burst
+    """
+
+    def __init__(self, rate: float = 1, burst: int = 10):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.dropped = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, last = self._buckets.get(record.msg, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+            if tokens < 1:
+                self._buckets[record.msg] = (tokens, now)
+                self.dropped += 1
+                return False
+
+            self._buckets[record.msg] = (tokens - 1, now)
+            return True
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keeps a random fraction of the records of a logger. Warnings and
+    above are always kept.
+
+    Parameters:
+        fraction: Fraction of the records to keep
+    """
+
+    def __init__(self, fraction: float = 0.01):
+        super().__init__()
+        self.fraction = fraction
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or random.random() < self.fraction:
+            return True
+
+        self.dropped += 1
+        return False
+
+
+class LoggerFilters(logging.Filter):
+    """
+    Applies the filters configured for a logger to the records of that
+    logger and all of its children. It is attached to every root handler,
+    so the result is kept on the record and the rate limits only count
+    each record once.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # logger name: [filter]
+        self.filters = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        filters = self.filters
+        if not filters:
+            return True
+
+        keep = getattr(record, '_keep', None)
+        if keep is None:
+            keep = record._keep = self._keep(filters, record)
+
+        return keep
+
+    @staticmethod
+    def _keep(filters: dict, record: logging.LogRecord) -> bool:
+        name = record.name
+        while name:
+            for log_filter in filters.get(name, ()):
+                if not log_filter.filter(record):
+                    return False
+            name = name.rpartition('.')[0]
+
+        return True
+
+
+_logger_filters = LoggerFilters()
+
+
+def apply_log_filters(conf: 'YamlConfig') -> None:
+    """
+    Set the root log level and replace the rate limit and sample filters for
+    the loggers named in ``logging.rate_limits`` and ``logging.sample``. The
+    filters are applied by the root handlers, so they cover the records of
+    the child loggers too.
+
+    :param conf: YamlConfig
+    """
+
+    log_level_str = conf.get('logging', 'log_level', default='info')
+    logging.getLogger().setLevel(getattr(logging, log_level_str.upper()))
+
+    filters = {}
+    for name, options in conf.get('logging', 'rate_limits', default={}).items():
+        filters.setdefault(name, []).append(RateLimitFilter(**options))
+
+    for name, fraction in conf.get('logging', 'sample', default={}).items():
+        filters.setdefault(name, []).append(SampleFilter(fraction))
+
+    _logger_filters.filters = filters
+
+    for handler in logging.getLogger().handlers:
+        if _logger_filters not in handler.filters:
+            handler.addFilter(_logger_filters)
+
+
+def setup_logging(conf: 'YamlConfig') -> Optional[logging.handlers.QueueListener]:
+    """
+    Configure logging from the ``logging`` section. Unless ``logging.async``
+    is false, the root handlers are moved behind a QueueListener thread,
+    which is stopped, flushing the queue, when the process exits. Calling
+    this again only updates the level and filters.
+
+    :param conf: YamlConfig
+    :return: The QueueListener or None if logging is synchronous
+    """
+    global _listener
+
+    root = logging.getLogger()
+
+    with _lock:
+        if not root.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(conf.get('logging', 'format', default=LOG_FORMAT)))
+            root.addHandler(handler)
+
+        if _listener is None and conf.get('logging', 'async', default=True):
+            handlers = list(root.handlers)
+            records = queue.SimpleQueue()
+
+            _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+            _listener.start()
+            atexit.register(_listener.stop)
+
+            for handler in handlers:
+                root.removeHandler(handler)
+            root.addHandler(AsyncQueueHandler(records))
+
+    apply_log_filters(conf)
+
+    return _listener
@@ -0,0 +1,208 @@
+# encoding: utf-8
+"""
+Batched lookups in the MOLES API for paths which are not in the mapping.
+
+Paths which are asked for within a short window are collected and looked up
+together with a pooled session, so the connections are reused rather than
+opened for every path. The API has no batch form, so each batch is looked up
+with parallel requests. Callers asking for a path which is already being
+looked up wait for the same result.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Typing imports
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MOLES_API_URL = 'http://api.catalogue.ceda.ac.uk/api/v0/obs/get_info'
+
+
+class MolesAPIBatcher:
+    """
+    Collects the paths to look up in the MOLES API for ``window`` seconds, or
+    until there are ``max_batch``, and looks them up in parallel with a pooled
+    session.
+
+    Parameters:
+        api_url: URL of the get_info endpoint. The path is appended.
+        window: Seconds to collect paths for before looking them up
+        max_batch: Number of paths which are looked up without waiting for the window
+        concurrency: Number of requests made at once and connections kept open
+        timeout: Request timeout in seconds
+        on_result: Called with the path and result for each result which can be cached.
+            Only successful responses and 404s are passed on, not errors or timeouts.
+    """
+
+    def __init__(
+        self,
+        api_url: str = MOLES_API_URL,
+        window: float = 0.005,
+        max_batch: int = 64,
+        concurrency: int = 8,
+        timeout: float = 10,
+        on_result: Optional[Callable[[str, Optional[dict]], None]] = None
+    ):
+        self.api_url = api_url.rstrip('/')
+        self.window = window
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.on_result = on_result
+
+        self.stats = {'requests': 0, 'batches': 0, 'coalesced': 0, 'errors': 0}
+
+        self._session = None
+        self._pool = None
+        self._dispatcher = None
+        self._closed = False
+
+        self._queue = []
+        self._pending = {}
+        self._condition = threading.Condition()
+
+    def _start(self) -> None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        self._session = session
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='moles-api')
+        self._dispatcher = threading.Thread(target=self._run, name='moles-api-batcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, paths: Iterable[str]) -> Dict[str, Future]:
+        """
+        Queue paths to be looked up
+
+        :param paths: Directory paths
+        :return: Future for the result of each path
+        """
+
+        futures = {}
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('MOLES API batcher is closed')
+
+            if self._dispatcher is None:
+                self._start()
+
+            for path in paths:
+                future = self._pending.get(path)
+
+                if future is None:
+                    future = self._pending[path] = Future()
+                    self._queue.append(path)
+                elif path not in futures:
+                    self.stats['coalesced'] += 1
+
+                futures[path] = future
+
+            self._condition.notify()
+
+        return futures
+
+    def get(self, path: str) -> Optional[dict]:
+        """
+        :param path: Directory path
+        :return: Metadata dict | None
+        """
+        return self.submit([path])[path].result()
+
+    def get_many(self, paths: List[str]) -> List[Optional[dict]]:
+        """
+        :param paths: Directory paths
+        :return: Metadata dict or None for each path
+        """
+        futures = self.submit(paths)
+        return [futures[path].result() for path in paths]
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+
+                if self._closed and not self._queue:
+                    return
+
+                # Collect the paths which arrive within the window
+                deadline = time.monotonic() + self.window
+                while len(self._queue) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = [(path, self._pending[path]) for path in self._queue[:self.max_batch]]
+                del self._queue[:self.max_batch]
+
+            self.stats['batches'] += 1
+            for path, future in batch:
+                self._pool.submit(self._lookup, path, future)
+
+    def _lookup(self, path: str, future: Future) -> None:
+        from requests.exceptions import Timeout
+
+        try:
+            self.stats['requests'] += 1
+            response = self._session.get(f'{self.api_url}{path}', timeout=self.timeout)
+
+            # A 5xx or 429 says nothing about the record so it is not cached
+            cacheable = response.ok or response.status_code == 404
+            result = response.json() if response.ok else None
+
+        except Timeout:
+            self._finish(path, future, None)
+
+        except Exception as e:
+            with self._condition:
+                self._pending.pop(path, None)
+            future.set_exception(e)
+
+        else:
+            if not cacheable:
+                logger.warning('MOLES API returned %s for %s', response.status_code, path)
+                self.stats['errors'] += 1
+
+            # Cached before the waiters are released so that later lookups find it
+            elif self.on_result is not None:
+                self.on_result(path, result)
+
+            self._finish(path, future, result)
+
+    def _finish(self, path: str, future: Future, result: Optional[dict]) -> None:
+        with self._condition:
+            self._pending.pop(path, None)
+        future.set_result(result)
+
+    def close(self) -> None:
+        """
+        Look up the queued paths and stop
+        """
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            dispatcher = self._dispatcher
+
+        if dispatcher is None:
+            return
+
+        dispatcher.join()
+        self._pool.shutdown(wait=True)
+        self._session.close()
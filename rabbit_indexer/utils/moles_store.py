@@ -0,0 +1,325 @@
+# encoding: utf-8
+"""
+Compact in-memory store for the MOLES observation mapping.
+
+The store combines the path to record mapping and the matching tree used by
+:class:`rabbit_indexer.utils.PathTools` into a single structure. Path
+components are interned and given an integer id, the children of each node
+are held in a sorted array of (component id, node id) pairs and the records
+only hold the uuid and title. The catalogue URL and record type are shared
+between records and the full metadata dict is built when it is looked up.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import sys
+from array import array
+
+# Typing imports
+from typing import Iterator, Optional, Tuple
+
+RECORD_KEYS = {'title', 'url', 'record_type'}
+
+
+class MolesRecord:
+    """
+    A single MOLES record. The uuid is stored as bytes when it is a hex
+    string and the url prefix and record type are held as an index into
+    the profiles of the owning store.
+    """
+
+    __slots__ = ('_uuid', 'title', 'profile')
+
+    def __init__(self, uuid: str, title: str, profile: int):
+        try:
+            self._uuid = bytes.fromhex(uuid) if len(uuid) == 32 else uuid
+        except ValueError:
+            self._uuid = uuid
+
+        self.title = title
+        self.profile = profile
+
+    @property
+    def uuid(self) -> str:
+        if isinstance(self._uuid, bytes):
+            return self._uuid.hex()
+        return self._uuid
+
+
+class CompactMolesStore:
+    """
+    Mapping of dataset path to MOLES record which can also be used as the
+    matching tree. Supports the parts of the ``dict`` and
+    ``directory_tree.DatasetNode`` interfaces used by PathTools.
+
+    Parameters:
+        mapping: Optional dict of path to ``{'title', 'url', 'record_type'}`` to load
+    """
+
+    ROOT = 0
+
+    def __init__(self, mapping: Optional[dict] = None):
+
+        # Interned path components
+        self._component_ids = {}
+        self._components = []
+
+        # Shared (url prefix, record type) pairs
+        self._profile_ids = {}
+        self._profiles = []
+
+        # Node storage, indexed by node id. Children are held as
+        # array('I', [component_id, node_id, ...]) sorted on component id
+        self._children = [None]
+        self._records = [None]
+        self._terminal = bytearray(1)
+
+        # Records which do not fit the compact form
+        self._raw = {}
+
+        self._count = 0
+
+        if mapping:
+            self.update(mapping)
+
+    # ------------------------------------------------------------------
+    # Tree interface
+    # ------------------------------------------------------------------
+
+    def add_child(self, path: str) -> None:
+        """
+        Add a path to the tree without a record
+
+        :param path: Directory path
+        """
+        node = self._insert(path)
+        self._terminal[node] = 1
+
+    def search_name(self, path: str) -> Optional[str]:
+        """
+        Find the longest path in the tree which is a prefix of the given path
+
+        :param path: Path to match
+        :return: Matching path or None
+        """
+        node = self.ROOT
+        matched = None
+        parts = []
+
+        for part in self._split(path):
+            node = self._child(node, part)
+            if node is None:
+                break
+
+            parts.append(part)
+            if self._terminal[node]:
+                matched = len(parts)
+
+        if matched is None:
+            return None
+
+        return '/' + '/'.join(parts[:matched])
+
+    # ------------------------------------------------------------------
+    # Mapping interface
+    # ------------------------------------------------------------------
+
+    def __setitem__(self, path: str, value: dict) -> None:
+        node = self._insert(path)
+        self._terminal[node] = 1
+
+        if self._records[node] is None and node not in self._raw:
+            self._count += 1
+
+        self._raw.pop(node, None)
+        self._records[node] = None
+
+        record = self._compact(value)
+        if record is None:
+            self._raw[node] = dict(value)
+        else:
+            self._records[node] = record
+
+    def __getitem__(self, path: str) -> dict:
+        result = self.get(path)
+        if result is None:
+            raise KeyError(path)
+        return result
+
+    def __contains__(self, path: str) -> bool:
+        return self.get(path) is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        for path, _ in self._walk():
+            yield path
+
+    def get(self, path: str, default=None) -> Optional[dict]:
+        """
+        Return the metadata for an exact path
+
+        :param path: Directory path
+        :param default: Returned when there is no record for the path
+        :return: Dictionary containing MOLES title, url and record_type
+        """
+        node = self._find(path)
+        if node is None:
+            return default
+
+        return self._expand(node, default)
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        for path, node in self._walk():
+            yield path, self._expand(node)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def update(self, mapping: dict) -> None:
+        for path, value in mapping.items():
+            self[path] = value
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _split(path: str):
+        return [part for part in path.split('/') if part]
+
+    def _component_id(self, part: str) -> int:
+        cid = self._component_ids.get(part)
+        if cid is None:
+            cid = len(self._components)
+            part = sys.intern(part)
+            self._component_ids[part] = cid
+            self._components.append(part)
+        return cid
+
+    @staticmethod
+    def _bisect(pairs: array, cid: int) -> int:
+        """
+        Find the index of the pair for cid, or where it should be inserted
+
+        :param pairs: Child array of a node
+        :param cid: Component id
+        :return: Index of the pair
+        """
+        lo, hi = 0, len(pairs) // 2
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if pairs[mid * 2] < cid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _child(self, node: int, part: str) -> Optional[int]:
+        cid = self._component_ids.get(part)
+        pairs = self._children[node]
+        if cid is None or pairs is None:
+            return None
+
+        i = self._bisect(pairs, cid) * 2
+        if i < len(pairs) and pairs[i] == cid:
+            return pairs[i + 1]
+
+        return None
+
+    def _find(self, path: str) -> Optional[int]:
+        node = self.ROOT
+        for part in self._split(path):
+            node = self._child(node, part)
+            if node is None:
+                return None
+        return node
+
+    def _insert(self, path: str) -> int:
+        node = self.ROOT
+        for part in self._split(path):
+            cid = self._component_id(part)
+            pairs = self._children[node]
+
+            if pairs is None:
+                pairs = self._children[node] = array('I')
+
+            i = self._bisect(pairs, cid) * 2
+            if i < len(pairs) and pairs[i] == cid:
+                node = pairs[i + 1]
+                continue
+
+            child = len(self._records)
+            self._children.append(None)
+            self._records.append(None)
+            self._terminal.append(0)
+
+            pairs[i:i] = array('I', (cid, child))
+            node = child
+
+        return node
+
+    def _profile_id(self, prefix: str, record_type: str) -> int:
+        key = (prefix, record_type)
+        pid = self._profile_ids.get(key)
+        if pid is None:
+            pid = len(self._profiles)
+            self._profile_ids[key] = pid
+            self._profiles.append(key)
+        return pid
+
+    def _compact(self, value: dict) -> Optional[MolesRecord]:
+        """
+        Convert a metadata dict into a record. Returns None if the dict
+        cannot be rebuilt exactly from the compact form.
+        """
+        if set(value) != RECORD_KEYS:
+            return None
+
+        url = value['url']
+        if not isinstance(url, str) or '/uuid/' not in url:
+            return None
+
+        prefix, uuid = url.rsplit('/uuid/', 1)
+        record = MolesRecord(uuid, value['title'], self._profile_id(f'{prefix}/uuid/', value['record_type']))
+
+        # Make sure that the round trip is exact, e.g. uppercase hex
+        if record.uuid != uuid:
+            return None
+
+        return record
+
+    def _expand(self, node: int, default=None) -> Optional[dict]:
+        record = self._records[node]
+        if record is None:
+            raw = self._raw.get(node)
+            return dict(raw) if raw is not None else default
+
+        prefix, record_type = self._profiles[record.profile]
+        return {
+            'title': record.title,
+            'url': f'{prefix}{record.uuid}',
+            'record_type': record_type,
+        }
+
+    def _walk(self) -> Iterator[Tuple[str, int]]:
+        """
+        Depth first walk yielding the path and node id of every node with a record
+        """
+        stack = [(self.ROOT, '')]
+        while stack:
+            node, path = stack.pop()
+
+            if self._records[node] is not None or node in self._raw:
+                yield path, node
+
+            pairs = self._children[node]
+            if pairs is None:
+                continue
+
+            for i in range(len(pairs) - 2, -1, -2):
+                stack.append((pairs[i + 1], f'{path}/{self._components[pairs[i]]}'))
@@ -8,16 +8,22 @@ __license__ = "BSD - see LICENSE file in top-level package directory"
 __contact__ = "richard.d.smith@stfc.ac.uk"
 
 from pathlib import Path
-from ceda_elasticsearch_tools.core.log_reader import SpotMapping
 import os
-import requests
 from json.decoder import JSONDecodeError
 import json
 import hashlib
-from requests.exceptions import Timeout
+import threading
+from contextlib import contextmanager
 from directory_tree import DatasetNode
+from .moles_store import CompactMolesStore
+from .spot_mapping import SpotMapping, SPOT_MAPPING_URL
+from .cache import TTLCache, MISSING
+from .fingerprint import Fingerprinter
+from .moles_api import MolesAPIBatcher, MOLES_API_URL
 
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, TYPE_CHECKING
+if TYPE_CHECKING:
+    from .yaml_config import YamlConfig
 
 
 def process_observations(results):
@@ -65,6 +71,8 @@ def generate_moles_mapping(api_url, mapping=None):
     if not mapping:
         mapping = {}
 
+    import requests
+
     # Get the api response
     try:
         response = requests.get(api_url).json()
@@ -106,33 +114,358 @@ class PathTools:
         self,
         moles_mapping_url: str = "http://api.catalogue.ceda.ac.uk/api/v2/observations.json/",
         mapping_file: Optional[str] = None,
+        compact_mapping: bool = False,
+        deferred: bool = False,
+        dir_cache_size: int = 0,
+        dir_cache_ttl: float = 300,
+        spot_mapping_url: str = SPOT_MAPPING_URL,
+        spot_cache_file: Optional[str] = None,
+        fingerprint: Optional[dict] = None,
+        api_cache_size: int = 10000,
+        api_cache_ttl: float = 3600,
+        api_url: str = MOLES_API_URL,
+        api_batch: Optional[dict] = None,
+        sidecar: Optional[str] = None,
+        sidecar_cache_size: int = 10000,
+        sidecar_cache_ttl: float = 60,
     ):
-
-        self.spots = SpotMapping()
+        """
+        :param moles_mapping_url: URL for the MOLES observations API
+        :param mapping_file: Load the MOLES mapping from a file rather than the API
+        :param compact_mapping: Hold the MOLES mapping and matching tree in a
+            single :class:`CompactMolesStore` to reduce memory use
+        :param deferred: Do not load the mappings on initialisation. They are
+            loaded in parallel by :meth:`start_loading`, or on first use, and
+            anything which needs them waits until they are ready.
+        :param dir_cache_size: Number of directory metadata documents to cache.
+            Disabled if 0
+        :param dir_cache_ttl: Time to live for the cached directory metadata in seconds
+        :param spot_mapping_url: URL to download the spot mapping from
+        :param spot_cache_file: File to cache the spot mapping in. If it exists,
+            the spots are loaded from it and revalidated on :meth:`update_mapping`
+        :param fingerprint: Options for the :class:`Fingerprinter` used to add
+            content checksums to the file metadata. Disabled if None
+        :param api_cache_size: Number of MOLES API results to cache for paths
+            which are not in the mapping
+        :param api_cache_ttl: Time to live for the cached MOLES API results in seconds
+        :param api_url: URL of the MOLES API get_info endpoint
+        :param api_batch: Options for the :class:`MolesAPIBatcher` used to look
+            up the paths which are not in the mapping
+        :param sidecar: Unix socket of a :class:`MappingSidecar`. If given, the
+            MOLES and spot lookups are made by the sidecar and no mappings are
+            held or refreshed here.
+        :param sidecar_cache_size: Number of sidecar lookups to cache
+        :param sidecar_cache_ttl: Time to live for the cached sidecar lookups in seconds
+        """
 
         self.moles_mapping_url = moles_mapping_url
+        self.mapping_file = mapping_file
+        self.compact_mapping = compact_mapping
+        self.spot_mapping_url = spot_mapping_url
+        self.spot_cache_file = spot_cache_file
+
+        self._spots = None
+        self._moles_mapping = None
+        self._tree = None
+
+        self._spots_ready = threading.Event()
+        self._mapping_ready = threading.Event()
+        self._load_lock = threading.Lock()
+        self._loaders = {}
+        self._load_errors = {}
+
+        self.dir_cache = TTLCache(dir_cache_size, dir_cache_ttl) if dir_cache_size else None
+        self.fingerprinter = Fingerprinter(**fingerprint) if fingerprint is not None else None
+
+        # Results for paths which are not in the mapping are kept here rather
+        # than added to the mapping so that they cannot grow without limit
+        self.api_cache = TTLCache(api_cache_size, api_cache_ttl)
+        self.api_batcher = MolesAPIBatcher(api_url, on_result=self.api_cache.set, **(api_batch or {}))
+        self._memo = threading.local()
+
+        self.sidecar = None
+        self.sidecar_cache = None
+        if sidecar:
+            from .sidecar import SidecarClient
+
+            self.sidecar = SidecarClient(sidecar, on_refresh=self._sidecar_refreshed)
+            self.sidecar_cache = TTLCache(sidecar_cache_size, sidecar_cache_ttl)
+
+        if not deferred:
+            self._load_spots()
+            self._load_mapping()
+
+    @classmethod
+    def from_config(cls, conf: "YamlConfig", **kwargs) -> "PathTools":
+        """
+        Create PathTools from the ``moles``, ``spots`` and ``indexer`` sections
+
+        :param conf: Configuration
+        :param kwargs: Override the options read from the configuration
+        """
+
+        dir_cache = conf.get("indexer", "directory_cache", default={})
+        spots = conf.get("spots", default={})
+        fingerprint = conf.get("indexer", "fingerprint")
+        api_cache = conf.get("moles", "api_cache", default={})
+
+        options = dict(
+            moles_mapping_url=conf.get("moles", "moles_obs_map_url"),
+            compact_mapping=conf.get("moles", "compact_mapping", default=False),
+            deferred=conf.get("indexer", "deferred_init", default=False),
+            dir_cache_size=dir_cache.get("size", 0),
+            dir_cache_ttl=dir_cache.get("ttl", 300),
+            spot_mapping_url=spots.get("url", SPOT_MAPPING_URL),
+            spot_cache_file=spots.get("cache_file"),
+            fingerprint={} if fingerprint is True else fingerprint or None,
+            api_cache_size=api_cache.get("size", 10000),
+            api_cache_ttl=api_cache.get("ttl", 3600),
+            api_url=conf.get("moles", "api_url", default=MOLES_API_URL),
+            api_batch=conf.get("moles", "api_batch"),
+        )
+        options.update(kwargs)
+
+        return cls(**options)
+
+    @property
+    def spots(self):
+        self._wait("spots", self._spots_ready, self._load_spots)
+        return self._spots
+
+    @spots.setter
+    def spots(self, value):
+        self._spots = value
+
+    @property
+    def moles_mapping(self):
+        self._wait("mapping", self._mapping_ready, self._load_mapping)
+        return self._moles_mapping
+
+    @moles_mapping.setter
+    def moles_mapping(self, value):
+        self._moles_mapping = value
+
+    @property
+    def tree(self):
+        self._wait("mapping", self._mapping_ready, self._load_mapping)
+        return self._tree
+
+    @tree.setter
+    def tree(self, value):
+        self._tree = value
+
+    def start_loading(self) -> None:
+        """
+        Load the spot and MOLES mappings in parallel background threads.
+        """
+        self._start_loader("spots", self._load_spots)
+        self._start_loader("mapping", self._load_mapping)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the MOLES mapping to be loaded. The spot mapping is not
+        waited for as it is only needed by some handlers; accessing
+        :attr:`spots` waits for it separately.
+
+        :param timeout: Maximum time to wait in seconds
+        :return: True if the mapping is ready
+        """
+        ready = self._mapping_ready.wait(timeout)
+        self._raise_load_error("mapping")
+        return ready
+
+    def _start_loader(self, name: str, loader) -> None:
+        with self._load_lock:
+            if name in self._loaders:
+                return
+
+            thread = threading.Thread(
+                target=self._run_loader, args=(name, loader), name=f"load-{name}", daemon=True
+            )
+            self._loaders[name] = thread
+
+        thread.start()
+
+    def _run_loader(self, name: str, loader) -> None:
+        try:
+            loader()
+        except Exception as e:
+            self._load_errors[name] = e
+            if name == "spots":
+                self._spots_ready.set()
+            else:
+                self._mapping_ready.set()
+
+    def _wait(self, name: str, event: threading.Event, loader) -> None:
+        """
+        Block until the named mapping is loaded, loading it in this thread
+        if nothing else has started to.
+        """
+        if event.is_set():
+            self._raise_load_error(name)
+            return
+
+        with self._load_lock:
+            started = name in self._loaders
+            if not started:
+                self._loaders[name] = threading.current_thread()
+
+        if not started:
+            self._run_loader(name, loader)
+
+        event.wait()
+        self._raise_load_error(name)
+
+    def _raise_load_error(self, name: str) -> None:
+        error = self._load_errors.get(name)
+        if error:
+            raise RuntimeError(f"Failed to load the {name}") from error
+
+    def _load_spots(self) -> None:
+        if self.sidecar is not None:
+            from .sidecar import SidecarSpots
 
-        if mapping_file:
-            self.moles_mapping = load_moles_mapping(mapping_file)
+            self._spots = SidecarSpots(self.sidecar, self.sidecar_cache)
+            self._spots_ready.set()
+            return
+
+        self._spots = SpotMapping(self.spot_mapping_url, cache_file=self.spot_cache_file)
+        self._spots_ready.set()
+
+    def _load_mapping(self) -> None:
+        # The sidecar holds the mapping
+        if self.sidecar is not None:
+            self._mapping_ready.set()
+            return
+
+        if self.mapping_file:
+            mapping = load_moles_mapping(self.mapping_file)
         else:
-            self.moles_mapping = generate_moles_mapping(self.moles_mapping_url)
+            mapping = generate_moles_mapping(self.moles_mapping_url)
+
+        self._set_mapping(mapping)
+        self._mapping_ready.set()
+
+    def _set_mapping(self, mapping: dict) -> None:
+        """
+        Set the MOLES mapping and build the matching tree
+
+        :param mapping: dict of path to MOLES record metadata
+        """
+
+        if self.compact_mapping:
+            store = CompactMolesStore(mapping)
+            self._moles_mapping = store
+            self._tree = store
+            return
 
         # Setup the matching tree
-        self.tree = DatasetNode()
-        for path in self.moles_mapping:
-            self.tree.add_child(path)
+        tree = DatasetNode()
+        for path in mapping:
+            tree.add_child(path)
+
+        self._moles_mapping = mapping
+        self._tree = tree
+
+    @contextmanager
+    def message_scope(self):
+        """
+        Share the results of :meth:`generate_path_metadata` and :meth:`stat`
+        between everything which processes the current message in this thread.
+        Used when several handlers process the same message.
+        """
+
+        previous = getattr(self._memo, "results", None)
+        self._memo.results = {} if previous is None else previous
+
+        try:
+            yield
+        finally:
+            self._memo.results = previous
+
+    def _memoised(self, kind: str, path: str, func):
+        results = getattr(self._memo, "results", None)
+        if results is None:
+            return func()
+
+        key = (kind, path)
+        if key not in results:
+            results[key] = func()
+        return results[key]
+
+    def stat(self, path: str) -> Optional[os.stat_result]:
+        """
+        :param path: File path
+        :return: os.stat result for the path or None if it does not exist
+        """
+
+        def _stat():
+            try:
+                return os.stat(path)
+            except (FileNotFoundError, PermissionError):
+                return None
+
+        return self._memoised("stat", path, _stat)
 
     def generate_path_metadata(
-        self, path: str
+        self, path: str, fingerprint: bool = True
     ) -> Tuple[Optional[dict], Optional[bool]]:
         """
         Take path and process it to generate metadata as used in ceda directories index
         :param path: path to retrieve metadata for
+        :param fingerprint: Add the content checksum of a file as ``checksum``
+            when fingerprinting is enabled
         :return:
         """
 
+        meta, link = self._memoised("metadata", str(path), lambda: self._generate_path_metadata(path))
+
+        # Callers add to the metadata so each gets its own copy
+        if meta is None:
+            return None, link
+
+        meta = dict(meta)
+
+        if fingerprint and meta["type"] == "file":
+            checksum = self.fingerprint(str(path))
+            if checksum is not None:
+                meta["checksum"] = dict(checksum)
+
+        return meta, link
+
+    def fingerprint(self, path: str) -> Optional[dict]:
+        """
+        :param path: File path
+        :return: Content checksum for the file or None if fingerprinting is
+            disabled or the file was not hashed
+        """
+
+        if self.fingerprinter is None:
+            return None
+
+        return self._memoised("fingerprint", path, lambda: self.fingerprinter.fingerprint(path))
+
+    def prefetch_fingerprints(self, paths: List[str]) -> None:
+        """
+        Start hashing files ahead of :meth:`generate_path_metadata`
+
+        :param paths: File paths
+        """
+
+        if self.fingerprinter is not None:
+            self.fingerprinter.prefetch(paths)
+
+    def _generate_path_metadata(
+        self, path: str
+    ) -> Tuple[Optional[dict], Optional[bool]]:
+
         path = Path(path)
 
+        if self.dir_cache is not None:
+            cached = self.dir_cache.get(str(path))
+            if cached is not MISSING:
+                return dict(cached), cached["link"]
+
         try:
             if not path.exists():
                 return None, None
@@ -176,8 +509,32 @@ class PathTools:
                 meta["url"] = record["url"]
                 meta["record_type"] = record["record_type"]
 
+            if self.dir_cache is not None:
+                self.dir_cache.set(str(path), dict(meta))
+
         return meta, meta["link"]
 
+    def invalidate_directory_metadata(self, path: str) -> None:
+        """
+        Remove the cached metadata for a directory and everything below it
+
+        :param path: Directory path
+        """
+        if self.dir_cache is not None:
+            self.dir_cache.invalidate_tree(str(Path(path)))
+
+    def cache_info(self) -> dict:
+        """
+        :return: Statistics for the caches held by PathTools
+        """
+        info = {}
+        if self.dir_cache is not None:
+            info["directory_metadata"] = self.dir_cache.info()
+        info["moles_api"] = self.api_cache.info()
+        if self.sidecar_cache is not None:
+            info["sidecar"] = self.sidecar_cache.info()
+        return info
+
     def get_moles_record_metadata(self, path: str) -> Optional[dict]:
         """
         Try and find metadata for a MOLES record associated with the path.
@@ -189,15 +546,21 @@ class PathTools:
         # Condition path - remove trailing slash
         path = path.rstrip("/")
 
+        if self.sidecar is not None:
+            return self.get_moles_records([path])[0]
+
+        return self._mapping_record(path) or self._get_moles_record_metadata_data_from_api(path)
+
+    def _mapping_record(self, path: str) -> Optional[dict]:
+        """
+        :param path: Directory path without a trailing slash
+        :return: The MOLES record from the mapping or None
+        """
+
         # Search the tree
         match = self.tree.search_name(path)
         if match:
-            result = self.moles_mapping.get(path)
-
-            if result:
-                return result
-
-        return self._get_moles_record_metadata_data_from_api(path)
+            return self.moles_mapping.get(path)
 
     def _get_moles_record_metadata_data_from_api(self, path: str) -> Optional[dict]:
         """
@@ -207,16 +570,67 @@ class PathTools:
         :return: Metadata dict | None
         """
 
-        url = f"http://api.catalogue.ceda.ac.uk/api/v0/obs/get_info{path}"
-        try:
-            response = requests.get(url, timeout=10)
-        except Timeout:
-            return
+        cached = self.api_cache.get(path)
+        if cached is not MISSING:
+            return cached
+
+        # Paths without a record are cached by the batcher too so they are not
+        # requested again. Errors and timeouts are not cached.
+        return self.api_batcher.get(path)
+
+    def get_moles_records(self, paths: List[str]) -> List[Optional[dict]]:
+        """
+        Look up the MOLES records for many paths. With a sidecar, the paths
+        which are not in the local cache are looked up in a single request.
+
+        :param paths: Directory paths
+        :return: MOLES record metadata for each path or None
+        """
 
-        # Update moles mapping
-        if response:
-            self.moles_mapping[path] = response.json()
-            return response.json()
+        paths = [path.rstrip("/") for path in paths]
+
+        if self.sidecar is None:
+            records = [self._mapping_record(path) for path in paths]
+
+            # The misses are looked up in the API together
+            self.api_batcher.submit({
+                path for path, record in zip(paths, records)
+                if not record and self.api_cache.get(path) is MISSING
+            })
+
+            return [
+                record or self._get_moles_record_metadata_data_from_api(path)
+                for path, record in zip(paths, records)
+            ]
+
+        results = [self.sidecar_cache.get(("moles", path)) for path in paths]
+        missing = sorted({path for path, result in zip(paths, results) if result is MISSING})
+
+        if not missing:
+            return results
+
+        found = dict(zip(missing, self.sidecar.moles_records(missing)))
+        for path, record in found.items():
+            self.sidecar_cache.set(("moles", path), record)
+
+        return [found[path] if result is MISSING else result for path, result in zip(paths, results)]
+
+    def prefetch_moles_records(self, paths: List[str]) -> None:
+        """
+        Fill the local cache with the MOLES records for many paths in one
+        sidecar request. Does nothing without a sidecar.
+
+        :param paths: Directory paths
+        """
+
+        if self.sidecar is not None and paths:
+            self.get_moles_records(paths)
+
+    def _sidecar_refreshed(self) -> None:
+        # The cached directory metadata includes the MOLES records
+        self.sidecar_cache.clear()
+        if self.dir_cache is not None:
+            self.dir_cache.clear()
 
     @staticmethod
     def get_readme(path: str) -> Optional[str]:
@@ -235,15 +649,32 @@ class PathTools:
             return content.encode(errors="ignore").decode()
 
     def update_mapping(self) -> bool:
+        # The sidecar refreshes the mappings for the node
+        if self.sidecar is not None:
+            return True
+
+        import requests
+        from requests.exceptions import RequestException
 
         successful = True
         # Update the moles mapping
         try:
-            self.spots._download_mapping()
-            self.moles_mapping = requests.get(self.moles_mapping_url, timeout=30).json()
-        except (ValueError, Timeout):
+            # Only downloaded if the spot mapping has changed
+            self.spots.refresh()
+
+            if self.compact_mapping:
+                self._set_mapping(generate_moles_mapping(self.moles_mapping_url))
+            else:
+                self.moles_mapping = requests.get(self.moles_mapping_url, timeout=30).json()
+        except (ValueError, RequestException, ConnectionError):
             successful = False
 
+        # The cached directory metadata includes the MOLES records
+        if successful:
+            self.api_cache.clear()
+            if self.dir_cache is not None:
+                self.dir_cache.clear()
+
         return successful
 
     @classmethod
@@ -0,0 +1,363 @@
+# encoding: utf-8
+"""
+Anti-entropy reconciler for the archive and the indices.
+
+Each directory is given a digest of the names, kinds, sizes and mtimes of its
+own entries. The archive is walked from the top down, level by level, and each
+directory is compared with the record stored by the last run as soon as it has
+been listed. Only the directories whose digest has changed have their entries
+compared and their record rewritten, and corrective MKDIR, RMDIR, SYMLINK,
+DEPOSIT and REMOVE events are emitted for the differences. The records are
+released once compared, so memory is bounded by the width of a level.
+
+There is no digest for a sub-tree. A change below a directory does not change
+the directory itself, so there is nothing to show that a sub-tree is unchanged
+and every directory is listed on every run. The time taken scales with the size of
+the archive. The events and the state written scale with the amount of change.
+
+With ``quick``, directories whose mtime has not changed reuse the stored file
+attributes rather than stat-ing every file, so an unchanged directory costs a
+single stat. Files rewritten in place are not seen in this mode.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Typing imports
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pika import BlockingConnection
+    from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+    from rabbit_indexer.utils.path_tools import PathFilter
+
+logger = logging.getLogger(__name__)
+
+FILE = 'f'
+DIRECTORY = 'd'
+LINK = 'l'
+
+
+class DigestStore:
+    """
+    Directory records from the last run, held in a sqlite database.
+    A record is a dict with the directory ``mtime``, its ``digest`` and its
+    ``entries``, a mapping of name to ``[kind, size, mtime]``.
+
+    Parameters:
+        path: sqlite database file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, record TEXT)')
+
+    def get(self, path: str) -> Optional[dict]:
+        row = self._db.execute('SELECT record FROM dirs WHERE path = ?', (path,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, path: str, record: dict) -> None:
+        self._db.execute('REPLACE INTO dirs VALUES (?, ?)', (path, json.dumps(record)))
+
+    def delete_tree(self, path: str) -> List[Tuple[str, dict]]:
+        """
+        Delete the records for a directory and everything below it
+
+        :param path: Directory path
+        :return: (path, record) for the deleted records, deepest first
+        """
+        # '0' sorts directly after '/'
+        where = 'path = ? OR (path >= ? AND path < ?)'
+        params = (path, f'{path}/', f'{path}0')
+
+        rows = self._db.execute(f'SELECT path, record FROM dirs WHERE {where} ORDER BY path DESC', params).fetchall()
+        self._db.execute(f'DELETE FROM dirs WHERE {where}', params)
+
+        return [(row_path, json.loads(record)) for row_path, record in rows]
+
+    def commit(self) -> None:
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
+
+
+def scan_directory(path: str, previous: Optional[dict] = None) -> dict:
+    """
+    List a directory. If ``previous`` is given and the directory mtime has not
+    changed, the file attributes are taken from it rather than from stat.
+
+    :param path: Directory path
+    :param previous: Stored record for the directory
+    :return: record without the digest
+    """
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except (FileNotFoundError, PermissionError):
+        return {'mtime': None, 'entries': {}}
+
+    if previous is not None and previous.get('mtime') == mtime:
+        return {'mtime': mtime, 'entries': previous['entries']}
+
+    entries = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_symlink():
+                        entries[entry.name] = [LINK, 0, os.readlink(entry.path)]
+                    elif entry.is_dir(follow_symlinks=False):
+                        entries[entry.name] = [DIRECTORY, 0, 0]
+                    else:
+                        stat = entry.stat(follow_symlinks=False)
+                        entries[entry.name] = [FILE, stat.st_size, stat.st_mtime_ns]
+                except (FileNotFoundError, PermissionError):
+                    continue
+    except (FileNotFoundError, PermissionError):
+        pass
+
+    return {'mtime': mtime, 'entries': entries}
+
+
+def directory_digest(entries: Dict[str, list]) -> str:
+    """
+    :param entries: name to [kind, size, mtime]
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for name in sorted(entries):
+        kind, size, mtime = entries[name]
+        line = f'{kind}\0{name}\0{size}\0{mtime}\n'
+        digest.update(line.encode(errors='surrogateescape'))
+
+    return digest.hexdigest()
+
+
+class DirectoryReconciler:
+    """
+    Compares the archive below ``root`` with the stored digests and emits
+    corrective events.
+
+    Parameters:
+        store: DigestStore with the records from the last run
+        emit: Called with an IngestMessage for each difference
+        workers: Number of directories scanned in parallel
+        quick: Reuse the stored file attributes for directories whose mtime has not changed
+        path_filter: Optional PathFilter. Paths which are not allowed are ignored.
+        batch_size: Number of directories of a level listed and compared at a time
+    """
+
+    def __init__(
+        self,
+        store: DigestStore,
+        emit: Callable[['IngestMessage'], None],
+        workers: int = 8,
+        quick: bool = False,
+        path_filter: Optional['PathFilter'] = None,
+        batch_size: int = 1000
+    ):
+        self.store = store
+        self.emit = emit
+        self.workers = workers
+        self.quick = quick
+        self.path_filter = path_filter
+        self.batch_size = batch_size
+
+        self.stats = {'directories': 0, 'changed': 0, 'events': 0}
+        self._timestamp = None
+
+    def reconcile(self, root: str) -> dict:
+        """
+        Walk the tree below root level by level, in parallel, comparing each
+        directory as it is listed and storing the new records for the
+        directories which have changed
+
+        :param root: Directory to reconcile
+        :return: stats
+        """
+
+        root = root.rstrip('/') or '/'
+        self._timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        frontier = [root]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while frontier:
+                next_frontier = []
+
+                for start in range(0, len(frontier), self.batch_size):
+                    batch = frontier[start:start + self.batch_size]
+                    stored = [self.store.get(path) for path in batch]
+                    previous = stored if self.quick else [None] * len(batch)
+
+                    for path, old, new in zip(batch, stored, pool.map(scan_directory, batch, previous)):
+                        next_frontier.extend(self._compare(path, old, new))
+
+                self.store.commit()
+                frontier = next_frontier
+
+        return self.stats
+
+    def _compare(self, path: str, old: Optional[dict], new: dict) -> List[str]:
+        """
+        Compare a directory with its stored record, emit the events for the
+        differences and store the new record if it has changed
+
+        :param path: Directory path
+        :param old: Stored record
+        :param new: Record from the scan
+        :return: The sub-directories to compare next
+        """
+
+        if self.path_filter is not None:
+            new['entries'] = {
+                name: value for name, value in new['entries'].items()
+                if self.path_filter.allow_path(os.path.join(path, name))
+            }
+
+        new['digest'] = directory_digest(new['entries'])
+        self.stats['directories'] += 1
+
+        new_entries = new['entries']
+        subdirs = [os.path.join(path, name) for name, (kind, _, _) in new_entries.items() if kind == DIRECTORY]
+
+        if old is not None and old['digest'] == new['digest']:
+            return subdirs
+
+        self.stats['changed'] += 1
+        old_entries = old['entries'] if old else {}
+
+        for name, (kind, size, mtime) in new_entries.items():
+            child = os.path.join(path, name)
+            previous = old_entries.get(name)
+
+            if previous is not None and previous[0] != kind:
+                self._removed(child, previous[0])
+                previous = None
+
+            if kind == DIRECTORY:
+                if previous is None:
+                    self._event(child, 'MKDIR')
+
+            elif kind == LINK:
+                if previous != [kind, size, mtime]:
+                    self._event(child, 'SYMLINK')
+
+            elif previous != [kind, size, mtime]:
+                self._event(child, 'DEPOSIT', size)
+
+        for name, (kind, _, _) in old_entries.items():
+            if name not in new_entries:
+                self._removed(os.path.join(path, name), kind)
+
+        self.store.put(path, new)
+        return subdirs
+
+    def _removed(self, path: str, kind: str) -> None:
+        if kind == DIRECTORY:
+            # Everything recorded below the directory goes with it
+            for directory, record in self.store.delete_tree(path):
+                for name, (entry_kind, _, _) in record['entries'].items():
+                    self._event(os.path.join(directory, name), 'RMDIR' if entry_kind == DIRECTORY else 'REMOVE')
+            self._event(path, 'RMDIR')
+        else:
+            self._event(path, 'REMOVE')
+
+    def _event(self, path: str, action: str, size: int = 0) -> None:
+        from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+
+        self.stats['events'] += 1
+        self.emit(IngestMessage(self._timestamp, path, action, str(size), 'reconcile'))
+
+
+def _stdout_emitter() -> Callable[['IngestMessage'], None]:
+    def emit(message):
+        sys.stdout.write(json.dumps(message._asdict()) + '\n')
+    return emit
+
+
+def _connect(conf) -> 'BlockingConnection':
+    import pika
+
+    credentials = pika.PlainCredentials(conf.get('rabbit_server', 'user'), conf.get('rabbit_server', 'password'))
+    return pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=conf.get('rabbit_server', 'name'),
+            credentials=credentials,
+            virtual_host=conf.get('rabbit_server', 'vhost'),
+        )
+    )
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Reconcile the indices with the archive using per-directory digests')
+
+    parser.add_argument('paths', nargs='+', help='Directories to reconcile')
+    parser.add_argument('--state', required=True, help='sqlite file to keep the digests in between runs')
+    parser.add_argument('--config', nargs='+', help='Config files. Used for the path filter and to publish the events')
+    parser.add_argument('--publish', action='store_true', help='Publish the events to the dest_exchange rather than printing them')
+    parser.add_argument('--workers', type=int, default=8, help='Directories scanned in parallel')
+    parser.add_argument('--quick', action='store_true', help='Skip stat-ing the files in directories whose mtime has not changed')
+    parser.add_argument('--init', action='store_true', help='Record the digests without emitting any events')
+
+    args = parser.parse_args(args)
+
+    logging.basicConfig(format='%(asctime)s @%(name)s [%(levelname)s]:    %(message)s', level=logging.INFO)
+
+    conf = None
+    path_filter = None
+    if args.config:
+        from rabbit_indexer.utils import PathFilter, YamlConfig
+
+        conf = YamlConfig()
+        conf.read(args.config)
+        path_filter = PathFilter(**conf.get('indexer', 'path_filter', default={}))
+
+    publisher = None
+    connection = None
+    if args.init:
+        def emit(message):
+            pass
+
+    elif args.publish:
+        if conf is None:
+            parser.error('--publish needs --config')
+
+        from rabbit_indexer.queue_handler.envelope import EnvelopePublisher
+
+        connection = _connect(conf)
+        publisher = EnvelopePublisher(connection.channel(), conf.get('rabbit_server', 'dest_exchange')['name'])
+        emit = publisher.publish
+    else:
+        emit = _stdout_emitter()
+
+    store = DigestStore(args.state)
+    reconciler = DirectoryReconciler(store, emit, workers=args.workers, quick=args.quick, path_filter=path_filter)
+
+    try:
+        for path in args.paths:
+            stats = reconciler.reconcile(path)
+            logger.info('Reconciled %s: %s', path, stats)
+    finally:
+        if publisher is not None:
+            publisher.close()
+            connection.close()
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,528 @@
+# encoding: utf-8
+"""
+Node local sidecar which holds the MOLES mapping, spot mapping and path filter
+once for all the consumers on a node and answers batched lookups over a Unix
+domain socket. The mappings are refreshed once by the sidecar rather than by
+every consumer.
+
+Protocol. Every frame is a ``>I`` payload length followed by the payload.
+Strings are a ``>H`` byte length and utf-8 bytes, with a length of 0xFFFF for
+None.
+
+    request    ``>BH`` operation and number of paths, then the paths
+    response   ``>BQ`` status and mapping generation, then one item per path:
+               OP_MOLES   a flag byte, then the title, url and record_type strings if set
+               OP_SPOT    a string
+               OP_FILTER  a byte, 1 if the path is allowed
+               On error, the status is STATUS_ERROR and the payload is the message.
+
+The generation changes whenever the sidecar refreshes the mappings, so that
+clients know to drop their local caches.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+# Typing imports
+from typing import Callable, List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from .cache import TTLCache
+    from .path_tools import PathFilter, PathTools
+
+logger = logging.getLogger(__name__)
+
+OP_MOLES = 1
+OP_SPOT = 2
+OP_FILTER = 3
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+FRAME = struct.Struct('>I')
+REQUEST = struct.Struct('>BH')
+RESPONSE = struct.Struct('>BQ')
+LENGTH = struct.Struct('>H')
+
+NONE_LENGTH = 0xFFFF
+MAX_BATCH = 0xFFFF
+MAX_FRAME = 64 * 2**20
+
+RECORD_FIELDS = ('title', 'url', 'record_type')
+
+
+def pack_string(value: Optional[str]) -> bytes:
+    if value is None:
+        return LENGTH.pack(NONE_LENGTH)
+
+    data = value.encode('utf-8', errors='surrogateescape')
+    if len(data) >= NONE_LENGTH:
+        raise ValueError(f'String too long for the sidecar protocol: {len(data)} bytes')
+
+    return LENGTH.pack(len(data)) + data
+
+
+def unpack_string(buffer: bytes, offset: int):
+    """
+    :return: The string and the offset of the next item
+    """
+    length, = LENGTH.unpack_from(buffer, offset)
+    offset += LENGTH.size
+
+    if length == NONE_LENGTH:
+        return None, offset
+
+    return buffer[offset:offset + length].decode('utf-8', errors='surrogateescape'), offset + length
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Sidecar connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def send_frame(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(FRAME.pack(len(payload)) + payload)
+
+
+def recv_frame(sock: socket.socket) -> bytes:
+    length, = FRAME.unpack(_recv_exactly(sock, FRAME.size))
+    if length > MAX_FRAME:
+        raise ConnectionError(f'Sidecar frame of {length} bytes is too large')
+    return _recv_exactly(sock, length)
+
+
+def encode_request(op: int, paths: List[str]) -> bytes:
+    return REQUEST.pack(op, len(paths)) + b''.join(pack_string(path) for path in paths)
+
+
+def decode_request(payload: bytes):
+    """
+    :return: The operation and the list of paths
+    """
+    op, count = REQUEST.unpack_from(payload)
+    offset = REQUEST.size
+
+    paths = []
+    for _ in range(count):
+        path, offset = unpack_string(payload, offset)
+        paths.append(path)
+
+    return op, paths
+
+
+def encode_results(op: int, results: list) -> bytes:
+    if op == OP_FILTER:
+        return bytes(1 if allowed else 0 for allowed in results)
+
+    if op == OP_SPOT:
+        return b''.join(pack_string(spot) for spot in results)
+
+    parts = []
+    for record in results:
+        if not record:
+            parts.append(b'\x00')
+            continue
+
+        parts.append(b'\x01')
+        parts.extend(pack_string(record.get(field)) for field in RECORD_FIELDS)
+
+    return b''.join(parts)
+
+
+def decode_results(op: int, count: int, payload: bytes, offset: int) -> list:
+    if op == OP_FILTER:
+        return [bool(allowed) for allowed in payload[offset:offset + count]]
+
+    results = []
+    for _ in range(count):
+        if op == OP_SPOT:
+            spot, offset = unpack_string(payload, offset)
+            results.append(spot)
+            continue
+
+        flag = payload[offset]
+        offset += 1
+
+        if not flag:
+            results.append(None)
+            continue
+
+        record = {}
+        for field in RECORD_FIELDS:
+            record[field], offset = unpack_string(payload, offset)
+        results.append(record)
+
+    return results
+
+
+class _LookupHandler(socketserver.StreamRequestHandler):
+    """
+    Answers requests on one client connection until it is closed
+    """
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections.add(self.request)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self.request)
+        super().finish()
+
+    def handle(self):
+        sidecar = self.server.sidecar
+
+        while True:
+            try:
+                payload = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                op, paths = decode_request(payload)
+                results = sidecar.lookup(op, paths)
+                response = RESPONSE.pack(STATUS_OK, sidecar.generation) + encode_results(op, results)
+            except Exception as e:
+                logger.exception('Sidecar lookup failed')
+                response = RESPONSE.pack(STATUS_ERROR, sidecar.generation) + pack_string(str(e)[:1024])
+
+            try:
+                send_frame(self.request, response)
+            except OSError:
+                return
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        self.connections = set()
+        self.lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def close_connections(self) -> None:
+        """
+        Close the open client connections, which shutdown leaves running
+        """
+        with self.lock:
+            connections = list(self.connections)
+
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class MappingSidecar:
+    """
+    Holds the mappings for all the consumers on a node and serves lookups on a
+    Unix domain socket. The mappings are refreshed every ``refresh_interval``
+    seconds.
+
+    Parameters:
+        path_tools: PathTools which owns the MOLES and spot mappings
+        socket_path: Unix domain socket to listen on
+        path_filter: Filter used to answer OP_FILTER requests. Everything is allowed if None.
+        refresh_interval: Seconds between refreshes of the mappings
+    """
+
+    def __init__(
+        self,
+        path_tools: 'PathTools',
+        socket_path: str,
+        path_filter: Optional['PathFilter'] = None,
+        refresh_interval: float = 1800
+    ):
+        self.path_tools = path_tools
+        self.socket_path = socket_path
+        self.path_filter = path_filter
+        self.refresh_interval = refresh_interval
+
+        # Starts from the clock so that clients of a restarted sidecar drop their caches
+        self.generation = time.time_ns()
+
+        self._closed = threading.Event()
+        self._serving = False
+        self._refresher = None
+
+        # A socket left behind by a sidecar which did not shut down cleanly
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        self.server = _UnixServer(socket_path, _LookupHandler)
+        self.server.sidecar = self
+
+    def lookup(self, op: int, paths: List[str]) -> list:
+        """
+        :param op: OP_MOLES, OP_SPOT or OP_FILTER
+        :param paths: Paths to look up
+        :return: One result for each path
+        """
+
+        if op == OP_MOLES:
+            return self.path_tools.get_moles_records(paths)
+
+        if op == OP_SPOT:
+            return self.path_tools.spots.spots_for(paths)
+
+        if op == OP_FILTER:
+            if self.path_filter is None:
+                return [True] * len(paths)
+            return [self.path_filter.allow_path(path) for path in paths]
+
+        raise ValueError(f'Unknown sidecar operation {op}')
+
+    def refresh(self) -> bool:
+        """
+        Refresh the mappings and move to a new generation if successful
+        """
+
+        successful = self.path_tools.update_mapping()
+        if successful:
+            self.generation += 1
+            logger.info('Refreshed mappings. Generation %s', self.generation)
+        else:
+            logger.warning('Failed to refresh mappings')
+
+        return successful
+
+    def _run_refresh(self) -> None:
+        while not self._closed.wait(self.refresh_interval):
+            self.refresh()
+
+    def serve_forever(self) -> None:
+        """
+        Serve lookups until :meth:`close` is called
+        """
+
+        self._refresher = threading.Thread(target=self._run_refresh, name='sidecar-refresh', daemon=True)
+        self._refresher.start()
+
+        logger.info('Sidecar listening on %s', self.socket_path)
+        self._serving = True
+        self.server.serve_forever()
+
+    def close(self) -> None:
+        self._closed.set()
+
+        # shutdown waits for serve_forever to return so would block if it never ran
+        if self._serving:
+            self.server.shutdown()
+        self.server.server_close()
+        self.server.close_connections()
+
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+class SidecarClient:
+    """
+    Client for :class:`MappingSidecar`. Each thread has its own connection,
+    which is reopened once if the sidecar has been restarted.
+
+    Parameters:
+        socket_path: Unix domain socket the sidecar listens on
+        timeout: Socket timeout in seconds
+        on_refresh: Called when the sidecar has moved to a new generation of the mappings
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 5, on_refresh: Optional[Callable[[], None]] = None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.on_refresh = on_refresh
+
+        self.generation = None
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+
+        self._local.sock = sock
+        return sock
+
+    def _disconnect(self) -> None:
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _exchange(self, request: bytes) -> bytes:
+        for attempt in range(2):
+            sock = getattr(self._local, 'sock', None)
+
+            try:
+                if sock is None:
+                    sock = self._connect()
+
+                send_frame(sock, request)
+                return recv_frame(sock)
+
+            except OSError:
+                self._disconnect()
+                if attempt:
+                    raise
+
+    def _request(self, op: int, paths: List[str]) -> list:
+        results = []
+
+        for start in range(0, len(paths), MAX_BATCH):
+            batch = paths[start:start + MAX_BATCH]
+            payload = self._exchange(encode_request(op, batch))
+
+            status, generation = RESPONSE.unpack_from(payload)
+            self._set_generation(generation)
+
+            if status != STATUS_OK:
+                message, _ = unpack_string(payload, RESPONSE.size)
+                raise RuntimeError(f'Sidecar lookup failed: {message}')
+
+            results.extend(decode_results(op, len(batch), payload, RESPONSE.size))
+
+        return results
+
+    def _set_generation(self, generation: int) -> None:
+        previous = self.generation
+        self.generation = generation
+
+        if previous is not None and previous != generation and self.on_refresh is not None:
+            self.on_refresh()
+
+    def moles_records(self, paths: List[str]) -> List[Optional[dict]]:
+        """
+        :param paths: Directory paths
+        :return: The MOLES record title, url and record_type for each path, or None
+        """
+        return self._request(OP_MOLES, paths)
+
+    def spots(self, paths: List[str]) -> List[Optional[str]]:
+        """
+        :param paths: File or directory paths
+        :return: The spot for each path, or None
+        """
+        return self._request(OP_SPOT, paths)
+
+    def allow_paths(self, paths: List[str]) -> List[bool]:
+        """
+        :param paths: File or directory paths
+        :return: The path filter decision for each path
+        """
+        return self._request(OP_FILTER, paths)
+
+    def close(self) -> None:
+        self._disconnect()
+
+
+class SidecarSpots:
+    """
+    Spot lookups through the sidecar, with the lookup methods of
+    :class:`SpotMapping` used by the handlers. Results are kept in the local cache.
+
+    Parameters:
+        client: Sidecar client
+        cache: Local cache shared with the MOLES lookups
+    """
+
+    def __init__(self, client: SidecarClient, cache: 'TTLCache'):
+        self.client = client
+        self.cache = cache
+
+    def get_spot(self, path: str) -> Optional[str]:
+        return self.spots_for([path])[0]
+
+    def spots_for(self, paths: List[str]) -> List[Optional[str]]:
+        from .cache import MISSING
+
+        results = [self.cache.get(('spot', path)) for path in paths]
+        missing = sorted({path for path, result in zip(paths, results) if result is MISSING})
+
+        if missing:
+            found = dict(zip(missing, self.client.spots(missing)))
+            for path, spot in found.items():
+                self.cache.set(('spot', path), spot)
+
+            results = [found[path] if result is MISSING else result for path, result in zip(paths, results)]
+
+        return results
+
+    def refresh(self) -> bool:
+        # The sidecar refreshes the spot mapping for the node
+        return False
+
+
+class SidecarPathFilter:
+    """
+    Path filter decisions from the sidecar, used in place of :class:`PathFilter`
+
+    Parameters:
+        client: Sidecar client
+    """
+
+    def __init__(self, client: SidecarClient):
+        self.client = client
+
+    def allow_path(self, path: str) -> bool:
+        return self.client.allow_paths([path])[0]
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Serve the MOLES mapping, spot mapping and path filter to the consumers on this node')
+    parser.add_argument('--config', nargs='+', required=True, help='Config files. The same files as the consumers.')
+    args = parser.parse_args(args)
+
+    from .log_setup import setup_logging
+    from .path_tools import PathFilter, PathTools
+    from .yaml_config import YamlConfig
+
+    conf = YamlConfig()
+    conf.read(args.config)
+    setup_logging(conf)
+
+    sidecar_conf = conf.get('indexer', 'sidecar', default={})
+    if not sidecar_conf.get('socket'):
+        parser.error('indexer.sidecar.socket is not set')
+
+    # Loaded before listening so that the consumers never wait on the sidecar
+    path_tools = PathTools.from_config(conf, deferred=False)
+
+    sidecar = MappingSidecar(
+        path_tools,
+        sidecar_conf['socket'],
+        path_filter=PathFilter(**conf.get('indexer', 'path_filter', default={})),
+        refresh_interval=conf.get('indexer', 'refresh_interval', default=30) * 60,
+    )
+
+    try:
+        sidecar.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sidecar.close()
+
+
+if __name__ == '__main__':
+    main()
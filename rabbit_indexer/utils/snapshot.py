@@ -0,0 +1,523 @@
+# encoding: utf-8
+"""
+Columnar snapshots of the directory metadata for rebuilding ``ceda-dirs``
+offline.
+
+The exporter walks the archive level by level in parallel and writes the
+``PathTools.generate_path_metadata`` output for each directory, with the MOLES
+record, into chunked files. The files are Parquet if pyarrow is installed,
+otherwise gzip compressed NDJSON. Each row is keyed by ``PathTools.generate_id``.
+A ``manifest.json`` listing the files is written last, so a snapshot without
+one is incomplete.
+
+The loader streams the files into the index with parallel bulk requests, one
+file per worker.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import argparse
+import gzip
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Typing imports
+from typing import Callable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from .path_tools import PathFilter, PathTools
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+COLUMNS = ('id', 'path', 'dir', 'depth', 'archive_path', 'link', 'type', 'title', 'url', 'record_type')
+
+
+class SnapshotWriter(ABC):
+    """
+    Writes rows to numbered files of ``rows_per_file`` rows. Files are
+    written under a temporary name and renamed once complete.
+
+    Parameters:
+        directory: Directory to write the snapshot to
+        prefix: File name prefix
+        rows_per_file: Number of rows in a file
+        batch_size: Number of rows written at a time
+    """
+
+    FORMAT = None
+    SUFFIX = None
+
+    def __init__(self, directory: str, prefix: str = 'ceda-dirs', rows_per_file: int = 1000000, batch_size: int = 10000):
+        self.directory = directory
+        self.prefix = prefix
+        self.rows_per_file = rows_per_file
+        self.batch_size = batch_size
+
+        self.files = []
+
+        self._batch = []
+        self._filename = None
+        self._file_rows = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, row: dict) -> None:
+        self._batch.append(row)
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        batch, self._batch = self._batch, []
+
+        while batch:
+            if self._filename is None:
+                self._filename = f'{self.prefix}-{len(self.files):05d}{self.SUFFIX}'
+                self._open(os.path.join(self.directory, f'{self._filename}.tmp'))
+
+            rows = batch[:self.rows_per_file - self._file_rows]
+            batch = batch[len(rows):]
+
+            self._write_rows(rows)
+            self._file_rows += len(rows)
+
+            if self._file_rows >= self.rows_per_file:
+                self._finish_file()
+
+    def _finish_file(self) -> None:
+        self._close()
+
+        path = os.path.join(self.directory, self._filename)
+        os.replace(f'{path}.tmp', path)
+        logger.info('Wrote %s rows to %s', self._file_rows, path)
+
+        self.files.append({'file': self._filename, 'rows': self._file_rows})
+        self._filename = None
+        self._file_rows = 0
+
+    def close(self) -> None:
+        """
+        Finish the last file and write the manifest
+        """
+
+        self._flush()
+        if self._filename is not None:
+            self._finish_file()
+
+        manifest = {
+            'format': self.FORMAT,
+            'columns': list(COLUMNS),
+            'created': datetime.now().isoformat(),
+            'rows': sum(file['rows'] for file in self.files),
+            'files': self.files,
+        }
+
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(f'{path}.tmp', 'w') as writer:
+            json.dump(manifest, writer, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+    @abstractmethod
+    def _open(self, path: str) -> None:
+        pass
+
+    @abstractmethod
+    def _write_rows(self, rows: List[dict]) -> None:
+        pass
+
+    @abstractmethod
+    def _close(self) -> None:
+        pass
+
+
+class NdjsonSnapshotWriter(SnapshotWriter):
+    """
+    Writes the rows as gzip compressed NDJSON
+    """
+
+    FORMAT = 'ndjson'
+    SUFFIX = '.jsonl.gz'
+
+    def _open(self, path: str) -> None:
+        self._writer = gzip.open(path, 'wt', encoding='utf-8', errors='surrogateescape')
+
+    def _write_rows(self, rows: List[dict]) -> None:
+        self._writer.write(''.join(json.dumps(row) + '\n' for row in rows))
+
+    def _close(self) -> None:
+        self._writer.close()
+
+
+class ParquetSnapshotWriter(SnapshotWriter):
+    """
+    Writes the rows as Parquet with a row group for each batch
+
+    Parameters:
+        compression: Parquet compression codec
+        kwargs: Options for :class:`SnapshotWriter`
+    """
+
+    FORMAT = 'parquet'
+    SUFFIX = '.parquet'
+
+    def __init__(self, directory: str, compression: str = 'zstd', **kwargs):
+        import pyarrow as pa
+
+        self.compression = compression
+        self.schema = pa.schema([
+            ('id', pa.string()),
+            ('path', pa.string()),
+            ('dir', pa.string()),
+            ('depth', pa.int32()),
+            ('archive_path', pa.string()),
+            ('link', pa.bool_()),
+            ('type', pa.string()),
+            ('title', pa.string()),
+            ('url', pa.string()),
+            ('record_type', pa.string()),
+        ])
+
+        super().__init__(directory, **kwargs)
+
+    def _open(self, path: str) -> None:
+        import pyarrow.parquet as pq
+
+        self._writer = pq.ParquetWriter(path, self.schema, compression=self.compression)
+
+    def _write_rows(self, rows: List[dict]) -> None:
+        import pyarrow as pa
+
+        table = pa.table({column: [row.get(column) for row in rows] for column in COLUMNS}, schema=self.schema)
+        self._writer.write_table(table)
+
+    def _close(self) -> None:
+        self._writer.close()
+
+
+def get_writer(directory: str, snapshot_format: str = 'auto', **kwargs) -> SnapshotWriter:
+    """
+    :param directory: Directory to write the snapshot to
+    :param snapshot_format: parquet, ndjson or auto to use parquet if pyarrow is installed
+    :param kwargs: Options for the writer
+    """
+
+    if snapshot_format == 'auto':
+        try:
+            import pyarrow.parquet  # noqa: F401
+            snapshot_format = 'parquet'
+        except ImportError:
+            logger.info('pyarrow is not installed, writing NDJSON')
+            snapshot_format = 'ndjson'
+
+    if snapshot_format == 'parquet':
+        return ParquetSnapshotWriter(directory, **kwargs)
+
+    if snapshot_format == 'ndjson':
+        return NdjsonSnapshotWriter(directory, **kwargs)
+
+    raise ValueError(f'Snapshot format must be one of parquet, ndjson or auto. You have provided {snapshot_format}')
+
+
+def snapshot_files(directory: str) -> List[str]:
+    """
+    :param directory: Snapshot directory
+    :return: Paths of the files listed in the manifest
+    """
+
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No {MANIFEST_FILE} in {directory}. The export did not finish.')
+
+    with open(path) as reader:
+        manifest = json.load(reader)
+
+    return [os.path.join(directory, file['file']) for file in manifest['files']]
+
+
+def read_snapshot_file(path: str, batch_size: int = 10000) -> Iterator[List[dict]]:
+    """
+    :param path: Parquet or NDJSON snapshot file
+    :param batch_size: Number of rows in a batch
+    :return: Batches of rows
+    """
+
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            columns = batch.to_pydict()
+            names = list(columns)
+            yield [dict(zip(names, values)) for values in zip(*columns.values())]
+        return
+
+    batch = []
+    with gzip.open(path, 'rt', encoding='utf-8', errors='surrogateescape') as reader:
+        for line in reader:
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    if batch:
+        yield batch
+
+
+class SnapshotExporter:
+    """
+    Walks the archive below each root, level by level, and writes a row for
+    every directory and symlink to a directory. Symlinks are not followed.
+
+    Parameters:
+        path_tools: PathTools with the MOLES mapping
+        writer: SnapshotWriter
+        workers: Number of directories read in parallel
+        path_filter: Optional PathFilter. Paths which are not allowed are skipped.
+    """
+
+    def __init__(
+        self,
+        path_tools: 'PathTools',
+        writer: SnapshotWriter,
+        workers: int = 8,
+        path_filter: Optional['PathFilter'] = None
+    ):
+        self.path_tools = path_tools
+        self.writer = writer
+        self.workers = workers
+        self.path_filter = path_filter
+
+        self.stats = {'directories': 0, 'links': 0, 'rows': 0}
+
+    def row(self, path: str) -> Optional[dict]:
+        """
+        :param path: Directory path
+        :return: Snapshot row with the directory metadata or None if it has gone
+        """
+
+        meta, _ = self.path_tools.generate_path_metadata(path, fingerprint=False)
+        if meta is None:
+            return None
+
+        row = {column: meta.get(column) for column in COLUMNS}
+        row['id'] = self.path_tools.generate_id(meta['path'])
+        return row
+
+    def _read(self, path: str) -> Tuple[List[dict], List[str]]:
+        """
+        :return: The rows for the directory and the symlinks to directories in
+            it, and the paths of its sub-directories
+        """
+
+        rows = []
+        subdirs = []
+
+        row = self.row(path)
+        if row is None:
+            return rows, subdirs
+        rows.append(row)
+
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except (FileNotFoundError, PermissionError):
+            return rows, subdirs
+
+        for entry in entries:
+            if self.path_filter is not None and not self.path_filter.allow_path(entry.path):
+                continue
+
+            try:
+                if entry.is_symlink():
+                    if entry.is_dir():
+                        link = self.row(entry.path)
+                        if link is not None:
+                            rows.append(link)
+
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+
+            except (FileNotFoundError, PermissionError):
+                continue
+
+        return rows, subdirs
+
+    def export(self, roots: List[str]) -> dict:
+        """
+        :param roots: Directories to export
+        :return: stats
+        """
+
+        frontier = [root.rstrip('/') or '/' for root in roots]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while frontier:
+                next_frontier = []
+
+                for rows, subdirs in pool.map(self._read, frontier):
+                    for row in rows:
+                        self.writer.write(row)
+                        self.stats['links' if row['link'] else 'directories'] += 1
+
+                    self.stats['rows'] += len(rows)
+                    next_frontier.extend(subdirs)
+
+                frontier = next_frontier
+
+        return self.stats
+
+
+class SnapshotLoader:
+    """
+    Loads snapshot files into an index. Each worker streams one file at a
+    time through its own :class:`BufferedBulkSink`, so ``workers`` bulk
+    requests are made at once.
+
+    Parameters:
+        bulk: Callable which takes the NDJSON bulk body and returns the bulk response dict
+        index: Index to load into
+        workers: Number of files loaded in parallel
+        max_actions: Number of actions in a bulk request
+        max_retries: Number of times a failed action is retried
+    """
+
+    def __init__(
+        self,
+        bulk: Callable[[str], dict],
+        index: str = 'ceda-dirs',
+        workers: int = 4,
+        max_actions: int = 1000,
+        max_retries: int = 5
+    ):
+        self.bulk = bulk
+        self.index = index
+        self.workers = workers
+        self.max_actions = max_actions
+        self.max_retries = max_retries
+
+    @staticmethod
+    def source(row: dict) -> dict:
+        # Directories without a MOLES record have no title, url or record_type
+        return {key: value for key, value in row.items() if key != 'id' and value is not None}
+
+    def load_file(self, path: str) -> dict:
+        """
+        :param path: Snapshot file
+        :return: Sink stats for the file
+        """
+
+        from rabbit_indexer.index_updaters.base import BufferedBulkSink
+
+        sink = BufferedBulkSink(
+            bulk=self.bulk,
+            max_actions=self.max_actions,
+            max_bytes=50 * 2**20,
+            max_age=3600,
+            max_retries=self.max_retries
+        )
+
+        try:
+            for batch in read_snapshot_file(path):
+                for row in batch:
+                    sink.add({'index': {'_index': self.index, '_id': row['id']}}, self.source(row))
+        finally:
+            sink.close()
+
+        logger.info('Loaded %s from %s, %s failed', sink.stats['actions'], path, sink.stats['failures'])
+        return sink.stats
+
+    def load(self, directory: str) -> dict:
+        """
+        :param directory: Snapshot directory
+        :return: Total actions, failures and retries
+        """
+
+        totals = {'files': 0, 'actions': 0, 'failures': 0, 'retries': 0}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for stats in pool.map(self.load_file, snapshot_files(directory)):
+                totals['files'] += 1
+                for key in ('actions', 'failures', 'retries'):
+                    totals[key] += stats[key]
+
+        return totals
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Export the directory metadata to columnar files and bulk load them into the index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Walk the archive and write a snapshot')
+    export_parser.add_argument('paths', nargs='+', help='Directories to export')
+    export_parser.add_argument('--output', required=True, help='Directory to write the snapshot to')
+    export_parser.add_argument('--config', nargs='+', required=True, help='Config files. Used for the MOLES mapping and the path filter')
+    export_parser.add_argument('--format', default='auto', choices=['auto', 'parquet', 'ndjson'], help='File format. auto uses parquet if pyarrow is installed')
+    export_parser.add_argument('--rows-per-file', type=int, default=1000000, help='Number of rows in a file')
+    export_parser.add_argument('--workers', type=int, default=8, help='Directories read in parallel')
+
+    load_parser = subparsers.add_parser('load', help='Bulk load a snapshot into the index')
+    load_parser.add_argument('snapshot', help='Snapshot directory')
+    load_parser.add_argument('--config', nargs='+', required=True, help='Config files. Used for the elasticsearch API key')
+    load_parser.add_argument('--index', default='ceda-dirs', help='Index to load into')
+    load_parser.add_argument('--workers', type=int, default=4, help='Files loaded in parallel')
+    load_parser.add_argument('--chunk-size', type=int, default=1000, help='Number of actions in a bulk request')
+
+    args = parser.parse_args(args)
+
+    logging.basicConfig(format='%(asctime)s @%(name)s [%(levelname)s]:    %(message)s', level=logging.INFO)
+
+    from .yaml_config import YamlConfig
+
+    conf = YamlConfig()
+    conf.read(args.config)
+
+    if args.command == 'export':
+        from .path_tools import PathFilter, PathTools
+
+        # Only the MOLES mapping is waited for
+        path_tools = PathTools.from_config(conf, deferred=True)
+        path_tools.start_loading()
+        path_tools.wait_ready()
+        writer = get_writer(args.output, args.format, rows_per_file=args.rows_per_file)
+        exporter = SnapshotExporter(
+            path_tools,
+            writer,
+            workers=args.workers,
+            path_filter=PathFilter(**conf.get('indexer', 'path_filter', default={}))
+        )
+
+        try:
+            stats = exporter.export(args.paths)
+        finally:
+            path_tools.api_batcher.close()
+
+        writer.close()
+        logger.info('Exported %s', stats)
+
+    else:
+        from ceda_elasticsearch_tools.elasticsearch import CEDAElasticsearchClient
+
+        api_key = conf.get('elasticsearch', 'es_api_key')
+        client = CEDAElasticsearchClient(headers={'x-api-key': api_key})
+
+        loader = SnapshotLoader(
+            bulk=lambda body: client.bulk(body=body),
+            index=args.index,
+            workers=args.workers,
+            max_actions=args.chunk_size
+        )
+        stats = loader.load(args.snapshot)
+        logger.info('Loaded %s', stats)
+
+        if stats['failures']:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
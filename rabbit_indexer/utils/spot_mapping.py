@@ -0,0 +1,216 @@
+# encoding: utf-8
+"""
+Spot mapping with a longest-prefix index, an on-disk cache and conditional
+refresh.
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import json
+import logging
+import os
+
+# Typing imports
+from typing import Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SPOT_MAPPING_URL = 'http://cedaarchiveapp.ceda.ac.uk/cedaarchiveapp/fileset/download_conf/'
+
+
+class _SpotIndex:
+    """
+    Immutable snapshot of the spot mapping. A new snapshot is built for each
+    change and swapped in with a single assignment, so readers never see a
+    partially built index.
+    """
+
+    __slots__ = ('spot_mapping', 'path2spotmapping')
+
+    def __init__(self, text: str):
+        self.spot_mapping = {}
+        self.path2spotmapping = {}
+
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+
+            spot, path = parts
+            path = path.rstrip('/') or '/'
+            self.spot_mapping[spot] = path
+            self.path2spotmapping[path] = spot
+
+    def lookup(self, path: str) -> Optional[str]:
+        """
+        Find the spot with the longest path which is a prefix of path
+
+        :param path: File or directory path
+        :return: spot name or None
+        """
+        path2spot = self.path2spotmapping
+        key = path.rstrip('/') or '/'
+
+        while key:
+            spot = path2spot.get(key)
+            if spot is not None:
+                return spot
+
+            index = key.rfind('/')
+            if index <= 0:
+                return path2spot.get('/')
+            key = key[:index]
+
+        return None
+
+
+class SpotMapping:
+    """
+    Mapping between spot names and archive paths.
+
+    Provides the lookup methods of ``ceda_elasticsearch_tools.core.log_reader.SpotMapping``.
+    The downloaded mapping is cached on disk along with its ``ETag`` and
+    ``Last-Modified`` headers. :meth:`refresh` revalidates the cache with a
+    conditional request and only rebuilds the index when it has changed.
+
+    Parameters:
+        url: URL to download the spot mapping from
+        cache_file: Optional file to cache the mapping in
+        timeout: Request timeout in seconds
+    """
+
+    def __init__(self, url: str = SPOT_MAPPING_URL, cache_file: Optional[str] = None, timeout: float = 30):
+        self.url = url
+        self.cache_file = cache_file
+        self.timeout = timeout
+
+        self._index = _SpotIndex('')
+        self._validators = {}
+
+        if not self._load_cache():
+            self.refresh()
+
+    @property
+    def spot_mapping(self) -> Dict[str, str]:
+        return self._index.spot_mapping
+
+    @property
+    def path2spotmapping(self) -> Dict[str, str]:
+        return self._index.path2spotmapping
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index.spot_mapping)
+
+    def __len__(self) -> int:
+        return len(self._index.spot_mapping)
+
+    def get_archive_root(self, key: str) -> Optional[str]:
+        """
+        :param key: Spot name
+        :return: Archive path for the spot
+        """
+        return self._index.spot_mapping.get(key)
+
+    def get_spot(self, path: str) -> Optional[str]:
+        """
+        :param path: File or directory path
+        :return: The spot the path belongs to
+        """
+        return self._index.lookup(path)
+
+    def spots_for(self, paths: Iterable[str]) -> List[Optional[str]]:
+        """
+        Look up the spots for many paths. Paths in the same directory are
+        only resolved once.
+
+        :param paths: File or directory paths
+        :return: List of spot names in the same order as paths
+        """
+        index = self._index
+        resolved = {}
+        spots = []
+
+        for path in paths:
+            directory = os.path.dirname(path.rstrip('/'))
+            if directory not in resolved:
+                resolved[directory] = index.lookup(directory)
+
+            # The path itself may be the root of a spot
+            spot = index.path2spotmapping.get(path.rstrip('/'))
+            spots.append(spot if spot is not None else resolved[directory])
+
+        return spots
+
+    def refresh(self) -> bool:
+        """
+        Revalidate the mapping with the server and swap in the new index
+        if it has changed.
+
+        :return: True if the mapping was changed
+        """
+        import requests
+
+        headers = {}
+        if self._validators.get('etag'):
+            headers['If-None-Match'] = self._validators['etag']
+        if self._validators.get('last_modified'):
+            headers['If-Modified-Since'] = self._validators['last_modified']
+
+        response = requests.get(self.url, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 304:
+            logger.debug('Spot mapping not modified')
+            return False
+
+        response.raise_for_status()
+
+        index = _SpotIndex(response.text)
+        if not index.spot_mapping:
+            raise ValueError(f'No spots found in the response from {self.url}')
+
+        self._index = index
+        self._validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+
+        logger.info('Loaded %s spots', len(index.spot_mapping))
+        self._save_cache(response.text)
+        return True
+
+    def _load_cache(self) -> bool:
+        """
+        :return: True if the mapping was loaded from the cache file
+        """
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return False
+
+        try:
+            with open(self.cache_file) as reader:
+                cache = json.load(reader)
+        except (OSError, ValueError):
+            logger.warning('Unable to read spot mapping cache %s', self.cache_file)
+            return False
+
+        index = _SpotIndex(cache.get('text', ''))
+        if not index.spot_mapping:
+            return False
+
+        self._index = index
+        self._validators = cache.get('validators', {})
+        return True
+
+    def _save_cache(self, text: str) -> None:
+        if not self.cache_file:
+            return
+
+        tmp_file = f'{self.cache_file}.tmp'
+        try:
+            with open(tmp_file, 'w') as writer:
+                json.dump({'validators': self._validators, 'text': text}, writer)
+            os.replace(tmp_file, self.cache_file)
+        except OSError:
+            logger.warning('Unable to write spot mapping cache %s', self.cache_file, exc_info=True)
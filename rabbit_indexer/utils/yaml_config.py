@@ -19,6 +19,7 @@ class YamlConfig:
 
     def __init__(self):
         self.config = {}
+        self.files = []
 
     def read(self, filenames, encoding=None):
         """
@@ -39,8 +40,11 @@ class YamlConfig:
         """
         if isinstance(filenames, (str, bytes, os.PathLike)):
             filenames = [filenames]
+        filenames = list(filenames)
         read_ok = []
 
+        self.files.extend(filenames)
+
         for filename in filenames:
             try:
                 with open(filename, encoding=encoding) as reader:
@@ -58,6 +62,20 @@ class YamlConfig:
 
         return read_ok
 
+    def reload(self) -> 'YamlConfig':
+        """
+        Read the same files again into a new config object
+
+        :return: YamlConfig
+        """
+        conf = YamlConfig()
+        conf.read(self.files)
+
+        if not conf.config:
+            raise ValueError(f'No config could be read from {self.files}')
+
+        return conf
+
     def get(self, *args, default=None):
         """
         Takes an iterable of keys and returns default if not found or the value
@@ -43,11 +43,12 @@ setup(
         'pyyaml'
     ],
     extras_require={
+        'parquet': ['pyarrow'],
     },
 
     # This qualifier can be used to selectively exclude Python versions -
     # in this case early Python 2 and 3 releases
-    python_requires='>=3.6.0',
+    python_requires='>=3.7.0',
 
     # See:
     # https://www.python.org/dev/peps/pep-0301/#distutils-trove-classification
@@ -78,7 +79,10 @@ setup(
     zip_safe=False,
     entry_points={
         'console_scripts': [
-            'rabbit_event_indexer = rabbit_indexer.utils.consumer_setup:consumer_setup'
+            'rabbit_event_indexer = rabbit_indexer.utils.consumer_setup:consumer_setup',
+            'rabbit_indexer_reconcile = rabbit_indexer.utils.reconciler:main',
+            'rabbit_indexer_sidecar = rabbit_indexer.utils.sidecar:main',
+            'rabbit_indexer_snapshot = rabbit_indexer.utils.snapshot:main'
         ],
     }
 )
\ No newline at end of file
@@ -0,0 +1,255 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import json
+import gzip
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from rabbit_indexer.index_updaters.base import BufferedBulkSink, Delivery, UpdateHandler
+from rabbit_indexer.index_updaters.sinks import JsonlSink, NullSink, get_sink
+from rabbit_indexer.queue_handler import QueueHandler
+from rabbit_indexer.utils import YamlConfig
+
+
+class TooManyRequests(Exception):
+    status_code = 429
+
+
+class SinkHandler(UpdateHandler):
+
+    def setup_extra(self, **kwargs):
+        self.setup_sink()
+        self.setup_burst()
+
+    def process_event(self, message):
+        pass
+
+
+class SinkQueueHandler(QueueHandler):
+    HANDLER_CLASS = SinkHandler
+
+
+class FakeChannel:
+
+    def __init__(self):
+        self.prefetch_count = None
+
+    def basic_qos(self, prefetch_count):
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, auto_ack, exclusive):
+        return 'ctag'
+
+
+class FakeBulk:
+    """
+    Records the bulk requests and returns the queued responses.
+    Responses can be a dict, an exception or a list of statuses or item results.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, body):
+        lines = body.splitlines()
+        self.requests.append(lines)
+
+        response = self.responses.pop(0) if self.responses else None
+        if isinstance(response, Exception):
+            raise response
+
+        actions = [json.loads(line) for line in lines if 'update' in line or 'delete' in line]
+        statuses = response or [200] * len(actions)
+        return {'items': [
+            {list(action)[0]: status if isinstance(status, dict) else {'status': status}}
+            for action, status in zip(actions, statuses)
+        ]}
+
+
+def action(i):
+    return {'update': {'_index': 'ceda-dirs', '_id': str(i)}}
+
+
+@patch('rabbit_indexer.index_updaters.base.time.sleep')
+class BufferedBulkSinkTestCase(unittest.TestCase):
+
+    def make_sink(self, bulk, **kwargs):
+        sink = BufferedBulkSink(bulk, max_age=60, **kwargs)
+        self.addCleanup(sink.close)
+        return sink
+
+    def test_flush_on_count(self, mock_sleep):
+        bulk = FakeBulk()
+        sink = self.make_sink(bulk, max_actions=2)
+
+        sink.add(action(1), {'doc': {}})
+        self.assertEqual(bulk.requests, [])
+
+        sink.add(action(2), {'doc': {}})
+        self.assertEqual(len(bulk.requests), 1)
+        self.assertEqual(len(bulk.requests[0]), 4)
+
+    def test_ack_after_flush(self, mock_sleep):
+        acks = []
+        sink = self.make_sink(FakeBulk(), max_actions=10)
+
+        delivery = Delivery(lambda: acks.append('ack'))
+        sink.add(action(1), {'doc': {}}, delivery=delivery)
+        sink.add(action(2), {'doc': {}}, delivery=delivery)
+        delivery.close()
+
+        self.assertEqual(acks, [])
+        sink.flush()
+        self.assertEqual(acks, ['ack'])
+
+    def test_retry_failed_items(self, mock_sleep):
+        bulk = FakeBulk([200, 429, 200], [200])
+        sink = self.make_sink(bulk)
+
+        for i in range(3):
+            sink.add(action(i), {'doc': {}})
+        sink.flush()
+
+        # Only the failed item is sent again
+        self.assertEqual(len(bulk.requests), 2)
+        self.assertEqual(json.loads(bulk.requests[1][0]), action(1))
+        self.assertEqual(sink.stats['actions'], 3)
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_backoff_on_429(self, mock_sleep):
+        bulk = FakeBulk(TooManyRequests(), TooManyRequests(), None)
+        sink = self.make_sink(bulk)
+
+        sink.add(action(1), {'doc': {}})
+        sink.flush()
+
+        self.assertEqual(len(bulk.requests), 3)
+        self.assertEqual([call[0][0] for call in mock_sleep.call_args_list], [1, 2])
+
+    def test_permanent_failure(self, mock_sleep):
+        nacks = []
+        bulk = FakeBulk([400])
+        sink = self.make_sink(bulk)
+
+        delivery = Delivery(lambda: None, nack=lambda: nacks.append('nack'))
+        sink.add(action(1), {'doc': {}}, delivery=delivery)
+        delivery.close()
+        sink.flush()
+
+        self.assertEqual(nacks, ['nack'])
+        self.assertEqual(sink.stats['failures'], 1)
+
+    def test_document_missing(self, mock_sleep):
+        nacks = []
+        missing = {'status': 404, 'error': {'type': 'document_missing_exception'}}
+        bulk = FakeBulk([missing])
+        sink = self.make_sink(bulk)
+
+        # Updates to documents which have been removed are dropped, not retried
+        delivery = Delivery(lambda: None, nack=lambda: nacks.append('nack'))
+        sink.add(action(1), {'script': {}}, delivery=delivery)
+        delivery.close()
+        sink.flush()
+
+        self.assertEqual(nacks, [])
+        self.assertEqual(len(bulk.requests), 1)
+        self.assertEqual(sink.stats['failures'], 0)
+
+
+class JsonlSinkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_rotating_files(self):
+        acks = []
+        sink = JsonlSink(self.tmpdir.name, max_file_actions=2, max_age=60)
+
+        delivery = Delivery(lambda: acks.append('ack'))
+        for i in range(3):
+            sink.add(action(i), {'doc': {'i': i}}, delivery=delivery)
+        delivery.close()
+
+        sink.flush()
+        self.assertEqual(acks, ['ack'])
+        sink.close()
+
+        self.assertEqual(len(sink.files), 2)
+
+        lines = []
+        for filename in sink.files:
+            with gzip.open(filename, 'rt') as reader:
+                lines.extend(json.loads(line) for line in reader)
+
+        self.assertEqual(lines[0], action(0))
+        self.assertEqual(lines[5], {'doc': {'i': 2}})
+
+
+class GetSinkTestCase(unittest.TestCase):
+
+    def test_null_sink(self):
+        conf = YamlConfig()
+        conf.config = {'indexer': {'sink': {'type': 'null'}}}
+
+        sink = get_sink(conf)
+        self.addCleanup(sink.close)
+
+        self.assertIsInstance(sink, NullSink)
+        sink.add(action(1), {'doc': {}})
+        self.assertEqual(sink.stats['actions'], 1)
+
+    def test_no_sink(self):
+        conf = YamlConfig()
+        conf.config = {'indexer': {}}
+
+        self.assertIsNone(get_sink(conf))
+
+    def test_unknown_sink(self):
+        conf = YamlConfig()
+        conf.config = {'indexer': {'sink': {'type': 'kafka'}}}
+
+        with self.assertRaises(ValueError):
+            get_sink(conf)
+
+
+class DefaultPrefetchTestCase(unittest.TestCase):
+
+    def prefetch(self, indexer, queue=None):
+        conf = YamlConfig()
+        conf.config = {'rabbit_server': {'queues': [{'name': 'deposits', **(queue or {})}]}, 'indexer': indexer}
+        queue_handler = SinkQueueHandler(conf)
+        self.addCleanup(queue_handler.queue_handler.close)
+
+        channel = FakeChannel()
+        queue_handler._start_consuming(SimpleNamespace(channel=lambda: channel))
+        return channel.prefetch_count
+
+    def test_default(self):
+        self.assertEqual(self.prefetch({}), 1)
+
+    def test_sink(self):
+        # Enough messages are delivered to fill a batch
+        self.assertEqual(self.prefetch({'sink': {'type': 'null', 'max_actions': 200}}), 200)
+
+        # The queue setting wins
+        self.assertEqual(self.prefetch({'sink': {'type': 'null', 'max_actions': 200}}, {'prefetch': 10}), 10)
+
+    def test_burst(self):
+        indexer = {'sink': {'type': 'null', 'max_actions': 200}, 'burst': {'threshold': 300}}
+        self.assertEqual(self.prefetch(indexer), 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+from rabbit_indexer.index_updaters.base import Delivery, UpdateHandler
+from rabbit_indexer.index_updaters.burst import BurstDetector
+from rabbit_indexer.index_updaters.sinks import Sink
+from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+from rabbit_indexer.utils import YamlConfig
+
+
+class ListSink(Sink):
+
+    def __init__(self):
+        super().__init__(max_age=60)
+        self.items = []
+
+    def _send(self, items):
+        self.items.extend(item for item, _ in items)
+        self._release(items)
+
+
+class ListHandler(UpdateHandler):
+
+    def setup_extra(self, **kwargs):
+        self.sink = ListSink()
+        self.setup_burst()
+
+    def process_event(self, message):
+        self.index({'update': {'_index': 'ceda-fbi', '_id': message.filepath}}, {'doc': {'size': message.filesize}})
+
+
+def deposit(path):
+    return IngestMessage('2021-02-08 12:00:00', path, 'DEPOSIT', '0', '')
+
+
+@patch('rabbit_indexer.index_updaters.burst.time.monotonic')
+class BurstDetectorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.reconciled = []
+        self.detector = BurstDetector(
+            lambda directory, deliveries, names: self.reconciled.append((directory, deliveries, names)),
+            threshold=3, window=10, settle=5, max_delay=30
+        )
+        self.addCleanup(self.detector.close)
+
+    def absorb(self, clock, now, directory='/badc/data'):
+        clock.return_value = now
+        return self.detector.absorb(f'{directory}/{now}.nc', Delivery(lambda: None))
+
+    def test_threshold(self, clock):
+        self.assertFalse(self.absorb(clock, 0))
+        self.assertFalse(self.absorb(clock, 1))
+        self.assertFalse(self.absorb(clock, 2, '/badc/other'))
+        self.assertTrue(self.absorb(clock, 2))
+        self.assertTrue(self.absorb(clock, 3))
+
+        clock.return_value = 4
+        self.detector.flush()
+        self.assertEqual(self.reconciled, [])
+
+        clock.return_value = 8
+        self.detector.flush()
+        self.assertEqual(len(self.reconciled), 1)
+        self.assertEqual(len(self.reconciled[0][1]), 2)
+        self.assertEqual(self.reconciled[0][2], {'2.nc', '3.nc'})
+
+        # The burst has ended
+        self.assertFalse(self.absorb(clock, 9))
+
+    def test_window(self, clock):
+        self.assertFalse(self.absorb(clock, 0))
+        self.assertFalse(self.absorb(clock, 6))
+        self.assertFalse(self.absorb(clock, 12))
+        self.assertTrue(self.absorb(clock, 13))
+
+    def test_max_delay(self, clock):
+        for now in range(40):
+            self.absorb(clock, now)
+            self.detector.flush()
+
+        self.assertEqual(len(self.reconciled), 1)
+
+        # Still absorbing after the first reconcile
+        self.assertTrue(self.absorb(clock, 40))
+
+
+class ReconcileTestCase(unittest.TestCase):
+
+    def test_reconcile_directory(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        # 3.nc has gone again before the rescan
+        for name in ('a.nc', 'b.nc', '0.nc', '1.nc', '2.nc'):
+            with open(os.path.join(tmp_dir.name, name), 'w') as writer:
+                writer.write(name)
+        os.mkdir(os.path.join(tmp_dir.name, 'subdir'))
+
+        conf = YamlConfig()
+        conf.config = {'indexer': {'burst': {'threshold': 2, 'settle': 60}}}
+        handler = ListHandler(conf)
+
+        acked = []
+        for i in range(4):
+            with handler.delivery(lambda i=i: acked.append(i)):
+                message = deposit(os.path.join(tmp_dir.name, f'{i}.nc'))
+                if not handler.absorb(message):
+                    handler.process_event(message)
+
+        # The first deposit is processed, the rest are held
+        handler.sink.flush()
+        self.assertEqual(acked, [0])
+
+        handler.close()
+
+        self.assertEqual(sorted(acked), [0, 1, 2, 3])
+
+        # Only the absorbed files which are still there are indexed again
+        ids = sorted(
+            os.path.basename(json.loads(item.splitlines()[0])['update']['_id'])
+            for item in handler.sink.items if '"update"' in item
+        )
+        self.assertEqual(ids, ['0.nc', '1.nc', '2.nc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
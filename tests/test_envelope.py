@@ -0,0 +1,150 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import gzip
+import json
+from types import SimpleNamespace
+
+from rabbit_indexer.index_updaters.base import UpdateHandler
+from rabbit_indexer.queue_handler import QueueHandler
+from rabbit_indexer.queue_handler.envelope import EnvelopePublisher, encode_envelope
+from rabbit_indexer.queue_handler.idempotency import IdempotencyCache
+from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+from rabbit_indexer.utils import YamlConfig
+
+JSON_RECORD = {
+    'datetime': '2021-02-08 12:00:00',
+    'filepath': '/badc/cmip5/data/a.nc',
+    'action': 'DEPOSIT',
+    'filesize': '10',
+    'message': ''
+}
+TEXT_RECORD = '2021-02-08 12:00:01:/badc/cmip5/data/b.nc:DEPOSIT:20:'
+
+
+class FakeChannel:
+
+    channel_number = 1
+    is_open = True
+
+    def __init__(self):
+        self.acked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((exchange, routing_key, body, properties))
+
+
+class FakeConnection:
+
+    is_open = True
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+
+class RecordingHandler(UpdateHandler):
+
+    def setup_extra(self, **kwargs):
+        self.events = []
+
+    def process_event(self, message):
+        if message.filepath.endswith('bad.nc'):
+            raise ValueError(message.filepath)
+        self.events.append(message.filepath)
+
+
+class RecordingQueueHandler(QueueHandler):
+    HANDLER_CLASS = RecordingHandler
+
+
+class DecodeMessagesTestCase(unittest.TestCase):
+
+    def test_single(self):
+        messages = QueueHandler.decode_messages(json.dumps(JSON_RECORD).encode())
+        self.assertEqual(messages, [IngestMessage(**JSON_RECORD)])
+
+        messages = QueueHandler.decode_messages(TEXT_RECORD.encode())
+        self.assertEqual(messages[0].filepath, '/badc/cmip5/data/b.nc')
+
+    def test_json_array(self):
+        body = json.dumps([JSON_RECORD, TEXT_RECORD]).encode()
+        messages = QueueHandler.decode_messages(body)
+
+        self.assertEqual([m.filepath for m in messages], ['/badc/cmip5/data/a.nc', '/badc/cmip5/data/b.nc'])
+
+    def test_ndjson_gzip(self):
+        body = gzip.compress(f'{json.dumps(JSON_RECORD)}\n{TEXT_RECORD}\n\n'.encode())
+        messages = QueueHandler.decode_messages(body)
+
+        self.assertEqual([m.filesize for m in messages], ['10', '20'])
+
+    def test_encode_envelope(self):
+        messages = [IngestMessage(**JSON_RECORD), QueueHandler.decode_message(TEXT_RECORD)]
+
+        for compress in (True, False):
+            self.assertEqual(QueueHandler.decode_messages(encode_envelope(messages, compress)), messages)
+
+    def test_envelope_key(self):
+        messages = [IngestMessage(**JSON_RECORD), QueueHandler.decode_message(TEXT_RECORD)]
+
+        self.assertEqual(IdempotencyCache.envelope_key(messages), IdempotencyCache.envelope_key(list(messages)))
+        self.assertNotEqual(IdempotencyCache.envelope_key(messages), IdempotencyCache.envelope_key(messages[:1]))
+
+
+class EnvelopeCallbackTestCase(unittest.TestCase):
+
+    def setUp(self):
+        conf = YamlConfig()
+        conf.config = {'rabbit_server': {'queues': []}, 'indexer': {}}
+        self.queue_handler = RecordingQueueHandler(conf)
+        self.channel = FakeChannel()
+
+    def callback(self, body, tag=1):
+        method = SimpleNamespace(delivery_tag=tag, redelivered=False)
+        self.queue_handler.callback(self.channel, method, None, body, connection=FakeConnection())
+
+    def test_envelope_acked_once(self):
+        records = [dict(JSON_RECORD, filepath=f'/badc/{i}.nc') for i in range(3)]
+        records.insert(1, dict(JSON_RECORD, filepath='/badc/bad.nc'))
+
+        with self.assertLogs(level='ERROR'):
+            self.callback(encode_envelope([IngestMessage(**record) for record in records]))
+
+        # The bad record does not stop the rest of the envelope
+        self.assertEqual(self.queue_handler.queue_handler.events, ['/badc/0.nc', '/badc/1.nc', '/badc/2.nc'])
+        self.assertEqual(self.channel.acked, [1])
+
+
+class EnvelopePublisherTestCase(unittest.TestCase):
+
+    def test_batching(self):
+        channel = FakeChannel()
+        publisher = EnvelopePublisher(channel, 'deposits', max_records=2, max_age=60)
+
+        for i in range(5):
+            publisher.publish(IngestMessage(**dict(JSON_RECORD, filepath=f'/badc/{i}.nc')))
+
+        self.assertEqual(len(channel.published), 2)
+        publisher.close()
+        self.assertEqual(len(channel.published), 3)
+
+        _, _, body, properties = channel.published[0]
+        self.assertEqual(properties.content_encoding, 'gzip')
+        self.assertEqual(len(QueueHandler.decode_messages(body)), 2)
+        self.assertEqual(publisher.stats, {'envelopes': 3, 'records': 5})
+
+
+if __name__ == '__main__':
+    unittest.main()
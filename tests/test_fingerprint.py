@@ -0,0 +1,99 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import hashlib
+import os
+import tempfile
+import threading
+from unittest.mock import patch
+
+from rabbit_indexer.utils import PathTools
+from rabbit_indexer.utils.fingerprint import Fingerprinter, hash_file
+
+MAPPING_FILE = os.path.join(os.path.dirname(__file__), 'moles_mapping_file.json')
+
+
+class FingerprintTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+
+        self.content = os.urandom(3 * 1024 + 17)
+        self.path = self.write('data.nc', self.content)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as writer:
+            writer.write(content)
+        return path
+
+    def test_hash_file(self):
+        expected = hashlib.sha256(self.content).hexdigest()
+
+        for use_mmap in (True, False):
+            self.assertEqual(hash_file(self.path, block_size=1024, use_mmap=use_mmap), expected)
+
+        empty = self.write('empty.nc', b'')
+        self.assertEqual(hash_file(empty), hashlib.sha256().hexdigest())
+        self.assertEqual(hash_file(self.path, algorithm='md5'), hashlib.md5(self.content).hexdigest())
+
+    def test_fingerprinter(self):
+        fingerprinter = Fingerprinter(max_size=4096, io_concurrency=2)
+        self.addCleanup(fingerprinter.close)
+
+        large = self.write('large.nc', b'0' * 4097)
+        fingerprinter.prefetch([self.path, large])
+
+        result = fingerprinter.fingerprint(self.path)
+        self.assertEqual(result['digest'], hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(result['size'], len(self.content))
+
+        # Over the size cap, missing files and directories are not hashed
+        self.assertIsNone(fingerprinter.fingerprint(large))
+        self.assertIsNone(fingerprinter.fingerprint(os.path.join(self.directory, 'missing.nc')))
+        self.assertIsNone(fingerprinter.fingerprint(self.directory))
+
+        self.assertEqual(fingerprinter.stats['hashed'], 1)
+        self.assertEqual(fingerprinter.stats['skipped'], 1)
+
+    def test_timeout(self):
+        fingerprinter = Fingerprinter(timeout=0.05)
+        self.addCleanup(fingerprinter.close)
+
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        # A slow file is left without a checksum rather than blocking the caller
+        with patch('rabbit_indexer.utils.fingerprint.hash_file', side_effect=lambda *args: release.wait(5)):
+            self.assertIsNone(fingerprinter.fingerprint(self.path))
+
+        self.assertEqual(fingerprinter.stats['timeouts'], 1)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            Fingerprinter(algorithm='unknown')
+
+    def test_path_metadata(self):
+        path_tools = PathTools(mapping_file=MAPPING_FILE, deferred=True, fingerprint={'algorithm': 'sha1'})
+        self.addCleanup(path_tools.fingerprinter.close)
+
+        meta, _ = path_tools.generate_path_metadata(self.path)
+        self.assertEqual(meta['checksum']['digest'], hashlib.sha1(self.content).hexdigest())
+        self.assertEqual(meta['checksum']['algorithm'], 'sha1')
+
+        meta, _ = path_tools.generate_path_metadata(self.path, fingerprint=False)
+        self.assertNotIn('checksum', meta)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import os
+from unittest.mock import patch
+
+from rabbit_indexer.index_updaters.base import UpdateHandler
+from rabbit_indexer.index_updaters.group import HandlerGroup
+from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+from rabbit_indexer.utils import YamlConfig
+from rabbit_indexer.utils.path_tools import PathTools
+
+MAPPING_FILE = os.path.join(os.path.dirname(__file__), 'moles_mapping_file.json')
+
+
+class StatHandler(UpdateHandler):
+
+    def setup_extra(self, **kwargs):
+        super().setup_extra(**kwargs)
+        self.processed = []
+
+    def process_event(self, message):
+        self.processed.append(self.pt.stat(message.filepath))
+
+
+class FlakyHandler(StatHandler):
+    failures = 1
+
+    def process_event(self, message):
+        if self.failures:
+            self.failures -= 1
+            raise ValueError('flaky')
+        super().process_event(message)
+
+
+class BrokenHandler(StatHandler):
+
+    def process_event(self, message):
+        raise ValueError('broken')
+
+
+@patch('rabbit_indexer.index_updaters.group.time.sleep')
+@patch.object(UpdateHandler, '_create_path_tools', lambda self: PathTools(mapping_file=MAPPING_FILE, deferred=True))
+class HandlerGroupTestCase(unittest.TestCase):
+
+    def make_group(self, *handler_classes):
+        conf = YamlConfig()
+        conf.config = {'indexer': {}}
+        group = HandlerGroup(conf, list(handler_classes), retries=2)
+        self.addCleanup(group.close)
+        return group
+
+    def process(self, group):
+        results = []
+        message = IngestMessage('2021-02-08 12:00:00', __file__, 'DEPOSIT', '0', '')
+        with group.delivery(lambda: results.append('ack'), lambda: results.append('nack')):
+            group.process_event(message)
+        return results
+
+    def test_shared_path_tools(self, mock_sleep):
+        group = self.make_group(StatHandler, StatHandler)
+
+        self.assertEqual(self.process(group), ['ack'])
+        first, second = group.handlers
+
+        self.assertIs(first.pt, group.pt)
+        self.assertIs(second.pt, group.pt)
+
+        # The stat is shared between the handlers for the message
+        self.assertIs(first.processed[0], second.processed[0])
+
+    def test_retry(self, mock_sleep):
+        group = self.make_group(StatHandler, FlakyHandler)
+
+        self.assertEqual(self.process(group), ['ack'])
+        self.assertEqual(len(group.handlers[0].processed), 1)
+        self.assertEqual(len(group.handlers[1].processed), 1)
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_failure_isolated(self, mock_sleep):
+        group = self.make_group(BrokenHandler, StatHandler)
+
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(self.process(group), ['nack'])
+
+        # The other handler still runs
+        self.assertEqual(len(group.handlers[1].processed), 1)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import tempfile
+import threading
+import time
+import os
+from types import SimpleNamespace
+
+from rabbit_indexer.index_updaters.base import UpdateHandler
+from rabbit_indexer.queue_handler import QueueHandler
+from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+from rabbit_indexer.queue_handler.idempotency import IdempotencyCache
+from rabbit_indexer.utils import YamlConfig
+
+
+def make_message(path, action='DEPOSIT', datetime='2021-02-09 11:17:12'):
+    return IngestMessage(datetime=datetime, filepath=path, action=action, filesize='10', message='')
+
+
+def make_body(path):
+    return f'2021-02-09 11:17:12:{path}:DEPOSIT:10:'.encode()
+
+
+class BlockingHandler(UpdateHandler):
+
+    def setup_extra(self, **kwargs):
+        self.release = threading.Event()
+        self.events = []
+
+    def process_event(self, message):
+        self.release.wait(5)
+        self.events.append(message.filepath)
+
+
+class BlockingQueueHandler(QueueHandler):
+    HANDLER_CLASS = BlockingHandler
+
+
+class IdempotencyCacheTestCase(unittest.TestCase):
+
+    def test_key(self):
+        key = IdempotencyCache.key(make_message('/badc/cmip5/data'))
+        self.assertEqual(key, '0ca121763e49eb46bfc209c455cb85773ecfcfa7:DEPOSIT:2021-02-09 11:17:12')
+
+        # Same path with a different action is a different event
+        self.assertNotEqual(key, IdempotencyCache.key(make_message('/badc/cmip5/data', action='REMOVE')))
+
+    def test_seen(self):
+        cache = IdempotencyCache(size=10)
+        key = cache.key(make_message('/badc/cmip5/data'))
+
+        self.assertFalse(cache.seen(key))
+        cache.add(key)
+        self.assertTrue(cache.seen(key))
+        self.assertEqual(cache.skipped, 1)
+
+    def test_bounded(self):
+        cache = IdempotencyCache(size=2)
+
+        for i in range(3):
+            cache.add(str(i))
+
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('0', cache)
+        self.assertIn('2', cache)
+
+    def test_persisted(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'applied')
+
+            cache = IdempotencyCache(size=2, path=path)
+            for i in range(6):
+                cache.add(str(i))
+            cache.close()
+
+            cache = IdempotencyCache(size=2, path=path)
+            self.assertEqual(list(cache._keys), ['4', '5'])
+            cache.close()
+
+
+class QueueHandlerIdempotencyTestCase(unittest.TestCase):
+
+    def make_queue_handler(self, **indexer):
+        conf = YamlConfig()
+        conf.config = {'rabbit_server': {'queues': []}, 'indexer': {'idempotency': {'size': 10}, **indexer}}
+        queue_handler = BlockingQueueHandler(conf)
+        return queue_handler
+
+    @staticmethod
+    def make_connection():
+        channel = SimpleNamespace(channel_number=1, is_open=True, acked=[])
+        channel.basic_ack = channel.acked.append
+        connection = SimpleNamespace(is_open=True, add_callback_threadsafe=lambda callback: callback())
+        return channel, connection
+
+    def test_old_connection(self):
+        queue_handler = self.make_queue_handler()
+        old_channel, old_connection = self.make_connection()
+        channel, connection = self.make_connection()
+
+        queue_handler._start_consuming(old_connection)
+        queue_handler._skip_applied(old_channel, SimpleNamespace(delivery_tag=1, redelivered=False), make_body('/badc/a.nc'))
+
+        # Delivery tags start again on the new connection
+        queue_handler._start_consuming(connection)
+        queue_handler._skip_applied(channel, SimpleNamespace(delivery_tag=1, redelivered=False), make_body('/badc/b.nc'))
+
+        # A worker finishing a message from the old connection does not mark the new delivery as applied
+        queue_handler.acknowledge_message(old_channel, 1, old_connection)
+        self.assertEqual(len(queue_handler.idempotency), 0)
+        self.assertEqual(old_channel.acked, [])
+
+        queue_handler.acknowledge_message(channel, 1, connection)
+        self.assertIn(IdempotencyCache.key(make_message('/badc/b.nc')), queue_handler.idempotency)
+        self.assertEqual(channel.acked, [1])
+
+    def test_journal_applied_on_complete(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        queue_handler = self.make_queue_handler(journal={'directory': tmp_dir.name})
+        self.addCleanup(queue_handler.journal.close)
+        channel, connection = self.make_connection()
+        queue_handler._start_consuming(connection)
+
+        key = IdempotencyCache.key(make_message('/badc/a.nc'))
+        method = SimpleNamespace(delivery_tag=1, redelivered=False)
+        queue_handler._on_message(channel, method, None, make_body('/badc/a.nc'), queue='deposits', connection=connection)
+
+        # Acknowledged once synced, but not applied until it has been processed
+        deadline = time.monotonic() + 5
+        while not channel.acked and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(channel.acked, [1])
+        self.assertNotIn(key, queue_handler.idempotency)
+
+        queue_handler.queue_handler.release.set()
+        deadline = time.monotonic() + 5
+        while queue_handler.journal.committed < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIn(key, queue_handler.idempotency)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import json
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from rabbit_indexer.index_updaters.base import UpdateHandler
+from rabbit_indexer.queue_handler import QueueHandler
+from rabbit_indexer.queue_handler.journal import Journal
+from rabbit_indexer.utils import YamlConfig
+
+
+class RecordingHandler(UpdateHandler):
+
+    def setup_extra(self, **kwargs):
+        self.events = []
+
+    def process_event(self, message):
+        self.events.append(message.filepath)
+
+
+class JournalQueueHandler(QueueHandler):
+    HANDLER_CLASS = RecordingHandler
+
+
+class FakeChannel:
+
+    def __init__(self):
+        self.channel_number = 1
+        self.is_open = True
+        self.acked = []
+        self.consumers = {}
+
+    def basic_qos(self, prefetch_count):
+        pass
+
+    def basic_consume(self, queue, on_message_callback, auto_ack, exclusive):
+        tag = f'ctag{len(self.consumers)}'
+        self.consumers[tag] = on_message_callback
+        return tag
+
+    def basic_cancel(self, consumer_tag):
+        del self.consumers[consumer_tag]
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+
+    def make_journal(self, **kwargs):
+        journal = Journal(self.directory, **kwargs)
+        self.addCleanup(journal.close)
+        return journal
+
+    def read(self, journal, count):
+        records = journal.records()
+        return [next(records) for _ in range(count)]
+
+    def test_append(self):
+        journal = self.make_journal()
+        synced = threading.Event()
+
+        journal.append(b'first')
+        offset = journal.append(b'second', on_sync=synced.set)
+
+        self.assertEqual(offset, 1)
+        self.assertTrue(synced.wait(5))
+        self.assertEqual(self.read(journal, 2), [(0, b'first'), (1, b'second')])
+
+    def test_replay(self):
+        journal = self.make_journal()
+        for i in range(5):
+            journal.append(str(i).encode())
+        self.read(journal, 5)
+
+        # Records complete out of order, the committed offset only moves past contiguous records
+        journal.complete(0)
+        journal.complete(2)
+        self.assertEqual(journal.committed, 1)
+        journal.close()
+
+        journal = self.make_journal()
+        self.assertEqual(self.read(journal, 4), [(1, b'1'), (2, b'2'), (3, b'3'), (4, b'4')])
+        self.assertEqual(journal.stats['replayed'], 4)
+
+        # New records follow on from the old ones
+        self.assertEqual(journal.append(b'5'), 5)
+
+    def test_torn_write(self):
+        journal = self.make_journal()
+        journal.append(b'complete')
+        journal.close()
+
+        segment = os.path.join(self.directory, f'{0:020d}.log')
+        with open(segment, 'ab') as writer:
+            writer.write(b'\x00\x00\x00\x10partial')
+
+        with self.assertLogs('rabbit_indexer.queue_handler.journal', level='WARNING'):
+            journal = self.make_journal()
+
+        self.assertEqual(self.read(journal, 1), [(0, b'complete')])
+        self.assertEqual(journal.append(b'next'), 1)
+        journal.close()
+
+        journal = self.make_journal()
+        self.assertEqual(self.read(journal, 2), [(0, b'complete'), (1, b'next')])
+
+    def test_segments_removed(self):
+        journal = self.make_journal(segment_size=10)
+        for i in range(4):
+            journal.append(f'record {i}'.encode())
+        self.read(journal, 4)
+
+        for i in range(3):
+            journal.complete(i)
+        journal.checkpoint()
+
+        segments = sorted(name for name in os.listdir(self.directory) if name.endswith('.log'))
+        self.assertEqual(segments, [f'{3:020d}.log'])
+
+        with open(os.path.join(self.directory, 'checkpoint.json')) as reader:
+            self.assertEqual(json.load(reader), {'committed': 3})
+
+    def test_backlog(self):
+        resumed = threading.Event()
+        journal = self.make_journal(max_backlog=3, on_resume=resumed.set)
+
+        # Appends are not refused while the journal is paused
+        for i in range(4):
+            journal.append(str(i).encode())
+        self.assertTrue(journal.paused)
+
+        journal.complete(0)
+        self.assertTrue(journal.paused)
+        journal.complete(1)
+        journal.complete(2)
+        self.assertFalse(journal.paused)
+        self.assertTrue(resumed.is_set())
+
+    def test_close_leaves_unread_records(self):
+        journal = self.make_journal()
+        for i in range(3):
+            journal.append(str(i).encode())
+
+        records = journal.records()
+        self.assertEqual(next(records), (0, b'0'))
+        wait_for(lambda: journal.stats['syncs'])
+        journal.close()
+
+        # The reader stops rather than passing on the rest of the backlog
+        self.assertEqual(list(records), [])
+
+        journal = self.make_journal()
+        self.assertEqual(self.read(journal, 3), [(0, b'0'), (1, b'1'), (2, b'2')])
+
+
+class JournalQueueHandlerTestCase(unittest.TestCase):
+
+    def make_queue_handler(self, handler_class=JournalQueueHandler, **journal):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        conf = YamlConfig()
+        conf.config = {
+            'rabbit_server': {'queues': [{'name': 'deposits'}]},
+            'indexer': {'journal': {'directory': tmp_dir.name, **journal}}
+        }
+        queue_handler = handler_class(conf)
+        self.addCleanup(queue_handler.journal.close)
+        return queue_handler
+
+    def test_ack_after_sync(self):
+        queue_handler = self.make_queue_handler()
+
+        acked = []
+        channel = SimpleNamespace(channel_number=1, is_open=True, basic_ack=acked.append)
+        connection = SimpleNamespace(is_open=True, add_callback_threadsafe=lambda callback: callback())
+
+        for tag in range(3):
+            method = SimpleNamespace(delivery_tag=tag, redelivered=False)
+            body = f'2021-02-08 12:00:00:/badc/{tag}.nc:DEPOSIT:10:'.encode()
+            queue_handler._on_message(channel, method, None, body, queue='deposits', connection=connection)
+
+        self.assertTrue(wait_for(lambda: queue_handler.journal.committed == 3))
+        queue_handler.journal.close()
+        queue_handler._journal_thread.join(5)
+
+        self.assertEqual(sorted(acked), [0, 1, 2])
+        self.assertEqual(queue_handler.queue_handler.events, ['/badc/0.nc', '/badc/1.nc', '/badc/2.nc'])
+        self.assertEqual(queue_handler.journal.committed, 3)
+
+    def test_backlog_pauses_consumers(self):
+        release = threading.Event()
+
+        class BlockingHandler(RecordingHandler):
+            def process_event(self, message):
+                release.wait(5)
+                super().process_event(message)
+
+        class BlockingQueueHandler(QueueHandler):
+            HANDLER_CLASS = BlockingHandler
+
+        queue_handler = self.make_queue_handler(BlockingQueueHandler, max_backlog=2)
+
+        channel = FakeChannel()
+        connection = SimpleNamespace(is_open=True, channel=lambda: channel, add_callback_threadsafe=lambda callback: callback())
+        queue_handler._start_consuming(connection)
+        self.assertEqual(len(channel.consumers), 1)
+
+        for tag in range(2):
+            method = SimpleNamespace(delivery_tag=tag, redelivered=False)
+            body = f'2021-02-08 12:00:00:/badc/{tag}.nc:DEPOSIT:10:'.encode()
+            list(channel.consumers.values())[0](channel, method, None, body)
+
+        # The consumer is cancelled rather than blocking the connection thread
+        self.assertTrue(queue_handler.journal.paused)
+        self.assertEqual(channel.consumers, {})
+
+        # And registered again once the backlog has drained
+        release.set()
+        self.assertTrue(wait_for(lambda: len(channel.consumers) == 1))
+        self.assertFalse(queue_handler.journal.paused)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import logging
+import queue
+from unittest.mock import Mock, patch
+
+from rabbit_indexer.utils import YamlConfig
+from rabbit_indexer.utils.log_setup import AsyncQueueHandler, RateLimitFilter, SampleFilter, apply_log_filters
+
+
+def make_record(msg, level=logging.INFO, args=()):
+    return logging.LogRecord('test', level, __file__, 0, msg, args, None)
+
+
+class RateLimitFilterTestCase(unittest.TestCase):
+
+    @patch('rabbit_indexer.utils.log_setup.time.monotonic')
+    def test_rate_limit(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        log_filter = RateLimitFilter(rate=1, burst=2)
+
+        results = [log_filter.filter(make_record('Processed %s', args=(i,))) for i in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+        # Each template has its own bucket
+        self.assertTrue(log_filter.filter(make_record('Acknowledging %s')))
+
+        # Warnings are never dropped
+        self.assertTrue(log_filter.filter(make_record('Processed %s', level=logging.WARNING)))
+
+        mock_monotonic.return_value = 1
+        self.assertTrue(log_filter.filter(make_record('Processed %s')))
+        self.assertFalse(log_filter.filter(make_record('Processed %s')))
+
+        self.assertEqual(log_filter.dropped, 2)
+
+
+class SampleFilterTestCase(unittest.TestCase):
+
+    @patch('rabbit_indexer.utils.log_setup.random.random')
+    def test_sample(self, mock_random):
+        log_filter = SampleFilter(fraction=0.1)
+
+        mock_random.return_value = 0.05
+        self.assertTrue(log_filter.filter(make_record('Processed')))
+
+        mock_random.return_value = 0.5
+        self.assertFalse(log_filter.filter(make_record('Processed')))
+        self.assertTrue(log_filter.filter(make_record('Failed', level=logging.ERROR)))
+
+        self.assertEqual(log_filter.dropped, 1)
+
+
+class LogSetupTestCase(unittest.TestCase):
+
+    def test_record_not_formatted(self):
+        records = queue.SimpleQueue()
+        handler = AsyncQueueHandler(records)
+
+        record = make_record('Processed %s', args=('/badc',))
+        handler.handle(record)
+
+        queued = records.get_nowait()
+        self.assertIs(queued, record)
+        self.assertEqual(queued.args, ('/badc',))
+
+    def capture(self, conf):
+        """
+        Apply the filters from conf and return the records which reach the root handlers
+        """
+        root = logging.getLogger()
+        self.addCleanup(root.setLevel, root.level)
+
+        records = queue.SimpleQueue()
+        handler = AsyncQueueHandler(records)
+        root.addHandler(handler)
+        self.addCleanup(root.removeHandler, handler)
+
+        apply_log_filters(conf)
+
+        reset = YamlConfig()
+        reset.config = {'logging': {}}
+        self.addCleanup(apply_log_filters, reset)
+
+        return records
+
+    def test_apply_log_filters(self):
+        conf = YamlConfig()
+        conf.config = {'logging': {'rate_limits': {'rabbit_indexer.tests': {'rate': 0, 'burst': 1}}}}
+        records = self.capture(conf)
+        apply_log_filters(conf)
+
+        # The filter covers the child loggers, whose records propagate past the configured logger
+        logging.getLogger('rabbit_indexer.tests').info('Processed')
+        for _ in range(2):
+            logging.getLogger('rabbit_indexer.tests.log_setup').info('Acknowledged')
+        logging.getLogger('rabbit_indexer.other').info('Acknowledged')
+
+        names = []
+        while not records.empty():
+            names.append(records.get_nowait().name)
+        self.assertEqual(names, ['rabbit_indexer.tests', 'rabbit_indexer.tests.log_setup', 'rabbit_indexer.other'])
+
+        conf.config = {'logging': {}}
+        apply_log_filters(conf)
+
+        logging.getLogger('rabbit_indexer.tests.log_setup').info('Acknowledged')
+        self.assertEqual(records.get_nowait().name, 'rabbit_indexer.tests.log_setup')
+
+    def test_queue_handler_rate_limit(self):
+        from rabbit_indexer.queue_handler import queue_handler
+
+        # The example in the README throttles the per-message logging of the consumer
+        conf = YamlConfig()
+        conf.config = {'logging': {'log_level': 'debug', 'rate_limits': {'rabbit_indexer.queue_handler': {'rate': 0, 'burst': 1}}}}
+        records = self.capture(conf)
+
+        for tag in range(3):
+            queue_handler.QueueHandler._acknowledge_message(Mock(is_open=False), tag)
+
+        messages = []
+        while not records.empty():
+            messages.append(records.get_nowait().getMessage())
+        self.assertEqual(messages, ['Acknowledging message: 0'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import gc
+import tempfile
+import tracemalloc
+
+from benchmarks.memory_footprint import (
+    path_filter_rules,
+    path_tools_footprint,
+    replay_footprint,
+    write_mapping_file,
+)
+from benchmarks.moles_api_stub import MolesAPIStub
+from rabbit_indexer.utils import PathFilter, PathTools
+
+# Regression thresholds. Measured values are around 650 bytes per observation
+# for the compact mapping and no growth once the API cache is full or the
+# filter tree has been read. The dict and DatasetNode mapping is not gated as
+# its size depends on directory_tree.
+COMPACT_BYTES_PER_OBSERVATION = 1024
+STEADY_STATE_GROWTH = 128 * 1024
+LOOKUP_GROWTH = 16 * 1024
+
+
+class MemoryTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.mapping_file = write_mapping_file(cls.tmp_dir.name, 10000)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_compact_mapping(self):
+        current, _ = path_tools_footprint(self.mapping_file, compact=True)
+        self.assertLess(current / 10000, COMPACT_BYTES_PER_OBSERVATION)
+
+    def test_path_filter_lookups(self):
+        rules = path_filter_rules(10000)
+        path_filter = PathFilter(rules)
+
+        def lookups():
+            for i, rule in enumerate(rules):
+                path_filter.allow_path(f'{rule}/file{i}.nc')
+                path_filter.allow_path(f'/neodc/project{i}/file.nc')
+
+        # The first read of each node in the tree allocates its children list
+        # in anytree. This happens once so it is left out of the baseline.
+        lookups()
+
+        gc.collect()
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+
+        lookups()
+
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.assertLess(after - before, LOOKUP_GROWTH)
+
+    def test_steady_state(self):
+        # Around 500kB over the last 600 messages if the API results are not bounded
+        samples = replay_footprint(self.mapping_file, 800, chunk=100, api_cache_size=100)
+
+        # The API cache is full after the first chunk
+        _, warm, _ = samples[1]
+        _, final, _ = samples[-1]
+        self.assertLess(final - warm, STEADY_STATE_GROWTH)
+
+    def test_api_results_not_added_to_mapping(self):
+        with MolesAPIStub() as stub:
+            path_tools = PathTools(mapping_file=self.mapping_file, deferred=True, api_cache_size=10, api_url=stub.url)
+            self.addCleanup(path_tools.api_batcher.close)
+            size = len(path_tools.moles_mapping)
+
+            for i in range(100):
+                self.assertIsNotNone(path_tools.get_moles_record_metadata(f'/badc/new{i}'))
+
+        self.assertEqual(len(path_tools.moles_mapping), size)
+        self.assertEqual(len(path_tools.api_cache), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.moles_api_stub import MolesAPIStub, stub_record
+from rabbit_indexer.utils import PathTools
+from rabbit_indexer.utils.moles_api import MolesAPIBatcher
+
+MAPPING_FILE = os.path.join(os.path.dirname(__file__), 'moles_mapping_file.json')
+
+
+class MolesAPIBatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = MolesAPIStub(latency=0.05).start()
+        self.addCleanup(self.stub.stop)
+
+        self.results = {}
+        self.batcher = MolesAPIBatcher(self.stub.url, concurrency=4, on_result=self.results.__setitem__)
+        self.addCleanup(self.batcher.close)
+
+    def test_coalesce(self):
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(self.batcher.get, ['/badc/new'] * 8))
+
+        self.assertEqual(results, [stub_record('/badc/new')] * 8)
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(self.batcher.stats['coalesced'], 7)
+
+    def test_batch(self):
+        paths = [f'/badc/new{i}' for i in range(20)]
+        self.assertEqual(self.batcher.get_many(paths), [stub_record(path) for path in paths])
+
+        # One batch over the pooled connections
+        self.assertEqual(self.batcher.stats['batches'], 1)
+        self.assertEqual(self.stub.requests, 20)
+        self.assertLessEqual(self.stub.connections, 4)
+        self.assertEqual(set(self.results), set(paths))
+
+    def test_missing_and_timeout(self):
+        self.stub.records = {}
+        self.assertIsNone(self.batcher.get('/badc/missing'))
+        self.assertIn('/badc/missing', self.results)
+
+        # Timeouts are not cached
+        batcher = MolesAPIBatcher(self.stub.url, timeout=0.01, on_result=self.results.__setitem__)
+        self.addCleanup(batcher.close)
+
+        self.assertIsNone(batcher.get('/badc/slow'))
+        self.assertNotIn('/badc/slow', self.results)
+
+    def test_errors_not_cached(self):
+        for status in (429, 500, 503):
+            self.stub.status = status
+            self.assertIsNone(self.batcher.get(f'/badc/error{status}'))
+
+        self.assertEqual(self.results, {})
+        self.assertEqual(self.batcher.stats['errors'], 3)
+
+        # Looked up again once the API has recovered
+        self.stub.status = None
+        self.assertEqual(self.batcher.get('/badc/error500'), stub_record('/badc/error500'))
+        self.assertIn('/badc/error500', self.results)
+
+    def test_path_tools(self):
+        path_tools = PathTools(mapping_file=MAPPING_FILE, deferred=True, api_url=self.stub.url)
+        self.addCleanup(path_tools.api_batcher.close)
+
+        records = path_tools.get_moles_records(['/badc/cmip5/data/', '/badc/new1', '/badc/new2'])
+
+        self.assertEqual(records[0]['record_type'], 'Dataset')
+        self.assertEqual(records[1:], [stub_record('/badc/new1'), stub_record('/badc/new2')])
+        self.assertEqual(path_tools.api_batcher.stats['batches'], 1)
+
+        # Answered from the API cache
+        self.assertEqual(path_tools.get_moles_record_metadata('/badc/new1'), stub_record('/badc/new1'))
+        self.assertEqual(self.stub.requests, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import os
+
+from rabbit_indexer.utils.path_tools import load_moles_mapping
+from rabbit_indexer.utils.moles_store import CompactMolesStore
+
+
+def get_local_path():
+    return os.path.dirname(os.path.relpath(__file__))
+
+
+MAPPING_FILE = os.path.join(get_local_path(), 'moles_mapping_file.json')
+
+
+class CompactMolesStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.mapping = load_moles_mapping(MAPPING_FILE)
+        self.store = CompactMolesStore(self.mapping)
+
+    def test_get(self):
+        for path, expected in self.mapping.items():
+            self.assertDictEqual(self.store.get(path), expected)
+            self.assertDictEqual(self.store.get(f'{path}/'), expected)
+
+        self.assertIsNone(self.store.get('/badc/cmip5'))
+        self.assertIsNone(self.store.get('/badc/cmip5/data/output1'))
+
+    def test_search_name(self):
+        paths = [
+            ('/neodc/avhrr-3', None),
+            ('/badc/cmip5', None),
+            ('/badc/cmip5/data', '/badc/cmip5/data'),
+            ('/badc/cmip5/data/output1/file.nc', '/badc/cmip5/data'),
+        ]
+
+        for path, expected in paths:
+            self.assertEqual(self.store.search_name(path), expected)
+
+    def test_setitem(self):
+        api_response = {
+            'title': 'AVHRR-3: Radiometric images',
+            'url': 'https://catalogue.ceda.ac.uk/uuid/7767578df074e685932237a00ef319c5',
+            'record_type': 'Dataset Collection'
+        }
+        self.store['/neodc/avhrr-3'] = api_response
+
+        self.assertDictEqual(self.store['/neodc/avhrr-3'], api_response)
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.search_name('/neodc/avhrr-3/data'), '/neodc/avhrr-3')
+
+    def test_non_compact_records(self):
+        values = [
+            {'title': 'No url', 'url': None, 'record_type': 'Dataset'},
+            {'title': 'Extra', 'url': 'https://catalogue.ceda.ac.uk/uuid/abc', 'record_type': 'Dataset', 'extra': 1},
+            {'title': 'Upper', 'url': 'https://catalogue.ceda.ac.uk/uuid/7767578DF074E685932237A00EF319C5', 'record_type': 'Dataset'},
+        ]
+
+        for i, value in enumerate(values):
+            self.store[f'/test/{i}'] = value
+            self.assertDictEqual(self.store[f'/test/{i}'], value)
+
+    def test_items(self):
+        self.store['/badc/cmip5/data/output1'] = {
+            'title': 'Nested',
+            'url': 'https://catalogue.ceda.ac.uk/uuid/2e46c98da23c4c8da7942b3c4f8bee09',
+            'record_type': 'Dataset'
+        }
+
+        self.assertEqual(list(self.store), ['/badc/cmip5/data', '/badc/cmip5/data/output1'])
+        self.assertEqual(dict(self.store.items())['/badc/cmip5/data'], self.mapping['/badc/cmip5/data'])
+
+
+if __name__ == '__main__':
+    unittest.main()
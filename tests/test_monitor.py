@@ -0,0 +1,220 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import math
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from rabbit_indexer.index_updaters.base import UpdateHandler
+from rabbit_indexer.queue_handler import QueueHandler
+from rabbit_indexer.queue_handler.monitor import BacklogMonitor
+from rabbit_indexer.utils import YamlConfig
+
+
+class FakeConnection:
+    """
+    Returns the queued message counts from passive declares
+    """
+
+    is_open = True
+
+    def __init__(self, counts):
+        self.counts = counts
+
+    def channel(self):
+        return self
+
+    def queue_declare(self, queue, passive):
+        messages, consumers = self.counts[queue]
+        return SimpleNamespace(method=SimpleNamespace(message_count=messages, consumer_count=consumers))
+
+    def close(self):
+        pass
+
+
+class HoldingHandler(UpdateHandler):
+    """
+    Holds each message, as a sink would until its output is written
+    """
+
+    def setup_extra(self, **kwargs):
+        self.held = []
+
+    def process_event(self, message):
+        delivery = self.current_delivery
+        delivery.hold()
+        self.held.append(delivery)
+
+    def write(self):
+        held, self.held = self.held, []
+        for delivery in held:
+            delivery.release()
+
+
+class HoldingQueueHandler(QueueHandler):
+    HANDLER_CLASS = HoldingHandler
+
+
+def make_connection():
+    channel = SimpleNamespace(channel_number=1, is_open=True, acked=[])
+    channel.basic_ack = channel.acked.append
+    connection = SimpleNamespace(is_open=True, add_callback_threadsafe=lambda callback: callback())
+    return channel, connection
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@patch('rabbit_indexer.queue_handler.monitor.time.monotonic')
+class BacklogMonitorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = FakeConnection({'a': (0, 2), 'b': (0, 2)})
+        self.monitor = BacklogMonitor(lambda: self.connection, ['a', 'b'], target_drain_time=100, max_workers=10)
+
+    def sample(self, clock, now, counts, acks=0):
+        clock.return_value = now
+        self.connection.counts = counts
+        for _ in range(acks):
+            self.monitor.record_ack()
+        return self.monitor.sample()
+
+    def test_idle(self, clock):
+        stats = self.sample(clock, 0, {'a': (0, 2), 'b': (0, 2)})
+
+        self.assertEqual(stats['backlog'], 0)
+        self.assertEqual(stats['drain_time'], 0)
+        self.assertEqual(stats['recommended_workers'], 1)
+
+    def test_scale_up(self, clock):
+        self.sample(clock, 0, {'a': (1000, 2), 'b': (0, 2)})
+        stats = self.sample(clock, 10, {'a': (1200, 2), 'b': (0, 2)}, acks=50)
+
+        # 5 acks/s per consumer, 10 acks/s drained and 30/s arriving
+        self.assertEqual(stats['ack_rate'], 5)
+        self.assertEqual(stats['inflow_rate'], 30)
+        self.assertEqual(stats['drain_time'], 120)
+
+        # (30 + 1200 / 100) / 5
+        self.assertEqual(stats['recommended_workers'], 9)
+
+    def test_clamped(self, clock):
+        self.sample(clock, 0, {'a': (10000, 2), 'b': (0, 2)})
+        stats = self.sample(clock, 10, {'a': (10000, 2), 'b': (0, 2)}, acks=10)
+
+        self.assertEqual(stats['recommended_workers'], 10)
+
+    def test_no_acks(self, clock):
+        stats = self.sample(clock, 0, {'a': (5, 2), 'b': (0, 2)})
+
+        self.assertEqual(stats['drain_time'], math.inf)
+        self.assertEqual(stats['recommended_workers'], 2)
+
+    def test_deposit_lag(self, clock):
+        keys = []
+        for minutes in (10, 1):
+            key = self.monitor.hold()
+            deposit = datetime.now() - timedelta(minutes=minutes)
+            self.monitor.record_deposit(key, deposit.strftime('%Y-%m-%d %H:%M:%S'))
+            keys.append(key)
+
+        # The oldest deposit still being processed
+        stats = self.sample(clock, 0, {'a': (5, 1), 'b': (0, 1)})
+        self.assertAlmostEqual(stats['deposit_lag'], 600, delta=5)
+
+        self.monitor.release(keys[0])
+        stats = self.sample(clock, 10, {'a': (5, 1), 'b': (0, 1)})
+        self.assertAlmostEqual(stats['deposit_lag'], 60, delta=5)
+
+        # With nothing held, the last processed deposit
+        self.monitor.release(keys[1])
+        stats = self.sample(clock, 20, {'a': (5, 1), 'b': (0, 1)})
+        self.assertAlmostEqual(stats['deposit_lag'], 60, delta=5)
+
+        stats = self.sample(clock, 30, {'a': (0, 1), 'b': (0, 1)})
+        self.assertEqual(stats['deposit_lag'], 0)
+
+    def test_publish(self, clock):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        calls = []
+        self.monitor.metrics_file = os.path.join(tmp_dir.name, 'rabbit_indexer.prom')
+        self.monitor.hook = calls.append
+
+        stats = self.sample(clock, 0, {'a': (3, 1), 'b': (4, 1)})
+        self.monitor.publish(stats)
+
+        self.assertEqual(calls, [stats])
+        with open(self.monitor.metrics_file) as reader:
+            metrics = reader.read()
+
+        self.assertIn('rabbit_indexer_queue_messages{queue="b"} 4', metrics)
+        self.assertIn('rabbit_indexer_drain_time +Inf', metrics)
+        self.assertIn('rabbit_indexer_recommended_workers 1', metrics)
+
+
+class QueueHandlerMonitorTestCase(unittest.TestCase):
+
+    def make_queue_handler(self, **indexer):
+        conf = YamlConfig()
+        conf.config = {'rabbit_server': {'queues': []}, 'indexer': indexer}
+        queue_handler = HoldingQueueHandler(conf)
+        queue_handler.monitor = BacklogMonitor(lambda: None, [])
+        return queue_handler
+
+    def test_deposit_held_until_processed(self):
+        queue_handler = self.make_queue_handler()
+        channel, connection = make_connection()
+
+        deposit = (datetime.now() - timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S')
+        queue_handler.callback(channel, SimpleNamespace(delivery_tag=1), None, f'{deposit}:/badc/a.nc:DEPOSIT:10:'.encode(), connection)
+
+        # Still waiting while its output is unwritten
+        self.assertAlmostEqual(queue_handler.monitor._deposit_lag(), 600, delta=5)
+        self.assertEqual(len(queue_handler.monitor._held), 1)
+
+        queue_handler.queue_handler.write()
+        self.assertEqual(channel.acked, [1])
+        self.assertEqual(queue_handler.monitor._held, {})
+        self.assertEqual(queue_handler.monitor._acks, 1)
+
+    def test_journal_counts_processed(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        queue_handler = self.make_queue_handler(journal={'directory': tmp_dir.name})
+        self.addCleanup(queue_handler.journal.close)
+        channel, connection = make_connection()
+        queue_handler._start_consuming(connection)
+
+        method = SimpleNamespace(delivery_tag=1, redelivered=False)
+        queue_handler._on_message(channel, method, None, b'2021-02-09 11:17:12:/badc/a.nc:DEPOSIT:10:', queue='deposits', connection=connection)
+
+        # Acknowledged once synced, but only counted once processed
+        wait_for(lambda: channel.acked and queue_handler.queue_handler.held)
+        self.assertEqual(channel.acked, [1])
+        self.assertEqual(queue_handler.monitor._acks, 0)
+
+        queue_handler.queue_handler.write()
+        wait_for(lambda: queue_handler.journal.committed)
+        self.assertEqual(queue_handler.monitor._acks, 1)
+        self.assertEqual(queue_handler.monitor._held, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,6 +14,7 @@ import os
 import json
 
 from rabbit_indexer.utils import PathTools, PathFilter
+from rabbit_indexer.utils.cache import TTLCache
 
 
 def get_local_path():
@@ -25,7 +26,8 @@ class PathToolsTestCase(TestCase):
     @classmethod
     def setUpClass(cls) -> None:
         mapping_file = os.path.join(get_local_path(), 'moles_mapping_file.json')
-        cls.path_tools = PathTools(mapping_file=mapping_file)
+        spot_cache_file = os.path.join(get_local_path(), 'spot_mapping_cache.json')
+        cls.path_tools = PathTools(mapping_file=mapping_file, spot_cache_file=spot_cache_file)
 
         with open(mapping_file) as reader:
             mapping = json.load(reader)
@@ -89,6 +91,25 @@ class PathToolsTestCase(TestCase):
         metadata, islink = self.path_tools.generate_path_metadata('/neodc/avhrr-3')
         self.assertTrue(metadata.get('record_type'), 'Dataset Collection')
 
+    def test_directory_metadata_cache(self):
+        self.path_tools.dir_cache = TTLCache(maxsize=10, ttl=60)
+        self.addCleanup(setattr, self.path_tools, 'dir_cache', None)
+
+        first, _ = self.path_tools.generate_path_metadata('/badc/cmip5/data')
+        first['readme'] = 'Changes by the caller are not cached'
+
+        second, _ = self.path_tools.generate_path_metadata('/badc/cmip5/data')
+        self.assertNotIn('readme', second)
+        self.assertEqual(self.path_tools.cache_info()['directory_metadata']['hits'], 1)
+
+        # Invalidating an ancestor removes the entry
+        self.path_tools.invalidate_directory_metadata('/badc/cmip5')
+        self.path_tools.generate_path_metadata('/badc/cmip5/data')
+
+        info = self.path_tools.cache_info()['directory_metadata']
+        self.assertEqual(info['invalidations'], 1)
+        self.assertEqual(info['misses'], 2)
+
     def test_get_moles_record_metadata(self):
         metadata = self.path_tools.get_moles_record_metadata(
             '/badc/cmip5/data'
@@ -134,6 +155,26 @@ class PathToolsTestCase(TestCase):
         self.assertEqual('5174fa172be7d29d15fb0a2a09e7d600375585d9', hash)
 
 
+class DeferredPathToolsTestCase(unittest.TestCase):
+
+    def test_deferred_mapping(self):
+        mapping_file = os.path.join(get_local_path(), 'moles_mapping_file.json')
+        path_tools = PathTools(mapping_file=mapping_file, deferred=True)
+
+        # Nothing is loaded until it is needed
+        self.assertFalse(path_tools._mapping_ready.is_set())
+
+        path_tools.start_loading()
+        self.assertTrue(path_tools.wait_ready(timeout=10))
+        self.assertTrue(path_tools.tree.search_name('/badc/cmip5/data'))
+
+    def test_deferred_load_error(self):
+        path_tools = PathTools(mapping_file='missing_mapping_file.json', deferred=True)
+
+        with self.assertRaises(RuntimeError):
+            path_tools.get_moles_record_metadata('/badc/cmip5/data')
+
+
 class PathFilterTestCase(TestCase):
 
     def test_allow_deny_filter(self):
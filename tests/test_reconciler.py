@@ -0,0 +1,126 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from rabbit_indexer.utils.reconciler import DigestStore, DirectoryReconciler
+
+
+class DirectoryReconcilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        self.root = os.path.join(tmp_dir.name, 'archive')
+        for directory in ('badc/cmip5/data', 'badc/cmip6', 'neodc/avhrr-3'):
+            os.makedirs(os.path.join(self.root, directory))
+
+        self.write('badc/cmip5/data/a.nc', 'a')
+        self.write('badc/cmip6/b.nc', 'b')
+        self.write('neodc/avhrr-3/c.nc', 'c')
+
+        self.store = DigestStore(os.path.join(tmp_dir.name, 'state.db'))
+        self.addCleanup(self.store.close)
+
+    def write(self, path, content):
+        with open(os.path.join(self.root, path), 'w') as writer:
+            writer.write(content)
+
+    def reconcile(self, quick=False, batch_size=1000):
+        events = []
+        reconciler = DirectoryReconciler(self.store, events.append, workers=2, quick=quick, batch_size=batch_size)
+        reconciler.reconcile(self.root)
+        return sorted((event.action, os.path.relpath(event.filepath, self.root)) for event in events), reconciler.stats
+
+    def test_initial_run(self):
+        events, stats = self.reconcile()
+
+        self.assertIn(('MKDIR', 'badc/cmip5'), events)
+        self.assertIn(('DEPOSIT', 'neodc/avhrr-3/c.nc'), events)
+        self.assertEqual(stats['directories'], 7)
+
+    def test_no_change(self):
+        self.reconcile()
+        events, stats = self.reconcile()
+
+        self.assertEqual(events, [])
+        self.assertEqual(stats['changed'], 0)
+
+    def test_changes(self):
+        self.reconcile()
+
+        self.write('badc/cmip5/data/a.nc', 'changed')
+        self.write('badc/cmip5/data/new.nc', 'new')
+        os.remove(os.path.join(self.root, 'badc/cmip6/b.nc'))
+        shutil.rmtree(os.path.join(self.root, 'neodc/avhrr-3'))
+        os.symlink('cmip5', os.path.join(self.root, 'badc/latest'))
+
+        events, stats = self.reconcile()
+
+        self.assertEqual(events, [
+            ('DEPOSIT', 'badc/cmip5/data/a.nc'),
+            ('DEPOSIT', 'badc/cmip5/data/new.nc'),
+            ('REMOVE', 'badc/cmip6/b.nc'),
+            ('REMOVE', 'neodc/avhrr-3/c.nc'),
+            ('RMDIR', 'neodc/avhrr-3'),
+            ('SYMLINK', 'badc/latest'),
+        ])
+
+        # Only the directories whose own entries changed are compared and stored
+        self.assertEqual(stats['changed'], 4)
+        self.assertEqual(stats['directories'], 6)
+        self.assertIsNone(self.store.get(os.path.join(self.root, 'neodc/avhrr-3')))
+
+        events, _ = self.reconcile()
+        self.assertEqual(events, [])
+
+    def test_removed_tree(self):
+        self.reconcile()
+        shutil.rmtree(os.path.join(self.root, 'badc'))
+
+        # Everything recorded below the removed directory is removed with it
+        events, _ = self.reconcile()
+        self.assertEqual(events, [
+            ('REMOVE', 'badc/cmip5/data/a.nc'),
+            ('REMOVE', 'badc/cmip6/b.nc'),
+            ('RMDIR', 'badc'),
+            ('RMDIR', 'badc/cmip5'),
+            ('RMDIR', 'badc/cmip5/data'),
+            ('RMDIR', 'badc/cmip6'),
+        ])
+        self.assertIsNone(self.store.get(os.path.join(self.root, 'badc/cmip5/data')))
+
+    def test_batches(self):
+        events, stats = self.reconcile(batch_size=1)
+
+        # Each level is compared one directory at a time
+        self.assertEqual(len(events), 9)
+        self.assertIn(('DEPOSIT', 'badc/cmip5/data/a.nc'), events)
+        self.assertEqual(stats['directories'], 7)
+
+        events, _ = self.reconcile(batch_size=1)
+        self.assertEqual(events, [])
+
+    def test_quick(self):
+        self.reconcile()
+
+        # A new file changes the directory mtime
+        self.write('badc/cmip6/new.nc', 'new')
+        events, _ = self.reconcile(quick=True)
+
+        self.assertEqual(events, [('DEPOSIT', 'badc/cmip6/new.nc')])
+
+
+if __name__ == '__main__':
+    unittest.main()
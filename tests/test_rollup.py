@@ -0,0 +1,175 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import os
+import tempfile
+
+from rabbit_indexer.index_updaters.base import Delivery
+from rabbit_indexer.index_updaters.rollup import DirectoryRollup
+from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+from rabbit_indexer.utils.path_tools import PathTools
+
+
+class RecordingSink:
+    """
+    Keeps the actions until they are released by the test
+    """
+
+    def __init__(self):
+        self.items = []
+
+    def add(self, action, source=None, delivery=None):
+        if delivery:
+            delivery.hold()
+        self.items.append((action, source, delivery))
+
+    def release(self, success=True):
+        items, self.items = self.items, []
+        for _, _, delivery in items:
+            delivery.release(success)
+        return items
+
+
+def message(path, action='DEPOSIT', size='10'):
+    return IngestMessage('2021-02-08 12:00:00', path, action, size, '')
+
+
+def updates(items, paths=('/badc', '/badc/cmip5', '/badc/cmip6', '/neodc')):
+    ids = {PathTools.generate_id(path): path for path in paths}
+    return {
+        ids[action['update']['_id']]: (source['script']['params']['seq'], source['script']['params']['size'], source['script']['params']['count'])
+        for action, source, _ in items
+    }
+
+
+class DirectoryRollupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.checkpoint_file = os.path.join(tmp_dir.name, 'rollup.json')
+        self.sink = RecordingSink()
+
+    def make_rollup(self):
+        rollup = DirectoryRollup(self.sink, checkpoint_file=self.checkpoint_file, instance='test', interval=3600)
+        self.addCleanup(rollup._stop.set)
+        return rollup
+
+    def test_rollup(self):
+        rollup = self.make_rollup()
+        acks = []
+        delivery = Delivery(lambda: acks.append('ack'))
+
+        rollup.apply(message('/badc/cmip6/a.nc', size='10'), delivery)
+        rollup.apply(message('/badc/cmip5/b.nc', size='5'), delivery)
+        rollup.apply(message('/badc/cmip6/c.nc', action='REMOVE', size='3'), delivery)
+        self.assertFalse(rollup.apply(message('/badc/cmip6', action='MKDIR', size='')))
+        delivery.close()
+
+        # Held until the changes are checkpointed
+        self.assertEqual(acks, [])
+        rollup.flush()
+        self.assertEqual(acks, ['ack'])
+        self.assertTrue(os.path.exists(self.checkpoint_file))
+
+        items = self.sink.release()
+        self.assertEqual(updates(items), {
+            '/badc': (1, 12, 1),
+            '/badc/cmip6': (1, 7, 0),
+            '/badc/cmip5': (1, 5, 1),
+        })
+        self.assertEqual(rollup.totals(), {})
+
+        # Directory documents are never created by the updates
+        self.assertTrue(all('upsert' not in source for _, source, _ in items))
+
+    def test_in_flight(self):
+        rollup = self.make_rollup()
+
+        rollup.apply(message('/badc/cmip6/a.nc'))
+        rollup.flush()
+
+        # Changes to directories with an update in flight wait for it to be confirmed
+        rollup.apply(message('/badc/cmip6/b.nc'))
+        rollup.apply(message('/neodc/c.nc'))
+        rollup.flush()
+
+        self.assertEqual(set(updates(self.sink.items)), {'/badc', '/badc/cmip6', '/neodc'})
+        self.assertEqual(rollup.totals()['/badc/cmip6'], (20, 2))
+
+        self.sink.release()
+        rollup.flush()
+
+        self.assertEqual(updates(self.sink.release()), {
+            '/badc': (3, 10, 1),
+            '/badc/cmip6': (3, 10, 1),
+        })
+
+    def test_failure_resent(self):
+        rollup = self.make_rollup()
+
+        rollup.apply(message('/badc/a.nc'))
+        rollup.flush()
+        self.sink.release(success=False)
+
+        rollup.apply(message('/badc/b.nc'))
+        rollup.flush()
+
+        # The failed update is resent with the same sequence number
+        self.assertEqual(updates(self.sink.items), {'/badc': (1, 10, 1)})
+        self.assertEqual(rollup.totals()['/badc'], (20, 2))
+        self.assertEqual(rollup.stats['failures'], 1)
+
+    def test_checkpoint(self):
+        rollup = self.make_rollup()
+        rollup.apply(message('/badc/a.nc'))
+        rollup.flush()
+
+        # Restart before the update was confirmed
+        self.sink.items = []
+        rollup = self.make_rollup()
+        rollup.flush()
+
+        self.assertEqual(updates(self.sink.release()), {'/badc': (1, 10, 1)})
+
+    def test_sequence_kept_over_restart(self):
+        rollup = DirectoryRollup(self.sink, checkpoint_file=self.checkpoint_file, interval=3600)
+        self.addCleanup(rollup._stop.set)
+        rollup.apply(message('/badc/a.nc'))
+        rollup.flush()
+        self.sink.release()
+        rollup.close()
+
+        # The name and the sequence number are read back from the checkpoint
+        restarted = DirectoryRollup(self.sink, checkpoint_file=self.checkpoint_file, interval=3600)
+        self.addCleanup(restarted._stop.set)
+        self.assertEqual(restarted.instance, rollup.instance)
+
+        # The unconfirmed update is resent first
+        restarted.apply(message('/badc/b.nc'))
+        restarted.flush()
+        self.assertEqual(updates(self.sink.release()), {'/badc': (1, 10, 1)})
+
+        restarted.flush()
+        self.assertEqual(updates(self.sink.release()), {'/badc': (3, 10, 1)})
+
+    def test_default_instance(self):
+        # Consumers on the same host have their own sequence numbers
+        instances = set()
+        for checkpoint_file in (self.checkpoint_file, f'{self.checkpoint_file}.other'):
+            rollup = DirectoryRollup(self.sink, checkpoint_file=checkpoint_file, interval=3600)
+            self.addCleanup(rollup._stop.set)
+            instances.add(rollup.instance)
+
+        self.assertEqual(len(instances), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import threading
+from unittest.mock import patch
+
+from rabbit_indexer.queue_handler.priority import ActionPriorityQueue
+from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+from rabbit_indexer.queue_handler.scheduler import WeightedFairScheduler
+
+
+def message(action, filepath):
+    return IngestMessage('2021-02-08 12:00:00', filepath, action, '0', '')
+
+
+class WeightedFairSchedulerTestCase(unittest.TestCase):
+
+    def run_tasks(self, scheduler, tasks):
+        """
+        Submit the tasks before starting the workers and wait for them all to complete
+
+        :param scheduler: WeightedFairScheduler
+        :param tasks: list of (queue, label) tuples
+        :return: list of labels in the order they ran
+        """
+        order = []
+        done = threading.Semaphore(0)
+
+        def task(label):
+            order.append(label)
+            done.release()
+
+        for queue, label in tasks:
+            scheduler.submit(queue, lambda label=label: task(label))
+
+        scheduler.start()
+        for _ in tasks:
+            done.acquire(timeout=5)
+        scheduler.stop()
+
+        return order
+
+    def test_hot_queue_does_not_starve(self):
+        scheduler = WeightedFairScheduler(1, {'deposit': {}, 'dirs': {}})
+
+        tasks = [('deposit', f'deposit-{i}') for i in range(100)]
+        tasks.append(('dirs', 'dirs-0'))
+
+        order = self.run_tasks(scheduler, tasks)
+
+        self.assertLess(order.index('dirs-0'), 2)
+
+    def test_weights(self):
+        scheduler = WeightedFairScheduler(1, {'a': {'weight': 3}, 'b': {'weight': 1}})
+
+        tasks = [('a', 'a') for _ in range(30)] + [('b', 'b') for _ in range(30)]
+
+        order = self.run_tasks(scheduler, tasks)
+
+        self.assertEqual(order[:20].count('a'), 15)
+
+    def test_concurrency_limit(self):
+        scheduler = WeightedFairScheduler(4, {'a': {'concurrency': 1}})
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def task():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            threading.Event().wait(0.01)
+            with lock:
+                running.pop()
+
+        tasks = [('a', i) for i in range(10)]
+        for queue, _ in tasks:
+            scheduler.submit(queue, task)
+
+        scheduler.start()
+        while scheduler.stats()['a']['dispatched'] < 10 or scheduler.stats()['a']['in_flight']:
+            threading.Event().wait(0.01)
+        scheduler.stop()
+
+        self.assertEqual(max(peak), 1)
+
+    def test_invalid_weight(self):
+        with self.assertRaises(ValueError):
+            WeightedFairScheduler(1, {'a': {'weight': 0}})
+
+    def test_priority(self):
+        scheduler = WeightedFairScheduler(1, {'a': {}}, priority={})
+        order = []
+        done = threading.Semaphore(0)
+
+        def task(label):
+            order.append(label)
+            done.release()
+
+        for i in range(20):
+            scheduler.submit('a', lambda i=i: task(f'deposit-{i}'), message('DEPOSIT', f'/badc/file-{i}'))
+        scheduler.submit('a', lambda: task('mkdir'), message('MKDIR', '/badc/new'))
+
+        scheduler.start()
+        for _ in range(21):
+            done.acquire(timeout=5)
+        scheduler.stop()
+
+        self.assertEqual(order[0], 'mkdir')
+
+
+@patch('rabbit_indexer.queue_handler.priority.time.monotonic')
+class ActionPriorityQueueTestCase(unittest.TestCase):
+
+    def drain(self, queue):
+        order = []
+        while queue:
+            task = queue.popleft()
+            order.append(task())
+            queue.done(task)
+        return order
+
+    def add(self, queue, label, action, filepath):
+        queue.append(lambda: label, message(action, filepath))
+
+    def test_weights(self, clock):
+        clock.return_value = 100
+        queue = ActionPriorityQueue()
+
+        self.add(queue, 'deposit', 'DEPOSIT', '/badc/a.nc')
+        self.add(queue, 'readme', 'DEPOSIT', '/badc/00README')
+        self.add(queue, 'mkdir', 'MKDIR', '/badc/data')
+
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(self.drain(queue), ['readme', 'mkdir', 'deposit'])
+
+    def test_aging(self, clock):
+        queue = ActionPriorityQueue(aging=10)
+
+        clock.return_value = 0
+        self.add(queue, 'deposit', 'DEPOSIT', '/badc/a.nc')
+
+        # A deposit gains 9 units of weight after 90 seconds
+        clock.return_value = 91
+        self.add(queue, 'mkdir', 'MKDIR', '/badc/data')
+
+        self.assertEqual(self.drain(queue), ['deposit', 'mkdir'])
+
+    def test_path_ordering(self, clock):
+        clock.return_value = 0
+        queue = ActionPriorityQueue()
+
+        self.add(queue, 'deposit', 'DEPOSIT', '/badc/a')
+        self.add(queue, 'other', 'DEPOSIT', '/badc/b')
+        self.add(queue, 'rmdir', 'RMDIR', '/badc/a')
+
+        # The RMDIR waits for the deposit on the same path
+        first = queue.popleft()
+        self.assertEqual(first(), 'deposit')
+
+        second = queue.popleft()
+        self.assertEqual(second(), 'other')
+        self.assertFalse(queue)
+
+        queue.done(first)
+        self.assertEqual(self.drain(queue), ['rmdir'])
+
+
+if __name__ == '__main__':
+    unittest.main()
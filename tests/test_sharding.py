@@ -0,0 +1,107 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import tempfile
+from types import SimpleNamespace
+
+from rabbit_indexer.queue_handler.router import ShardRouter
+from rabbit_indexer.queue_handler.sharding import (
+    ShardingConfig,
+    claimed_partitions,
+    partition_for,
+    shard_key
+)
+from rabbit_indexer.utils import YamlConfig
+
+
+class ShardingTestCase(unittest.TestCase):
+
+    def test_shard_key(self):
+        self.assertEqual(shard_key('/badc/cmip5/data/file.nc'), '/badc/cmip5/data')
+        self.assertEqual(shard_key('/badc/cmip5/data/'), '/badc/cmip5')
+        self.assertEqual(shard_key('/badc'), '/')
+
+    def test_partition_for(self):
+        # Files in the same directory go to the same partition
+        self.assertEqual(
+            partition_for('/badc/cmip5/data/a.nc', 16),
+            partition_for('/badc/cmip5/data/b.nc', 16)
+        )
+
+        # Stable between processes
+        self.assertEqual(partition_for('/badc/cmip5/data/a.nc', 16), 6)
+
+    def test_claimed_partitions(self):
+        claimed = [claimed_partitions(shard_id, 3, 8) for shard_id in range(3)]
+
+        self.assertEqual(claimed, [[0, 3, 6], [1, 4, 7], [2, 5]])
+
+        with self.assertRaises(ValueError):
+            claimed_partitions(3, 3, 8)
+
+    def test_partition_queues(self):
+        sharding = ShardingConfig({'partitions': 4, 'shards': 2, 'shard_id': 1, 'prefetch': 10})
+
+        queues = sharding.claimed_queues()
+        self.assertEqual([queue['name'] for queue in queues], ['rabbit_indexer.shard.1', 'rabbit_indexer.shard.3'])
+        self.assertEqual(queues[0]['bind_kwargs'], {'routing_key': '1'})
+        self.assertEqual(queues[0]['prefetch'], 10)
+        self.assertTrue(queues[0]['kwargs']['durable'])
+
+        self.assertEqual(len(sharding.all_queues()), 4)
+        self.assertEqual(sharding.routing_key('/badc/cmip5/data/a.nc'), str(partition_for('/badc/cmip5/data/a.nc', 4)))
+
+    def test_consistent_hash(self):
+        sharding = ShardingConfig({'mode': 'consistent_hash', 'shard_id': 2, 'hash_weight': 5})
+
+        self.assertEqual(sharding.exchange_type, 'x-consistent-hash')
+        self.assertEqual(sharding.claimed_queues()[0]['bind_kwargs'], {'routing_key': '5'})
+        self.assertEqual(sharding.routing_key('/badc/cmip5/data/a.nc'), '/badc/cmip5/data')
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            ShardingConfig({'mode': 'random'})
+
+
+class ShardRouterTestCase(unittest.TestCase):
+
+    def test_journal_not_used(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        conf = YamlConfig()
+        conf.config = {
+            'rabbit_server': {'queues': [{'name': 'deposits'}], 'sharding': {'partitions': 4}},
+            'indexer': {'journal': {'directory': tmp_dir.name}, 'idempotency': {'size': 10}},
+        }
+
+        # The router has no handler to process journal records or apply messages
+        router = ShardRouter(conf)
+        self.assertIsNone(router.journal)
+        self.assertIsNone(router.idempotency)
+
+        published = []
+        router.publish_channel = SimpleNamespace(basic_publish=lambda **kwargs: published.append(kwargs['routing_key']))
+
+        channel = SimpleNamespace(channel_number=1, is_open=True, acked=[])
+        channel.basic_ack = channel.acked.append
+        connection = SimpleNamespace(is_open=True, add_callback_threadsafe=lambda callback: callback())
+
+        body = b'2021-02-09 11:17:12:/badc/cmip5/a.nc:DEPOSIT:10:'
+        method = SimpleNamespace(delivery_tag=1, redelivered=False)
+        router._on_message(channel, method, None, body, queue='deposits', connection=connection)
+
+        self.assertEqual(published, [router.sharding.routing_key('/badc/cmip5/a.nc')])
+        self.assertEqual(channel.acked, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+
+from rabbit_indexer.utils import PathFilter, PathTools
+from rabbit_indexer.utils.sidecar import (
+    OP_FILTER,
+    OP_MOLES,
+    OP_SPOT,
+    MappingSidecar,
+    SidecarClient,
+    decode_request,
+    decode_results,
+    encode_request,
+    encode_results,
+)
+
+TEST_DIR = os.path.dirname(__file__)
+MAPPING_FILE = os.path.join(TEST_DIR, 'moles_mapping_file.json')
+SPOT_CACHE_FILE = os.path.join(TEST_DIR, 'spot_mapping_cache.json')
+
+CMIP5 = '/badc/cmip5/data'
+
+
+class ProtocolTestCase(unittest.TestCase):
+
+    def test_request(self):
+        paths = ['/badc/cmip5/data', '/neodc/ünïcode', '']
+        self.assertEqual(decode_request(encode_request(OP_SPOT, paths)), (OP_SPOT, paths))
+
+    def test_results(self):
+        cases = {
+            OP_MOLES: [None, {'title': 'Tïtle', 'url': 'https://catalogue.ceda.ac.uk/uuid/1', 'record_type': 'Dataset'}, {'title': None, 'url': None, 'record_type': None}],
+            OP_SPOT: ['spot-1234-cmip5', None, ''],
+            OP_FILTER: [True, False, True],
+        }
+
+        for op, results in cases.items():
+            payload = b'xx' + encode_results(op, results)
+            self.assertEqual(decode_results(op, len(results), payload, 2), results)
+
+
+class SidecarTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.socket_path = os.path.join(tmp_dir.name, 'mapping.sock')
+
+        # The spot cache file is copied as it is rewritten on refresh
+        spot_cache_file = os.path.join(tmp_dir.name, 'spots.json')
+        shutil.copy(SPOT_CACHE_FILE, spot_cache_file)
+
+        self.owner = PathTools(mapping_file=MAPPING_FILE, spot_cache_file=spot_cache_file, deferred=True)
+        self.start_sidecar()
+
+        # Paths which are not in the mapping are not looked up in the API
+        api = patch.object(PathTools, '_get_moles_record_metadata_data_from_api', return_value=None)
+        self.api = api.start()
+        self.addCleanup(api.stop)
+
+    def start_sidecar(self):
+        self.sidecar = MappingSidecar(self.owner, self.socket_path, path_filter=PathFilter(['/badc/restricted']))
+        thread = threading.Thread(target=self.sidecar.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.sidecar.close)
+
+    def client_path_tools(self):
+        path_tools = PathTools(sidecar=self.socket_path, deferred=True, dir_cache_size=10)
+        self.addCleanup(path_tools.sidecar.close)
+        return path_tools
+
+    def test_client(self):
+        client = SidecarClient(self.socket_path)
+        self.addCleanup(client.close)
+
+        records = client.moles_records([CMIP5, '/badc/missing'])
+        self.assertEqual(records[0], self.owner.get_moles_record_metadata(CMIP5))
+        self.assertIsNone(records[1])
+
+        self.assertEqual(client.spots([f'{CMIP5}/file.nc', '/neodc/avhrr-3', '/other']), ['spot-1234-cmip5', 'spot-2345-avhrr', None])
+        self.assertEqual(client.allow_paths(['/badc/restricted/file.nc', f'{CMIP5}/file.nc']), [False, True])
+
+    def test_path_tools(self):
+        path_tools = self.client_path_tools()
+
+        path_tools.prefetch_moles_records([CMIP5, '/badc/missing'])
+        self.assertEqual(path_tools.sidecar_cache.info()['misses'], 2)
+
+        # Answered from the local cache
+        self.assertEqual(path_tools.get_moles_record_metadata(f'{CMIP5}/'), self.owner.get_moles_record_metadata(CMIP5))
+        self.assertIsNone(path_tools.get_moles_record_metadata('/badc/missing'))
+        self.assertEqual(path_tools.sidecar_cache.info()['hits'], 2)
+
+        self.assertEqual(path_tools.spots.get_spot(f'{CMIP5}/file.nc'), 'spot-1234-cmip5')
+        self.assertIsNone(path_tools._moles_mapping)
+
+        # Refreshing is left to the sidecar
+        self.assertTrue(path_tools.update_mapping())
+
+    def test_refresh(self):
+        path_tools = self.client_path_tools()
+        path_tools.get_moles_record_metadata(CMIP5)
+        self.assertEqual(len(path_tools.sidecar_cache), 1)
+
+        with patch.object(PathTools, 'update_mapping', return_value=True):
+            self.assertTrue(self.sidecar.refresh())
+
+        # The new generation is seen on the next request and the local caches are dropped
+        path_tools.get_moles_record_metadata('/badc/missing')
+        self.assertEqual(len(path_tools.sidecar_cache), 1)
+
+    def test_restart(self):
+        path_tools = self.client_path_tools()
+        path_tools.get_moles_record_metadata(CMIP5)
+
+        self.sidecar.close()
+        self.start_sidecar()
+
+        # The client reconnects and drops the results of the old sidecar
+        self.assertIsNone(path_tools.get_moles_record_metadata('/badc/missing'))
+        self.assertEqual(len(path_tools.sidecar_cache), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+from unittest.mock import patch
+
+from rabbit_indexer.utils import PathTools
+from rabbit_indexer.utils.snapshot import (
+    SnapshotExporter,
+    SnapshotLoader,
+    get_writer,
+    main,
+    read_snapshot_file,
+    snapshot_files,
+)
+
+
+def bulk_response(body, failed=()):
+    lines = body.splitlines()
+    items = []
+    for action, source in zip(lines[::2], lines[1::2]):
+        doc_id = json.loads(action)['index']['_id']
+        items.append({'index': {'_id': doc_id, 'status': 400 if doc_id in failed else 201}})
+    return {'items': items}
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        self.root = os.path.join(tmp_dir.name, 'archive')
+        self.output = os.path.join(tmp_dir.name, 'snapshot')
+
+        os.makedirs(os.path.join(self.root, 'badc', 'data', 'v1'))
+        os.makedirs(os.path.join(self.root, 'badc', 'docs'))
+        open(os.path.join(self.root, 'badc', 'data', 'v1', 'file.nc'), 'w').close()
+        os.symlink('data', os.path.join(self.root, 'badc', 'latest'))
+        os.symlink('data/v1/file.nc', os.path.join(self.root, 'badc', 'file.nc'))
+
+        self.mapping = {
+            os.path.join(self.root, 'badc', 'data'): {
+                'title': 'Dataset', 'url': 'https://catalogue.ceda.ac.uk/uuid/1', 'record_type': 'Dataset'
+            }
+        }
+
+        mapping_file = os.path.join(tmp_dir.name, 'mapping.json')
+        with open(mapping_file, 'w') as writer:
+            json.dump(self.mapping, writer)
+
+        self.config_file = os.path.join(tmp_dir.name, 'config.yml')
+        with open(self.config_file, 'w') as writer:
+            json.dump({'indexer': {}, 'moles': {}}, writer)
+
+        self.path_tools = PathTools(mapping_file=mapping_file, deferred=True)
+        self.addCleanup(self.path_tools.api_batcher.close)
+
+        # Paths which are not in the mapping are not looked up in the API
+        api = patch.object(PathTools, '_get_moles_record_metadata_data_from_api', return_value=None)
+        api.start()
+        self.addCleanup(api.stop)
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def export(self, snapshot_format, rows_per_file=2):
+        writer = get_writer(self.output, snapshot_format, rows_per_file=rows_per_file, batch_size=3)
+        stats = SnapshotExporter(self.path_tools, writer, workers=2).export([self.root])
+        writer.close()
+        return stats
+
+    def rows(self):
+        return {
+            row['path']: row
+            for path in snapshot_files(self.output)
+            for batch in read_snapshot_file(path)
+            for row in batch
+        }
+
+    def check_rows(self):
+        rows = self.rows()
+
+        # Directories and links to directories, but not files
+        self.assertEqual(set(rows), {
+            self.root, self.path('badc'), self.path('badc', 'data'), self.path('badc', 'data', 'v1'),
+            self.path('badc', 'docs'), self.path('badc', 'latest'),
+        })
+
+        data = rows[self.path('badc', 'data')]
+        self.assertEqual(data['id'], PathTools.generate_id(data['path']))
+        self.assertEqual(data['title'], 'Dataset')
+        self.assertFalse(data['link'])
+
+        latest = rows[self.path('badc', 'latest')]
+        self.assertTrue(latest['link'])
+        self.assertIsNone(latest['title'])
+
+    def test_ndjson(self):
+        stats = self.export('ndjson')
+        self.assertEqual(stats, {'directories': 5, 'links': 1, 'rows': 6})
+
+        with open(os.path.join(self.output, 'manifest.json')) as reader:
+            manifest = json.load(reader)
+
+        self.assertEqual(manifest['rows'], 6)
+        self.assertEqual([file['rows'] for file in manifest['files']], [2, 2, 2])
+        self.assertEqual(sorted(os.listdir(self.output))[-1], 'manifest.json')
+
+        self.check_rows()
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_parquet(self):
+        self.export('parquet', rows_per_file=4)
+        self.assertTrue(all(path.endswith('.parquet') for path in snapshot_files(self.output)))
+        self.check_rows()
+
+    def test_load(self):
+        self.export('ndjson')
+        rows = self.rows()
+
+        bodies = []
+        failed = {rows[self.path('badc', 'docs')]['id']}
+
+        def bulk(body):
+            bodies.append(body)
+            return bulk_response(body, failed)
+
+        stats = SnapshotLoader(bulk, workers=2, max_actions=1, max_retries=0).load(self.output)
+        self.assertEqual(stats, {'files': 3, 'actions': 5, 'failures': 1, 'retries': 0})
+
+        sources = {}
+        for body in bodies:
+            action, source = body.splitlines()
+            sources[json.loads(action)['index']['_id']] = json.loads(source)
+
+        data = rows[self.path('badc', 'data')]
+        self.assertEqual(sources[data['id']]['title'], 'Dataset')
+        self.assertNotIn('id', sources[data['id']])
+
+        # Fields without a value are left out
+        self.assertNotIn('title', sources[rows[self.path('badc', 'latest')]['id']])
+
+    @patch('rabbit_indexer.utils.path_tools.SpotMapping')
+    @patch('rabbit_indexer.utils.path_tools.generate_moles_mapping')
+    def test_main_export(self, mock_mapping, mock_spots):
+        mock_mapping.return_value = dict(self.mapping)
+        args = ['export', self.root, '--output', self.output, '--config', self.config_file, '--format', 'ndjson']
+
+        # The export waits for the MOLES mapping to load
+        thread = threading.Thread(target=main, args=(args,), daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+
+        self.check_rows()
+
+    def test_incomplete(self):
+        with self.assertRaises(FileNotFoundError):
+            snapshot_files(self.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+
+from rabbit_indexer.utils.spot_mapping import SpotMapping
+
+MAPPING = 'spot-1 /badc\nspot-2 /badc/cmip5/data\nspot-3 /neodc/avhrr-3/\n\n'
+
+
+class FakeResponse:
+
+    def __init__(self, status_code=200, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ValueError(self.status_code)
+
+
+class SpotMappingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_file = os.path.join(tmp_dir.name, 'spots.json')
+
+    def make_mapping(self, *responses):
+        with patch('requests.get', side_effect=list(responses)) as mock_get:
+            spots = SpotMapping('http://spots', cache_file=self.cache_file)
+        return spots, mock_get
+
+    def test_lookup(self):
+        spots, _ = self.make_mapping(FakeResponse(text=MAPPING))
+
+        self.assertEqual(len(spots), 3)
+        self.assertEqual(spots.get_archive_root('spot-3'), '/neodc/avhrr-3')
+        self.assertEqual(spots.get_spot('/badc/cmip5/data/file.nc'), 'spot-2')
+        self.assertEqual(spots.get_spot('/badc/cmip5/data'), 'spot-2')
+        self.assertEqual(spots.get_spot('/badc/cmip5/dat'), 'spot-1')
+        self.assertIsNone(spots.get_spot('/neodc/other'))
+
+    def test_spots_for(self):
+        spots, _ = self.make_mapping(FakeResponse(text=MAPPING))
+
+        paths = ['/badc/cmip5/data/a.nc', '/badc/cmip5/data/b.nc', '/neodc/avhrr-3', '/ukmo/file']
+        self.assertEqual(spots.spots_for(paths), ['spot-2', 'spot-2', 'spot-3', None])
+
+    def test_conditional_refresh(self):
+        spots, mock_get = self.make_mapping(FakeResponse(text=MAPPING, headers={'ETag': '"v1"'}))
+
+        # Loaded from the cache without a request
+        with patch('requests.get', return_value=FakeResponse(304)) as mock_get:
+            cached = SpotMapping('http://spots', cache_file=self.cache_file)
+            self.assertEqual(mock_get.call_count, 0)
+
+            self.assertFalse(cached.refresh())
+            self.assertEqual(mock_get.call_args[1]['headers'], {'If-None-Match': '"v1"'})
+
+        index = cached.spot_mapping
+        with patch('requests.get', return_value=FakeResponse(text='spot-4 /badc\n', headers={'ETag': '"v2"'})):
+            self.assertTrue(cached.refresh())
+
+        # The old index is untouched by the swap
+        self.assertEqual(len(index), 3)
+        self.assertEqual(cached.get_spot('/badc/cmip5/data/file.nc'), 'spot-4')
+
+    def test_empty_response(self):
+        spots, _ = self.make_mapping(FakeResponse(text=MAPPING))
+
+        with patch('requests.get', return_value=FakeResponse(text='')):
+            with self.assertRaises(ValueError):
+                spots.refresh()
+
+        self.assertEqual(len(spots), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+
+from rabbit_indexer.index_updaters.base import UpdateHandler
+from rabbit_indexer.index_updaters.subtree import SubtreeRemover
+from rabbit_indexer.queue_handler.queue_handler import IngestMessage
+from rabbit_indexer.utils import YamlConfig
+
+
+def message(path, action):
+    return IngestMessage('2021-02-08 12:00:00', path, action, '', '')
+
+
+class RecordingHandler(UpdateHandler):
+
+    def setup_extra(self, **kwargs):
+        self.setup_subtree_removal()
+        self.events = []
+        self.flushed = 0
+
+    def process_event(self, message):
+        self.events.append(message.filepath)
+
+    def flush(self):
+        self.flushed += 1
+
+
+class SubtreeRemoverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        # The archive root is deep enough to pass min_depth on its own
+        self.root = os.path.join(tmp_dir.name, 'archive')
+        os.makedirs(os.path.join(self.root, 'badc', 'cmip6'))
+
+        self.deleted = []
+        self.remover = SubtreeRemover(self.deleted.append, threshold=3, min_depth=self.remover_depth())
+
+    def remover_depth(self):
+        return SubtreeRemover.depth(self.root) + 1
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def test_rmdir(self):
+        # The highest missing ancestor is removed
+        self.assertTrue(self.remover.handle(message(self.path('neodc', 'avhrr', 'data'), 'RMDIR')))
+        self.assertEqual(self.deleted, [self.path('neodc')])
+
+        # Later events under the prefix are subsumed
+        self.assertTrue(self.remover.handle(message(self.path('neodc', 'avhrr', 'a.nc'), 'REMOVE')))
+        self.assertTrue(self.remover.handle(message(self.path('neodc'), 'RMDIR')))
+        self.assertFalse(self.remover.handle(message(self.path('neodc', 'b.nc'), 'DEPOSIT')))
+
+        self.assertEqual(self.remover.stats, {'removed': 1, 'subsumed': 2})
+
+    def test_recreated_prefix(self):
+        self.assertTrue(self.remover.handle(message(self.path('neodc', 'avhrr'), 'RMDIR')))
+
+        # Once the prefix exists again, removals below it are processed as usual
+        os.makedirs(self.path('neodc', 'avhrr'))
+        self.assertIsNone(self.remover.covers(self.path('neodc', 'avhrr', 'a.nc')))
+        self.assertFalse(self.remover.handle(message(self.path('neodc', 'avhrr', 'a.nc'), 'REMOVE')))
+
+        self.assertEqual(self.remover.stats, {'removed': 1, 'subsumed': 0})
+
+    def test_existing_directory(self):
+        # Recreated directories and removals from existing directories are left alone
+        self.assertFalse(self.remover.handle(message(self.path('badc', 'cmip6'), 'RMDIR')))
+
+        for i in range(5):
+            self.assertFalse(self.remover.handle(message(self.path('badc', 'cmip6', f'{i}.nc'), 'REMOVE')))
+
+        self.assertEqual(self.deleted, [])
+
+    def test_remove_burst(self):
+        results = [
+            self.remover.handle(message(self.path('neodc', 'avhrr', f'{i}.nc'), 'REMOVE'))
+            for i in range(4)
+        ]
+
+        self.assertEqual(results, [False, False, True, True])
+        self.assertEqual(self.deleted, [self.path('neodc')])
+
+    def test_min_depth(self):
+        remover = SubtreeRemover(self.deleted.append, min_depth=self.remover_depth() + 1)
+
+        # The missing directory is too close to the root
+        self.assertFalse(remover.handle(message(self.path('neodc'), 'RMDIR')))
+
+        # Only climbs as far as min_depth
+        self.assertTrue(remover.handle(message(self.path('neodc', 'avhrr', 'data'), 'RMDIR')))
+        self.assertEqual(self.deleted, [self.path('neodc', 'avhrr')])
+
+    @patch.object(UpdateHandler, '_delete_by_prefix')
+    def test_handler(self, mock_delete):
+        conf = YamlConfig()
+        conf.config = {
+            'indexer': {
+                'subtree_removal': {
+                    'min_depth': self.remover_depth(),
+                    'indices': [{'index': 'ceda-dirs'}, {'index': 'ceda-fbi', 'field': 'info.directory'}]
+                }
+            }
+        }
+        handler = RecordingHandler(conf)
+
+        self.assertTrue(handler.remove_subtree(message(self.path('neodc', 'avhrr'), 'RMDIR')))
+        self.assertEqual(handler.flushed, 1)
+        mock_delete.assert_any_call('ceda-dirs', 'path', self.path('neodc'))
+        mock_delete.assert_any_call('ceda-fbi', 'info.directory', self.path('neodc'))
+
+
+if __name__ == '__main__':
+    unittest.main()
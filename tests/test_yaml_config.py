@@ -0,0 +1,65 @@
+# encoding: utf-8
+"""
+
+"""
+__author__ = 'Richard Smith'
+__date__ = '19 Oct 2026'
+__copyright__ = 'Copyright 2018 United Kingdom Research and Innovation'
+__license__ = 'BSD - see LICENSE file in top-level package directory'
+__contact__ = 'richard.d.smith@stfc.ac.uk'
+
+import unittest
+import tempfile
+import os
+
+from rabbit_indexer.utils import YamlConfig
+from rabbit_indexer.utils.config_watcher import ConfigWatcher
+
+
+class YamlConfigReloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = os.path.join(self.tmpdir.name, 'base.yml')
+        self.override = os.path.join(self.tmpdir.name, 'override.yml')
+
+        self.write(self.base, 'logging:\n  log_level: info\nindexer:\n  refresh_interval: 30\n')
+        self.write(self.override, 'logging:\n  log_level: debug\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @staticmethod
+    def write(filename, content):
+        with open(filename, 'w') as writer:
+            writer.write(content)
+
+    def test_reload_merges_files(self):
+        conf = YamlConfig()
+        conf.read([self.base, self.override])
+
+        self.write(self.base, 'logging:\n  log_level: info\nindexer:\n  refresh_interval: 5\n')
+        new_conf = conf.reload()
+
+        self.assertEqual(new_conf.get('indexer', 'refresh_interval'), 5)
+        self.assertEqual(new_conf.get('logging', 'log_level'), 'debug')
+
+        # The original config is unchanged
+        self.assertEqual(conf.get('indexer', 'refresh_interval'), 30)
+
+    def test_watcher(self):
+        calls = []
+        watcher = ConfigWatcher([self.base, self.override], lambda: calls.append(1))
+
+        self.assertFalse(watcher.check())
+
+        stat = os.stat(self.base)
+        os.utime(self.base, (stat.st_atime, stat.st_mtime + 10))
+
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()